@@ -0,0 +1,129 @@
+"""
+Capacity of the LUNR storage nodes, gathered in the background.
+"""
+
+from time import time
+
+try:
+    from eventlet import sleep
+except ImportError:
+    from time import sleep
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrError
+from lunrdriver.lunr.compat import spawn_n
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.capacity')
+
+# the lunr account nodes are listed from
+ADMIN_CONTEXT = {'project_id': 'admin'}
+
+
+def node_free(node):
+    """
+    :returns: free GB of a node, from storage_free if Lunr has it or what's
+              left of the size after storage_used
+    """
+    free = node.get('storage_free')
+    if free is None:
+        free = node.get('size', 0) - node.get('storage_used', 0)
+    return max(free, 0)
+
+
+class CapacityMonitor(object):
+    """
+    Free and total GB of the ACTIVE Lunr nodes by volume type, listed every
+    `interval` seconds so get_volume_stats has them without asking Lunr.
+
+    Capacity older than `max_age` seconds is reported as 'unknown' rather
+    than steering the scheduler with numbers that might be long gone.
+    """
+
+    def __init__(self, clients, interval=60, max_age=300):
+        self.clients = clients
+        self.interval = interval
+        self.max_age = max_age
+        self.running = False
+        self.refreshes = 0
+        self.failures = 0
+        # when the last list of the nodes came back
+        self.updated = None
+        self.types = {}
+        self.total_gb = 0
+        self.free_gb = 0
+
+    def refresh(self):
+        """
+        List the nodes and total them up by volume type.
+        """
+        client = self.clients.get(ADMIN_CONTEXT)
+        nodes = client.nodes.list().body
+        types = {}
+        for node in nodes:
+            if node.get('status') != 'ACTIVE':
+                continue
+            capacity = types.setdefault(node.get('volume_type_name'), {
+                'nodes': 0, 'total_capacity_gb': 0, 'free_capacity_gb': 0})
+            capacity['nodes'] += 1
+            capacity['total_capacity_gb'] += node.get('size', 0)
+            capacity['free_capacity_gb'] += node_free(node)
+        # swapped in whole, readers never see half a refresh
+        self.types = types
+        self.total_gb = sum(c['total_capacity_gb'] for c in types.values())
+        self.free_gb = sum(c['free_capacity_gb'] for c in types.values())
+        self.updated = time()
+        self.refreshes += 1
+
+    def age(self):
+        if self.updated is None:
+            return None
+        return time() - self.updated
+
+    def stale(self):
+        age = self.age()
+        return age is None or age > self.max_age
+
+    def get(self):
+        """
+        :returns: (total GB, free GB) of the nodes, 'unknown' for both if
+                  the last refresh is too old
+        """
+        if self.stale():
+            return 'unknown', 'unknown'
+        return self.total_gb, self.free_gb
+
+    def _refresh_forever(self):
+        while self.running:
+            try:
+                self.refresh()
+            except LunrError, e:
+                self.failures += 1
+                LOG.warning('unable to list Lunr nodes: %s' % e)
+            except Exception:
+                self.failures += 1
+                LOG.exception('failed to refresh Lunr capacity')
+            sleep(self.interval)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        spawn_n(self._refresh_forever)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        return {
+            'age': self.age(),
+            'stale': self.stale(),
+            'max_age': self.max_age,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'types': self.types,
+        }
@@ -0,0 +1,240 @@
+"""
+Durable queue of LUNR snapshot deletes, drained in the background.
+"""
+
+import sqlite3
+from collections import deque
+from time import time
+
+try:
+    from eventlet import sleep
+    from eventlet.semaphore import Semaphore as Lock
+    from eventlet.tpool import execute
+except ImportError:
+    from threading import Lock
+    from time import sleep
+
+    def execute(func, *args):
+        return func(*args)
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrError
+from lunrdriver.lunr.compat import spawn_n
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.deletion')
+
+QUEUED = 'queued'
+DELETING = 'deleting'
+
+# backup statuses that mean Lunr is done deleting
+DONE = ('DELETED', 'AUDITING')
+
+# deletes sent at a time when there's no rate limit
+BATCH_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot_deletes (
+    snapshot_id TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    retry_at REAL NOT NULL DEFAULT 0
+)
+"""
+
+
+class DeleteQueue(object):
+    """
+    Snapshot deletes, persisted in a local sqlite database so they survive
+    restarts.
+
+    One greenthread sends queued deletes to Lunr at no more than `rate` a
+    second, or as fast as it can if `rate` is 0, another checks on the
+    ones Lunr is deleting every `confirm_interval` seconds, with one list
+    of backups per project. Deletes that fail are tried again, up to
+    `max_attempts` times.
+
+    Every commit waits on sqlite's fsync, so the database is only used
+    from the eventlet thread pool.
+    """
+
+    def __init__(self, path, clients, rate=5, confirm_interval=30,
+                 max_attempts=5, retry_backoff=60, window=300):
+        self.path = path
+        self.clients = clients
+        self.rate = rate
+        self.confirm_interval = confirm_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.window = window
+        self.running = False
+        self.completed = 0
+        self.failed = 0
+        self._completions = deque()
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._db.commit()
+
+    def _run(self, sql, args):
+        cursor = self._db.execute(sql, args)
+        self._db.commit()
+        return cursor.fetchall()
+
+    def _execute(self, sql, *args):
+        with self._lock:
+            return execute(self._run, sql, args)
+
+    def put(self, snapshot):
+        """
+        Queue up the delete of a snapshot.
+        """
+        self._execute(
+            'INSERT OR REPLACE INTO snapshot_deletes '
+            '(snapshot_id, project_id, state, enqueued_at) '
+            'VALUES (?, ?, ?, ?)',
+            snapshot['id'], snapshot['project_id'], QUEUED, time())
+
+    def _client(self, project_id):
+        return self.clients.get({'project_id': project_id})
+
+    def _done(self, snapshot_id):
+        self._execute('DELETE FROM snapshot_deletes WHERE snapshot_id = ?',
+                      snapshot_id)
+        self.completed += 1
+        self._completions.append(time())
+
+    def _retry(self, snapshot_id, attempts, reason):
+        attempts += 1
+        if attempts >= self.max_attempts:
+            LOG.error('giving up on deleting snapshot %s after %s '
+                      'attempts: %s' % (snapshot_id, attempts, reason))
+            self._execute('DELETE FROM snapshot_deletes '
+                          'WHERE snapshot_id = ?', snapshot_id)
+            self.failed += 1
+            return
+        LOG.warning('delete of snapshot %s failed, will retry: %s' %
+                    (snapshot_id, reason))
+        self._execute(
+            'UPDATE snapshot_deletes SET state = ?, attempts = ?, '
+            'retry_at = ? WHERE snapshot_id = ?',
+            QUEUED, attempts, time() + self.retry_backoff * attempts,
+            snapshot_id)
+
+    def delete_next(self, limit=None):
+        """
+        Send the next queued deletes to Lunr, `rate` a second.
+
+        :returns: number of deletes sent
+        """
+        if not limit:
+            limit = max(int(self.rate), 1) if self.rate > 0 else BATCH_SIZE
+        rows = self._execute(
+            'SELECT snapshot_id, project_id, attempts FROM snapshot_deletes '
+            'WHERE state = ? AND retry_at <= ? ORDER BY enqueued_at '
+            'LIMIT ?', QUEUED, time(), limit)
+        for snapshot_id, project_id, attempts in rows:
+            try:
+                self._client(project_id).backups.delete(snapshot_id)
+            except LunrError, e:
+                if e.code == 404:
+                    # already gone
+                    self._done(snapshot_id)
+                else:
+                    self._retry(snapshot_id, attempts, e)
+            else:
+                self._execute('UPDATE snapshot_deletes SET state = ? '
+                              'WHERE snapshot_id = ?', DELETING, snapshot_id)
+            if self.rate > 0:
+                sleep(1.0 / self.rate)
+        return len(rows)
+
+    def confirm(self):
+        """
+        Check on the snapshots Lunr is deleting.
+
+        :returns: number of deletes confirmed done
+        """
+        rows = self._execute(
+            'SELECT snapshot_id, project_id, attempts FROM snapshot_deletes '
+            'WHERE state = ?', DELETING)
+        projects = {}
+        for snapshot_id, project_id, attempts in rows:
+            projects.setdefault(project_id, {})[snapshot_id] = attempts
+        done = 0
+        for project_id, deleting in projects.items():
+            try:
+                backups = self._client(project_id).backups.list().body
+            except LunrError, e:
+                LOG.warning('unable to list backups of %s: %s' %
+                            (project_id, e))
+                continue
+            statuses = dict((b['id'], b['status']) for b in backups)
+            for snapshot_id, attempts in deleting.items():
+                status = statuses.get(snapshot_id)
+                if status is None or status in DONE:
+                    self._done(snapshot_id)
+                    done += 1
+                elif not status.endswith('ING'):
+                    self._retry(snapshot_id, attempts,
+                                'backup went %s' % status)
+        return done
+
+    def _delete_forever(self):
+        while self.running:
+            try:
+                if self.delete_next():
+                    continue
+            except Exception:
+                LOG.exception('snapshot delete queue failed')
+            sleep(1)
+
+    def _confirm_forever(self):
+        while self.running:
+            sleep(self.confirm_interval)
+            try:
+                self.confirm()
+            except Exception:
+                LOG.exception('snapshot delete confirmation failed')
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        spawn_n(self._delete_forever)
+        spawn_n(self._confirm_forever)
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    def drain_rate(self):
+        """
+        :returns: deletes completed per second over the last `window`
+                  seconds
+        """
+        cutoff = time() - self.window
+        while self._completions and self._completions[0] < cutoff:
+            self._completions.popleft()
+        return float(len(self._completions)) / self.window
+
+    def stats(self):
+        counts = dict(self._execute(
+            'SELECT state, COUNT(*) FROM snapshot_deletes GROUP BY state'))
+        return {
+            'queued': counts.get(QUEUED, 0),
+            'deleting': counts.get(DELETING, 0),
+            'completed': self.completed,
+            'failed': self.failed,
+            'drain_rate': self.drain_rate(),
+        }
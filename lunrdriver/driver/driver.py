@@ -2,7 +2,10 @@
 Driver for LUNR volumes.
 """
 
-from time import sleep
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from time import time
 from uuid import uuid4
 
 try:
@@ -12,20 +15,290 @@ except ImportError:
 
 from cinder import exception
 from cinder.volume.driver import VolumeDriver
-from cinder.volume import volume_types
 from cinder.context import get_admin_context
 try:
     from oslo_log import log as logging
 except ImportError:
     from cinder.openstack.common import log as logging
 
-from lunrdriver.lunr.client import LunrClient, LunrError
+from lunrdriver.driver.capacity import CapacityMonitor
+from lunrdriver.driver.deletion import DeleteQueue
+from lunrdriver.driver.exports import ExportRegistry
+from lunrdriver.driver.fairness import FairScheduler
+from lunrdriver.driver.imagecache import ImageCache
+from lunrdriver.driver.reconciler import Reconciler
+from lunrdriver.driver.restorecache import RestoreCache
+from lunrdriver.driver.speculative import SpeculativeExports
+from lunrdriver.driver.typesync import TypeSync
+from lunrdriver.driver.warmpool import WarmPool, parse_pools
+from lunrdriver.lunr.client import ClientRegistry, LunrError, \
+    JSON_BACKENDS, get_project_id, set_json_backend
+from lunrdriver.lunr import pool
+from lunrdriver.lunr.balancer import LoadBalancer
+from lunrdriver.lunr.breaker import CircuitBreaker
+from lunrdriver.lunr.bulk import BulkPolicy, BulkReport, BulkResult, run
+from lunrdriver.lunr.hedge import HedgePolicy
+from lunrdriver.lunr.push import CallbackListener, LongPoller
+from lunrdriver.lunr.ratelimit import RateLimiter
+from lunrdriver.lunr.resolver import resolver
+from lunrdriver.lunr.retry import RetryPolicy
+from lunrdriver.lunr.schedule import PollSchedule
+from lunrdriver.lunr.singleflight import SingleFlight
+from lunrdriver.lunr.timeouts import Deadline, Timeouts
+from lunrdriver.lunr.watcher import StatusWatcher
 from utils import initialize_connection
 
 
 lunr_opts = [
-    cfg.StrOpt('lunr_api_endpoint', default='http://127.0.0.1:8080/v1.0',
-               help='Lunr API endpoint'),
+    cfg.ListOpt('lunr_api_endpoint', default=['http://127.0.0.1:8080/v1.0'],
+                help='Lunr API endpoints, requests are balanced across all '
+                     'of them'),
+    cfg.StrOpt('lunr_api_balancer', default='least_outstanding',
+               choices=LoadBalancer.strategies,
+               help='How requests are spread across Lunr API endpoints'),
+    cfg.IntOpt('lunr_api_probe_interval', default=10,
+               help='Seconds between background probes of Lunr API '
+                    'endpoints that were taken out of rotation, 0 to only '
+                    'recover them with live traffic'),
+    cfg.StrOpt('lunr_json_backend', default='auto',
+               choices=('auto',) + JSON_BACKENDS,
+               help='Module used to decode Lunr API responses, auto picks '
+                    'the fastest one installed'),
+    cfg.IntOpt('lunr_pool_size', default=10,
+               help='Max idle keep-alive connections kept per Lunr '
+                    'endpoint'),
+    cfg.IntOpt('lunr_pool_idle_timeout', default=60,
+               help='Seconds an idle keep-alive connection is kept before '
+                    'it is closed'),
+    cfg.IntOpt('lunr_pool_max_requests', default=100,
+               help='Requests served by a keep-alive connection before it '
+                    'is closed'),
+    cfg.IntOpt('lunr_client_cache_size', default=1024,
+               help='Max number of per project Lunr clients kept by the '
+                    'driver'),
+    cfg.FloatOpt('lunr_connect_timeout', default=10,
+                 help='Seconds to wait on a connection to the Lunr API'),
+    cfg.FloatOpt('lunr_read_timeout', default=120,
+                 help='Seconds to wait on a response from the Lunr API'),
+    cfg.DictOpt('lunr_connect_timeouts', default={},
+                help='Connect timeout overrides keyed by resource, method '
+                     'or resource.method, e.g. volumes.GET:5,DELETE:10'),
+    cfg.DictOpt('lunr_read_timeouts', default={},
+                help='Read timeout overrides keyed by resource, method '
+                     'or resource.method, e.g. exports.PUT:300'),
+    cfg.IntOpt('lunr_operation_timeout', default=0,
+               help='Seconds a driver operation may spend on the Lunr API, '
+                    'including waiting on status, 0 for no limit'),
+    cfg.DictOpt('lunr_operation_timeouts', default={},
+                help='Operation timeout overrides keyed by driver method, '
+                     'e.g. create_cloned_volume:7200,delete_snapshot:600'),
+    cfg.IntOpt('lunr_retry_attempts', default=3,
+               help='Max tries for idempotent Lunr API requests that fail '
+                    'with a connection error or a 502, 503 or 504'),
+    cfg.FloatOpt('lunr_retry_backoff', default=0.5,
+                 help='Base seconds of the jittered exponential backoff '
+                      'between retries'),
+    cfg.FloatOpt('lunr_retry_max_backoff', default=10,
+                 help='Max seconds to sleep between two retries'),
+    cfg.FloatOpt('lunr_retry_budget', default=30,
+                 help='Max total seconds to sleep on retries of a request'),
+    cfg.IntOpt('lunr_breaker_window', default=60,
+               help='Seconds of requests the circuit breaker error rate is '
+                    'computed over'),
+    cfg.IntOpt('lunr_breaker_min_requests', default=20,
+               help='Requests in the window before the circuit breaker may '
+                    'open'),
+    cfg.FloatOpt('lunr_breaker_error_rate', default=0.5,
+                 help='Fraction of failed requests in the window that opens '
+                      'the circuit breaker'),
+    cfg.IntOpt('lunr_breaker_reset_timeout', default=30,
+               help='Seconds the circuit breaker stays open before trial '
+                    'requests are let through'),
+    cfg.IntOpt('lunr_breaker_trial_requests', default=3,
+               help='Successful trial requests needed to close the circuit '
+                    'breaker again'),
+    cfg.BoolOpt('lunr_hedge_enabled', default=False,
+                help='Send a second copy of GET requests that are slower '
+                     'than usual and use whichever answers first'),
+    cfg.FloatOpt('lunr_hedge_percentile', default=95,
+                 help='Percentile of recent GET latency after which a GET '
+                      'is hedged'),
+    cfg.FloatOpt('lunr_hedge_min_delay', default=0.05,
+                 help='Min seconds to wait on a GET before hedging it'),
+    cfg.FloatOpt('lunr_hedge_max_rate', default=0.1,
+                 help='Max fraction of GET requests that may be hedged'),
+    cfg.FloatOpt('lunr_status_watch_interval', default=1,
+                 help='Max seconds between checks for volumes and snapshots '
+                      'that are due a status poll, all waiters share the '
+                      'polls. 0 to have every waiter poll on its own'),
+    cfg.IntOpt('lunr_status_watch_list_threshold', default=5,
+               help='Min volumes or snapshots of a project waited on at once '
+                    'before their polls share a list of the whole project, '
+                    'fewer are fetched one at a time'),
+    cfg.StrOpt('lunr_status_push', default='none',
+               choices=('none', 'long_poll', 'callback'),
+               help='Have Lunr tell us about status changes instead of '
+                    'polling for them, with long polling GETs or callbacks '
+                    'to a listener in the driver. Falls back to polling if '
+                    'Lunr does not support it'),
+    cfg.IntOpt('lunr_long_poll_timeout', default=30,
+               help='Seconds Lunr may hold on to a long polling GET'),
+    cfg.StrOpt('lunr_status_callback_host', default='0.0.0.0',
+               help='Address to listen on for Lunr status callbacks'),
+    cfg.IntOpt('lunr_status_callback_port', default=0,
+               help='Port to listen on for Lunr status callbacks, 0 for any '
+                    'free port'),
+    cfg.StrOpt('lunr_status_callback_advertise', default=None,
+               help='Address Lunr can reach the status callback listener '
+                    'on, defaults to the listen address or hostname'),
+    cfg.BoolOpt('lunr_async_clone', default=False,
+                help='Return from clones, restores from snapshots and '
+                     'creates from images as soon as Lunr accepts them, '
+                     'and set the volume available or error in the '
+                     'background once Lunr is done. Until then Cinder may '
+                     'show the volume available, attaching or cloning it '
+                     'waits for Lunr to finish it'),
+    cfg.IntOpt('lunr_async_clone_concurrency', default=20,
+               help='Max volumes the background reconciler waits on at '
+                    'once'),
+    cfg.BoolOpt('lunr_coalesce_gets', default=True,
+                help='Identical GET requests in flight at the same time '
+                     'share one request to the Lunr API'),
+    cfg.StrOpt('lunr_snapshot_delete_queue', default=None,
+               help='Path of a local database to queue snapshot deletes in, '
+                    'delete_snapshot returns once the delete is queued and '
+                    'Lunr is told about it in the background'),
+    cfg.FloatOpt('lunr_snapshot_delete_rate', default=5,
+                 help='Max queued snapshot deletes sent to Lunr per '
+                      'second, 0 for no limit'),
+    cfg.IntOpt('lunr_snapshot_delete_confirm_interval', default=30,
+               help='Seconds between checks on the snapshots Lunr is '
+                    'deleting'),
+    cfg.IntOpt('lunr_snapshot_delete_attempts', default=5,
+               help='Times a queued snapshot delete is tried before giving '
+                    'up on it'),
+    cfg.BoolOpt('lunr_image_cache', default=False,
+                help='Keep golden Lunr volumes of images and clone volumes '
+                     'created from an image off of them'),
+    cfg.IntOpt('lunr_image_cache_max_count', default=50,
+               help='Max golden volumes kept by the image cache'),
+    cfg.IntOpt('lunr_image_cache_max_gb', default=1000,
+               help='Max GB of golden volumes kept by the image cache'),
+    cfg.BoolOpt('lunr_restore_cache', default=False,
+                help='Keep a restored Lunr volume of snapshots that are '
+                     'restored a lot and clone volumes created from them '
+                     'off of it'),
+    cfg.IntOpt('lunr_restore_cache_threshold', default=3,
+               help='Restores of a snapshot within the window that make it '
+                    'worth keeping a restored volume of'),
+    cfg.IntOpt('lunr_restore_cache_window', default=3600,
+               help='Seconds restores of a snapshot are counted over'),
+    cfg.IntOpt('lunr_restore_cache_ttl', default=3600,
+               help='Seconds a restored volume is kept without being used'),
+    cfg.IntOpt('lunr_restore_cache_max_count', default=20,
+               help='Max restored volumes kept by the restore cache'),
+    cfg.IntOpt('lunr_restore_cache_max_gb', default=2000,
+               help='Max GB of restored volumes kept by the restore cache'),
+    cfg.ListOpt('lunr_warm_pool', default=[],
+                help='volume_type:size pairs to keep empty Lunr volumes of '
+                     'ready for create_volume to claim'),
+    cfg.StrOpt('lunr_warm_pool_project', default='lunr-warm-pool',
+               help='Lunr account warm pool volumes are kept in'),
+    cfg.IntOpt('lunr_warm_pool_min', default=1,
+               help='Min volumes kept in each warm pool'),
+    cfg.IntOpt('lunr_warm_pool_max', default=10,
+               help='Max volumes kept in each warm pool'),
+    cfg.IntOpt('lunr_warm_pool_lead_time', default=300,
+               help='Seconds of creates at the recent create rate each '
+                    'warm pool holds volumes for'),
+    cfg.IntOpt('lunr_warm_pool_refill_interval', default=10,
+               help='Seconds between top ups of the warm pools'),
+    cfg.BoolOpt('lunr_export_registry', default=True,
+                help='Remember the connection info of exports and reuse it '
+                     'when initialize_connection is called again for the '
+                     'same volume and connector'),
+    cfg.IntOpt('lunr_export_registry_ttl', default=30,
+               help='Seconds remembered connection info is reused without '
+                    'checking the export is still there'),
+    cfg.BoolOpt('lunr_speculative_exports', default=False,
+                help='Export volumes likely to be booted from as soon as '
+                     'Lunr has them ready, ahead of initialize_connection'),
+    cfg.StrOpt('lunr_speculative_export_hint', default='boot',
+               help='Volume metadata key that marks a volume as about to '
+                    'be booted from'),
+    cfg.BoolOpt('lunr_speculative_export_images', default=True,
+                help='Treat every volume created from an image as about to '
+                     'be booted from'),
+    cfg.IntOpt('lunr_speculative_export_timeout', default=600,
+               help='Seconds before an export made ahead of time that '
+                    'nobody used is deleted'),
+    cfg.StrOpt('lunr_speculative_export_acl', default='127.0.0.1',
+               help='IP exports made ahead of time are restricted to until '
+                    'initialize_connection binds them to the connector, '
+                    'Lunr opens an export without one to every initiator'),
+    cfg.IntOpt('lunr_volume_type_sync_interval', default=3600,
+               help='Seconds between syncs of the Cinder volume types with '
+                    'the Lunr types after the one on startup, 0 to only '
+                    'sync on startup'),
+    cfg.BoolOpt('lunr_volume_type_sync_remove', default=False,
+                help='Destroy the Cinder volume types of types that are no '
+                     'longer active in Lunr, instead of just reporting '
+                     'them'),
+    cfg.IntOpt('lunr_capacity_interval', default=60,
+               help='Seconds between lists of the Lunr nodes for the '
+                    'capacity get_volume_stats reports, 0 to report '
+                    'infinite capacity'),
+    cfg.IntOpt('lunr_capacity_max_age', default=300,
+               help='Seconds the capacity of the Lunr nodes is reported '
+                    'for after it was listed, after that it is unknown'),
+    cfg.FloatOpt('lunr_rate_limit_reads', default=0,
+                 help='Max GETs a second to each Lunr endpoint, other than '
+                      'polls for a status, 0 for no limit'),
+    cfg.FloatOpt('lunr_rate_limit_writes', default=0,
+                 help='Max PUTs, POSTs and DELETEs a second to each Lunr '
+                      'endpoint, 0 for no limit'),
+    cfg.FloatOpt('lunr_rate_limit_polls', default=0,
+                 help='Max GETs a second polling for a status from each Lunr '
+                      'endpoint, 0 for no limit'),
+    cfg.IntOpt('lunr_rate_limit_burst', default=10,
+               help='Requests of a rate limited kind that may go to an '
+                    'endpoint at once after a quiet spell'),
+    cfg.FloatOpt('lunr_rate_limit_max_wait', default=10,
+                 help='Max seconds a request over the rate limit waits '
+                      'before failing, 0 to fail right away'),
+    cfg.BoolOpt('lunr_fair_scheduler', default=False,
+                help='Queue driver operations by project when they are more '
+                     'than lunr_fair_scheduler_slots, so no one project can '
+                     'take up the whole driver'),
+    cfg.IntOpt('lunr_fair_scheduler_slots', default=20,
+               help='Max driver operations running at once with the fair '
+                    'scheduler on'),
+    cfg.IntOpt('lunr_fair_scheduler_reserved_slots', default=4,
+               help='Fair scheduler slots only initialize_connection, '
+                    'terminate_connection, attach_volume and detach_volume '
+                    'may use, so they never wait behind creates and '
+                    'deletes'),
+    cfg.StrOpt('lunr_fair_scheduler_policy', default='round_robin',
+               choices=('round_robin', 'weighted'),
+               help='Serve the queued projects in turn, or by the weights '
+                    'in lunr_fair_scheduler_weights'),
+    cfg.DictOpt('lunr_fair_scheduler_weights', default={},
+                help='project_id:weight pairs, projects not listed weigh 1'),
+    cfg.IntOpt('lunr_bulk_concurrency', default=10,
+               help='Max requests to Lunr at once for the volumes of bulk '
+                    'terminate_connections and detach_volumes'),
+    cfg.IntOpt('lunr_dns_ttl', default=300,
+               help='Seconds storage node addresses are cached for'),
+    cfg.IntOpt('lunr_dns_negative_ttl', default=30,
+               help='Seconds failed storage node lookups are cached for'),
+    cfg.FloatOpt('lunr_dns_timeout', default=2,
+                 help='Seconds to wait on a storage node lookup before '
+                      'passing the hostname through'),
+    cfg.IntOpt('lunr_dns_workers', default=4,
+               help='Max storage node lookups running at once'),
+    cfg.BoolOpt('lunr_dns_prefetch', default=False,
+                help='Look storage nodes seen before up again in the '
+                     'background before their addresses expire'),
 ]
 
 
@@ -33,6 +306,28 @@ LOG = logging.getLogger('cinder.volume.driver.lunr')
 CONF = cfg.CONF
 
 
+def scheduled(index=0, name='volume'):
+    """
+    Run a driver operation through the fair scheduler if there is one.
+
+    :param index: of the positional argument the project_id is taken from
+    :param name: of the argument if it's passed by keyword
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.scheduler:
+                return func(self, *args, **kwargs)
+            if len(args) > index:
+                project_id = get_project_id(args[index])
+            else:
+                project_id = get_project_id(kwargs[name])
+            with self.scheduler.slot(project_id, func.__name__):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class LunrDriver(VolumeDriver):
     """Executes commands relating to Volumes."""
 
@@ -40,6 +335,184 @@ class LunrDriver(VolumeDriver):
         super(LunrDriver, self).__init__(*args, **kwargs)
         self.configuration.append_config_values(lunr_opts)
         self.url = self.configuration.lunr_api_endpoint
+        # connection pools are shared by every client in the process
+        pool.manager.configure(
+            size=self.configuration.lunr_pool_size,
+            idle_timeout=self.configuration.lunr_pool_idle_timeout,
+            max_requests=self.configuration.lunr_pool_max_requests)
+        set_json_backend(self.configuration.lunr_json_backend)
+        # so is the resolver of storage node hostnames
+        resolver.configure(
+            ttl=self.configuration.lunr_dns_ttl,
+            negative_ttl=self.configuration.lunr_dns_negative_ttl,
+            timeout=self.configuration.lunr_dns_timeout,
+            workers=self.configuration.lunr_dns_workers)
+        timeouts = Timeouts(
+            connect=self.configuration.lunr_connect_timeout,
+            read=self.configuration.lunr_read_timeout,
+            connect_overrides=self.configuration.lunr_connect_timeouts,
+            read_overrides=self.configuration.lunr_read_timeouts)
+        self.retry_policy = RetryPolicy(
+            attempts=self.configuration.lunr_retry_attempts,
+            backoff=self.configuration.lunr_retry_backoff,
+            max_backoff=self.configuration.lunr_retry_max_backoff,
+            budget=self.configuration.lunr_retry_budget)
+
+        def breaker_factory():
+            return CircuitBreaker(
+                window=self.configuration.lunr_breaker_window,
+                min_requests=self.configuration.lunr_breaker_min_requests,
+                error_rate=self.configuration.lunr_breaker_error_rate,
+                reset_timeout=self.configuration.lunr_breaker_reset_timeout,
+                trial_requests=self.configuration.lunr_breaker_trial_requests)
+        self.endpoints = LoadBalancer(
+            self.url, strategy=self.configuration.lunr_api_balancer,
+            breaker_factory=breaker_factory)
+        self.hedge_policy = None
+        if self.configuration.lunr_hedge_enabled:
+            self.hedge_policy = HedgePolicy(
+                percentile=self.configuration.lunr_hedge_percentile,
+                min_delay=self.configuration.lunr_hedge_min_delay,
+                max_rate=self.configuration.lunr_hedge_max_rate)
+        self.single_flight = None
+        if self.configuration.lunr_coalesce_gets:
+            self.single_flight = SingleFlight()
+        # how long waits on Lunr take is learned across all projects
+        self.poll_schedule = PollSchedule()
+        self.watcher = None
+        if self.configuration.lunr_status_watch_interval > 0:
+            self.watcher = StatusWatcher(
+                interval=self.configuration.lunr_status_watch_interval,
+                list_threshold=(
+                    self.configuration.lunr_status_watch_list_threshold))
+        self.status_push = None
+        if self.configuration.lunr_status_push == 'long_poll':
+            self.status_push = LongPoller(
+                timeout=self.configuration.lunr_long_poll_timeout)
+        elif self.configuration.lunr_status_push == 'callback':
+            self.status_push = CallbackListener(
+                host=self.configuration.lunr_status_callback_host,
+                port=self.configuration.lunr_status_callback_port,
+                advertise=self.configuration.lunr_status_callback_advertise)
+        self.rate_limiter = None
+        rates = {
+            'reads': self.configuration.lunr_rate_limit_reads,
+            'writes': self.configuration.lunr_rate_limit_writes,
+            'polls': self.configuration.lunr_rate_limit_polls,
+        }
+        if any(rate > 0 for rate in rates.values()):
+            self.rate_limiter = RateLimiter(
+                rates, burst=self.configuration.lunr_rate_limit_burst,
+                max_wait=self.configuration.lunr_rate_limit_max_wait)
+        self.bulk_policy = BulkPolicy(
+            concurrency=self.configuration.lunr_bulk_concurrency)
+        self.clients = ClientRegistry(
+            self.endpoints, logger=LOG,
+            max_size=self.configuration.lunr_client_cache_size,
+            timeouts=timeouts, retry_policy=self.retry_policy,
+            hedge_policy=self.hedge_policy, single_flight=self.single_flight,
+            watcher=self.watcher, poll_schedule=self.poll_schedule,
+            status_push=self.status_push, bulk_policy=self.bulk_policy,
+            rate_limiter=self.rate_limiter)
+        self.reconciler = None
+        if self.configuration.lunr_async_clone:
+            self.reconciler = Reconciler(
+                self.db, self.clients,
+                concurrency=self.configuration.lunr_async_clone_concurrency)
+        self.delete_queue = None
+        if self.configuration.lunr_snapshot_delete_queue:
+            self.delete_queue = DeleteQueue(
+                self.configuration.lunr_snapshot_delete_queue, self.clients,
+                rate=self.configuration.lunr_snapshot_delete_rate,
+                confirm_interval=(
+                    self.configuration.lunr_snapshot_delete_confirm_interval),
+                max_attempts=self.configuration.lunr_snapshot_delete_attempts)
+        self.image_cache = None
+        if self.configuration.lunr_image_cache:
+            self.image_cache = ImageCache(
+                self.clients,
+                max_count=self.configuration.lunr_image_cache_max_count,
+                max_gb=self.configuration.lunr_image_cache_max_gb)
+        self.restore_cache = None
+        if self.configuration.lunr_restore_cache:
+            self.restore_cache = RestoreCache(
+                self.clients,
+                max_count=self.configuration.lunr_restore_cache_max_count,
+                max_gb=self.configuration.lunr_restore_cache_max_gb,
+                threshold=self.configuration.lunr_restore_cache_threshold,
+                window=self.configuration.lunr_restore_cache_window,
+                ttl=self.configuration.lunr_restore_cache_ttl)
+        self.type_sync = TypeSync(
+            self.clients,
+            interval=self.configuration.lunr_volume_type_sync_interval,
+            remove=self.configuration.lunr_volume_type_sync_remove,
+            deadline=lambda: self._deadline('check_for_setup_error'))
+        self.scheduler = None
+        if self.configuration.lunr_fair_scheduler:
+            self.scheduler = FairScheduler(
+                slots=self.configuration.lunr_fair_scheduler_slots,
+                policy=self.configuration.lunr_fair_scheduler_policy,
+                weights=self.configuration.lunr_fair_scheduler_weights,
+                reserved=self.configuration.lunr_fair_scheduler_reserved_slots)
+        self.capacity = None
+        if self.configuration.lunr_capacity_interval > 0:
+            self.capacity = CapacityMonitor(
+                self.clients,
+                interval=self.configuration.lunr_capacity_interval,
+                max_age=self.configuration.lunr_capacity_max_age)
+        self.exports = None
+        if self.configuration.lunr_export_registry:
+            self.exports = ExportRegistry(
+                ttl=self.configuration.lunr_export_registry_ttl)
+        self.speculative_exports = None
+        if self.configuration.lunr_speculative_exports:
+            self.speculative_exports = SpeculativeExports(
+                self.clients,
+                timeout=self.configuration.lunr_speculative_export_timeout,
+                acl_ip=self.configuration.lunr_speculative_export_acl)
+        self.warm_pool = None
+        if self.configuration.lunr_warm_pool:
+            self.warm_pool = WarmPool(
+                self.clients, self.configuration.lunr_warm_pool_project,
+                parse_pools(self.configuration.lunr_warm_pool),
+                min_size=self.configuration.lunr_warm_pool_min,
+                max_size=self.configuration.lunr_warm_pool_max,
+                lead_time=self.configuration.lunr_warm_pool_lead_time,
+                refill_interval=(
+                    self.configuration.lunr_warm_pool_refill_interval))
+
+    def _deadline(self, operation):
+        """
+        Get a Deadline for a driver operation, or None if it has no limit.
+        """
+        timeout = self.configuration.lunr_operation_timeouts.get(
+            operation, self.configuration.lunr_operation_timeout)
+        timeout = float(timeout)
+        if timeout > 0:
+            return Deadline(timeout)
+        return None
+
+    def do_setup(self, context):
+        interval = self.configuration.lunr_api_probe_interval
+        if interval > 0:
+            self.endpoints.start_probing(interval)
+        if isinstance(self.status_push, CallbackListener):
+            self.status_push.start()
+        if self.delete_queue:
+            # picks up whatever was queued before a restart
+            self.delete_queue.start()
+        if self.warm_pool:
+            self.warm_pool.start()
+        if self.configuration.lunr_dns_prefetch:
+            resolver.configure(prefetch=True)
+        if self.speculative_exports:
+            self.speculative_exports.start()
+        if self.image_cache:
+            self.image_cache.start()
+        if self.restore_cache:
+            self.restore_cache.start()
+        if self.capacity:
+            self.capacity.start()
 
     def update_migrated_volume(self, ctxt, volume, new_volume,
                                original_volume_status=None):
@@ -54,7 +527,7 @@ class LunrDriver(VolumeDriver):
         return updates
 
     def _create_volume(self, volume, snapshot=None, source=None,
-                       image_id=None):
+                       image_id=None, deadline=None):
         model_update = {}
         model_update_meta = {}
         affinity = None
@@ -94,17 +567,31 @@ class LunrDriver(VolumeDriver):
             params['name'] = v
             params['force_node'] = CONF.host
 
-        # Make the Rest Call
-        client = LunrClient(self.url, volume, logger=LOG)
-        try:
-            resp = client.volumes.create(lunr_id, **params)
-        except LunrError as e:
-            if e.code == 409:
-                lunr_id = str(uuid4())
-                resp = client.volumes.create(lunr_id, **params)
+        resp = None
+        if self.warm_pool and not (snapshot or source or image_id or
+                                   affinity or 'force_node' in params):
+            claimed = self.warm_pool.claim(volume, volume_type_name,
+                                           deadline=deadline)
+            if claimed:
+                lunr_id, resp = claimed
                 model_update['_name_id'] = lunr_id
-            else:
-                raise
+
+        if not resp:
+            # Make the Rest Call
+            client = self.clients.get(volume)
+            try:
+                resp = client.volumes.create(lunr_id, deadline=deadline,
+                                             **params)
+            except LunrError as e:
+                if e.code != 409:
+                    raise
+                resp = self._created_already(client, lunr_id, params,
+                                             deadline)
+                if not resp:
+                    lunr_id = str(uuid4())
+                    resp = client.volumes.create(lunr_id, deadline=deadline,
+                                                 **params)
+                    model_update['_name_id'] = lunr_id
 
         if resp.body['size'] != volume['size']:
             model_update['size'] = resp.body['size']
@@ -118,9 +605,49 @@ class LunrDriver(VolumeDriver):
             model_update['metadata'] = model_update_meta
         return model_update
 
+    def _created_already(self, client, lunr_id, params, deadline):
+        """
+        A create that got a 409 may have been a retry of one that made it
+        to Lunr, the first reply lost on the way back. If the volume that's
+        there has our name it's the one we asked for.
+
+        :returns: the response of a GET on the volume if it's ours, or None
+        """
+        try:
+            resp = client.volumes.get(lunr_id, deadline=deadline)
+        except LunrError, e:
+            if e.code != 404:
+                raise
+            return None
+        if resp.body.get('name') != params['name']:
+            return None
+        return resp
+
+    @scheduled()
     def create_volume(self, volume):
         """Call the Lunr API to request a volume """
-        return self._create_volume(volume)
+        model_update = self._create_volume(
+            volume, deadline=self._deadline('create_volume'))
+        self._speculate(volume, model_update)
+        return model_update
+
+    def _speculate(self, volume, model_update, image=False):
+        """
+        Export the volume ahead of time if it looks like it's about to be
+        booted from.
+        """
+        if not self.speculative_exports:
+            return
+        hint = self.configuration.lunr_speculative_export_hint
+        hinted = any(meta.key == hint
+                     for meta in volume.get('volume_metadata') or [])
+        if image and self.configuration.lunr_speculative_export_images:
+            hinted = True
+        if not hinted:
+            return
+        volume_id = self._lookup_volume_id(volume, model_update)
+        self.speculative_exports.prepare(volume, volume_id,
+                                         ('ACTIVE', 'IMAGING_SCRUB'))
 
     def _lookup_volume_id(self, volume, model_update=None):
         if model_update and model_update.get('_name_id'):
@@ -129,44 +656,128 @@ class LunrDriver(VolumeDriver):
             return volume['_name_id']
         return volume['id']
 
+    def _wait_for_create(self, volume, model_update, statuses, deadline):
+        """
+        Wait for Lunr to get a volume it accepted into one of statuses, or
+        leave that to the reconciler if we're async.
+        """
+        volume_id = self._lookup_volume_id(volume, model_update)
+        if self.reconciler:
+            self.reconciler.track(volume, volume_id, statuses,
+                                  deadline=deadline)
+            return
+        client = self.clients.get(volume)
+        client.volumes.wait_on_status(volume_id, *statuses,
+                                      deadline=deadline, size=volume['size'])
+
+    def _wait_for_reconciler(self, volume, deadline):
+        """
+        Cinder has the volumes the reconciler hasn't gotten to available,
+        wait for Lunr to finish the volume before it's used.
+        """
+        if not self.reconciler:
+            return
+        volume_id = self._lookup_volume_id(volume)
+        job = self.reconciler.pending(volume_id)
+        if not job:
+            return
+        client = self.clients.get(volume)
+        client.volumes.wait_on_status(volume_id, *job.statuses,
+                                      deadline=deadline, size=job.size)
+
+    @scheduled()
     def create_cloned_volume(self, volume, src_vref):
         """Call the Lunr API to request a clone """
-        model_update = self._create_volume(volume, source=src_vref)
+        deadline = self._deadline('create_cloned_volume')
+        self._wait_for_reconciler(src_vref, deadline)
+        model_update = self._create_volume(volume, source=src_vref,
+                                           deadline=deadline)
 
         # Wait until the volume is ACTIVE
-        client = LunrClient(self.url, volume, logger=LOG)
-        volume_id = self._lookup_volume_id(volume, model_update)
-        client.volumes.wait_on_status(volume_id, 'ACTIVE')
+        self._wait_for_create(volume, model_update, ('ACTIVE',), deadline)
 
+        self._speculate(volume, model_update)
         return model_update
 
+    def _clone_cached(self, cache, volume, source, deadline):
+        """
+        Clone the volume off of a volume in cache made from source, the
+        image or snapshot the volume is created from.
+
+        :returns: model_update, or None if there's no cached volume to use
+        """
+        try:
+            volume_type_name = volume['volume_type']['name']
+        except (KeyError, TypeError):
+            return None
+        cached_id = cache.lookup(volume, volume_type_name, source)
+        if not cached_id:
+            return None
+        try:
+            model_update = self._create_volume(
+                volume, source={'id': cached_id}, deadline=deadline)
+        except LunrError, e:
+            if e.code != 404:
+                raise
+            # somebody deleted it out from under us
+            cache.discard(cached_id)
+            return None
+        self._wait_for_create(volume, model_update, ('ACTIVE',), deadline)
+        return model_update
+
+    @scheduled()
     def create_volume_from_snapshot(self, volume, snapshot):
         """Call the Lunr API to request a snapshot"""
-        model_update = self._create_volume(volume, snapshot=snapshot)
+        deadline = self._deadline('create_volume_from_snapshot')
+        if self.restore_cache:
+            model_update = self._clone_cached(self.restore_cache, volume,
+                                              snapshot, deadline)
+            if model_update is not None:
+                self._speculate(volume, model_update)
+                return model_update
+        model_update = self._create_volume(volume, snapshot=snapshot,
+                                           deadline=deadline)
 
         # Wait until the snapshot is ACTIVE
-        client = LunrClient(self.url, volume, logger=LOG)
-        volume_id = self._lookup_volume_id(volume, model_update)
-        client.volumes.wait_on_status(volume_id, 'ACTIVE')
+        self._wait_for_create(volume, model_update, ('ACTIVE',), deadline)
 
+        self._speculate(volume, model_update)
         return model_update
 
+    @scheduled(1)
     def clone_image(self, context, volume,
                     image_location, image_meta, image_service):
-        model_update = self._create_volume(volume, image_id=image_meta['id'])
+        deadline = self._deadline('clone_image')
+        if self.image_cache:
+            model_update = self._clone_cached(self.image_cache, volume,
+                                              image_meta, deadline)
+            if model_update is not None:
+                self._speculate(volume, model_update, image=True)
+                return model_update, True
+        model_update = self._create_volume(volume, image_id=image_meta['id'],
+                                           deadline=deadline)
 
         # Wait until the snapshot is ACTIVE
-        client = LunrClient(self.url, volume, logger=LOG)
-        volume_id = self._lookup_volume_id(volume, model_update)
-        client.volumes.wait_on_status(volume_id, 'ACTIVE', 'IMAGING_SCRUB')
+        self._wait_for_create(volume, model_update,
+                              ('ACTIVE', 'IMAGING_SCRUB'), deadline)
 
+        self._speculate(volume, model_update, image=True)
         return model_update, True
 
+    @scheduled()
     def delete_volume(self, volume):
         try:
-            client = LunrClient(self.url, volume, logger=LOG)
+            client = self.clients.get(volume)
             volume_id = self._lookup_volume_id(volume)
-            client.volumes.delete(volume_id)
+            deadline = self._deadline('delete_volume')
+            if self.exports:
+                self.exports.invalidate(volume_id)
+            if self.speculative_exports:
+                # lunr won't delete a volume that's exported
+                if not self.speculative_exports.discard(volume_id):
+                    self.speculative_exports.remove_leftover(
+                        client, volume_id, deadline=deadline)
+            client.volumes.delete(volume_id, deadline=deadline)
         except LunrError, e:
             # ignore Not Found on delete
             if e.code != 404:
@@ -181,6 +792,7 @@ class LunrDriver(VolumeDriver):
         """Removes an export for a logical volume."""
         pass
 
+    @scheduled(name='snapshot')
     def create_snapshot(self, snapshot):
         """Creates a snapshot."""
         try:
@@ -191,20 +803,33 @@ class LunrDriver(VolumeDriver):
             LOG.error(msg)
             raise exception.VolumeDriverException(message=msg)
 
-        client = LunrClient(self.url, snapshot, logger=LOG)
+        deadline = self._deadline('create_snapshot')
+        self._wait_for_reconciler(volume, deadline)
+        client = self.clients.get(snapshot)
         volume_id = self._lookup_volume_id(volume)
         params = {
             'volume': volume_id
         }
-        client.backups.create(snapshot['id'], **params)
-        client.backups.wait_on_status(snapshot['id'], 'AVAILABLE')
+        client.backups.create(snapshot['id'], deadline=deadline, **params)
+        client.backups.wait_on_status(snapshot['id'], 'AVAILABLE',
+                                      deadline=deadline,
+                                      size=snapshot.get('volume_size'))
 
+    @scheduled(name='snapshot')
     def delete_snapshot(self, snapshot):
-        client = LunrClient(self.url, snapshot, logger=LOG)
+        if self.restore_cache:
+            self.restore_cache.discard_snapshot(snapshot['id'])
+        if self.delete_queue:
+            self.delete_queue.put(snapshot)
+            return
+        deadline = self._deadline('delete_snapshot')
+        client = self.clients.get(snapshot)
         try:
-            client.backups.delete(snapshot['id'])
+            client.backups.delete(snapshot['id'], deadline=deadline)
             client.backups.wait_on_status(snapshot['id'],
-                                          'DELETED', 'AUDITING')
+                                          'DELETED', 'AUDITING',
+                                          deadline=deadline,
+                                          size=snapshot.get('volume_size'))
         except LunrError, e:
             # ignore Not Found on delete_snapshot. Don't wait on status.
             if e.code == 404:
@@ -215,76 +840,178 @@ class LunrDriver(VolumeDriver):
         """
         Runs once on startup of the manager, good a time as any to hit lunr and
         make sure cinder's got the types in the db.
+
+        The types are synced in the background so startup doesn't wait on
+        Lunr.
         """
-        lunr_admin_context = {'project_id': 'admin'}
-        max_attempts = 3
-        attempt = 0
-        while True:
-            attempt += 1
-            try:
-                client = LunrClient(self.url, lunr_admin_context, logger=LOG)
-                resp = client.types.list()
-            except Exception:
-                if attempt >= max_attempts:
-                    LOG.error('Unable up to read volume types from Lunr '
-                              'after %s attempts.' % attempt)
-                    return
-                LOG.exception('failed attempt %s to retrieve volume types '
-                              'from %s, will retry.' % (attempt, self.url))
-                sleep(attempt ** 2)
-            else:
-                LOG.info('successfully pulled volume types from Lunr')
-                break
-        context = get_admin_context()
-        for vtype in resp.body:
-            if vtype['status'] != 'ACTIVE':
-                LOG.debug('ignoring type %s with status %s' % (
-                    vtype['name'], vtype['status']))
-                continue
-            try:
-                volume_types.create(context, vtype['name'])
-                LOG.info('volume type %s successfully created' % vtype['name'])
-            except exception.VolumeTypeExists:
-                LOG.info('volume type %s already exists' % vtype['name'])
+        self.type_sync.start()
 
     def ensure_export(self, context, volume):
         """Synchronously recreates an export for a logical volume."""
         # TODO: recreate export if needed?
         pass
 
+    @scheduled()
     def initialize_connection(self, volume, connector, initiator_data=None):
         """Create export and return connection info."""
-        client = LunrClient(self.url, volume, logger=LOG)
+        client = self.clients.get(volume)
         volume_id = self._lookup_volume_id(volume)
-        return initialize_connection(client, volume_id, connector)
+        deadline = self._deadline('initialize_connection')
+        self._wait_for_reconciler(volume, deadline)
+        if self.exports:
+            info = self.exports.get(client, volume_id, connector,
+                                    deadline=deadline)
+            if info:
+                return info
+        info = None
+        if self.speculative_exports:
+            info = self.speculative_exports.claim(client, volume_id,
+                                                  connector,
+                                                  deadline=deadline)
+        if not info:
+            info = initialize_connection(client, volume_id, connector,
+                                         deadline=deadline)
+        if self.exports:
+            self.exports.put(volume_id, connector, info)
+        return info
 
+    @scheduled()
     def terminate_connection(self, volume, connector, force=False):
         """Delete lunr export."""
-        client = LunrClient(self.url, volume, logger=LOG)
+        client = self.clients.get(volume)
         initiator = connector.get('initiator')
         volume_id = self._lookup_volume_id(volume)
-        client.exports.delete(volume_id, force=force, initiator=initiator)
+        if self.exports:
+            self.exports.invalidate(volume_id)
+        if self.speculative_exports:
+            self.speculative_exports.discard(volume_id, delete=False)
+        client.exports.delete(volume_id, force=force, initiator=initiator,
+                              deadline=self._deadline('terminate_connection'))
 
+    @contextmanager
+    def _slot(self, project_id, operation):
+        """
+        Hold a fair scheduler slot for project_id if there's a scheduler,
+        for the bulk operations that span projects.
+        """
+        if not self.scheduler:
+            yield
+            return
+        with self.scheduler.slot(project_id, operation):
+            yield
+
+    def _bulk(self, groups, func):
+        """
+        Run func on each group of volumes, groups at once.
+
+        :param groups: OrderedDict of a key to a list of (lunr volume id,
+                       cinder volume) pairs
+        :param func: called with a key and the lunr volume ids of it's
+                     group, returns a BulkReport by lunr volume id
+        :returns: a BulkReport by cinder volume id
+        """
+        start = time()
+        keys = groups.keys()
+        report = run(lambda key: func(key, [volume_id for volume_id, volume
+                                            in groups[key]]),
+                     keys, concurrency=self.bulk_policy.concurrency)
+        results = []
+        for key, group_result in zip(keys, report.results):
+            for i, (volume_id, volume) in enumerate(groups[key]):
+                if group_result.ok:
+                    result = group_result.resp.results[i]
+                    result.key = volume['id']
+                else:
+                    # the whole group failed
+                    result = BulkResult(volume['id'],
+                                        error=group_result.error,
+                                        latency=group_result.latency)
+                results.append(result)
+        return BulkReport(results, time() - start)
+
+    def terminate_connections(self, pairs, force=False):
+        """
+        Delete the lunr exports of many (volume, connector) pairs, as when a
+        compute host is evacuated.
+
+        Each project's exports are deleted in a fair scheduler slot of
+        its own, like terminate_connection.
+
+        :returns: a BulkReport by cinder volume id
+        """
+        deadline = self._deadline('terminate_connection')
+        groups = OrderedDict()
+        for volume, connector in pairs:
+            volume_id = self._lookup_volume_id(volume)
+            if self.exports:
+                self.exports.invalidate(volume_id)
+            if self.speculative_exports:
+                self.speculative_exports.discard(volume_id, delete=False)
+            key = (get_project_id(volume), connector.get('initiator'))
+            groups.setdefault(key, []).append((volume_id, volume))
+
+        def terminate(key, volume_ids):
+            project_id, initiator = key
+            client = self.clients.get({'project_id': project_id})
+            with self._slot(project_id, 'terminate_connection'):
+                return client.exports.delete_many(volume_ids, force=force,
+                                                  initiator=initiator,
+                                                  deadline=deadline)
+        return self._bulk(groups, terminate)
+
+    @scheduled(1)
     def attach_volume(self, context, volume, instance_uuid, host_name,
                       mountpoint):
         """Update lunr export metadata."""
-        client = LunrClient(self.url, volume, logger=LOG)
+        client = self.clients.get(volume)
         volume_id = self._lookup_volume_id(volume)
         client.exports.update(volume_id, instance_id=instance_uuid,
-                              mountpoint=mountpoint, status='ATTACHED')
+                              mountpoint=mountpoint, status='ATTACHED',
+                              deadline=self._deadline('attach_volume'))
 
+    @scheduled(1)
     def detach_volume(self, context, volume, attachment=None):
         """Update lunr export metadata."""
-        client = LunrClient(self.url, volume, logger=LOG)
+        client = self.clients.get(volume)
         volume_id = self._lookup_volume_id(volume)
-        client.exports.update(volume['id'], instance_id=None)
+        if self.exports:
+            self.exports.invalidate(volume_id)
+        client.exports.update(volume['id'], instance_id=None,
+                              deadline=self._deadline('detach_volume'))
+
+    def detach_volumes(self, context, volumes):
+        """
+        Update the lunr export metadata of many volumes, as when an
+        instance with many volumes is torn down.
+
+        Each project's exports are updated in a fair scheduler slot of
+        its own, like detach_volume.
+
+        :returns: a BulkReport by cinder volume id
+        """
+        deadline = self._deadline('detach_volume')
+        groups = OrderedDict()
+        for volume in volumes:
+            if self.exports:
+                self.exports.invalidate(self._lookup_volume_id(volume))
+            groups.setdefault(get_project_id(volume), []).append(
+                (volume['id'], volume))
+
+        def detach(project_id, volume_ids):
+            client = self.clients.get({'project_id': project_id})
+            with self._slot(project_id, 'detach_volume'):
+                return client.exports.update_many(volume_ids,
+                                                  instance_id=None,
+                                                  deadline=deadline)
+        return self._bulk(groups, detach)
 
     def accept_transfer(self, context, volume, new_user, new_project):
         if new_project == volume['project_id']:
             return
-        client = LunrClient(self.url, volume, logger=LOG)
+        client = self.clients.get(volume)
         volume_id = self._lookup_volume_id(volume)
-        client.volumes.update(volume_id, account_id=new_project)
+        client.volumes.update(volume_id, account_id=new_project,
+                              deadline=self._deadline('accept_transfer'))
 
     def get_volume_stats(self, refresh=False):
         """
@@ -300,6 +1027,46 @@ class LunrDriver(VolumeDriver):
                  'storage_protocol': 'lunr',
                  'total_capacity_gb': 'infinite',
                  'vendor_name': 'Rackspace',
-                 'volume_backend_name': 'lunr'
+                 'volume_backend_name': 'lunr',
+                 'connection_pool': pool.manager.stats(),
+                 'client_registry': self.clients.stats(),
+                 'retries': self.retry_policy.stats(),
+                 'endpoints': self.endpoints.stats(),
+                 'resolver': resolver.stats(),
+                 'bulk': self.bulk_policy.stats(),
+                 'type_sync': self.type_sync.stats(),
                 }
+        if self.rate_limiter:
+            stats['rate_limits'] = self.rate_limiter.stats()
+        if self.scheduler:
+            stats['scheduler'] = self.scheduler.stats()
+        if self.capacity:
+            # whatever the last refresh found, this never waits on Lunr
+            total_gb, free_gb = self.capacity.get()
+            stats['total_capacity_gb'] = total_gb
+            stats['free_capacity_gb'] = free_gb
+            stats['capacity'] = self.capacity.stats()
+        if self.hedge_policy:
+            stats['hedging'] = self.hedge_policy.stats()
+        if self.single_flight:
+            stats['coalescing'] = self.single_flight.stats()
+        if self.watcher:
+            stats['status_watcher'] = self.watcher.stats()
+        stats['status_times'] = self.poll_schedule.stats()
+        if self.status_push:
+            stats['status_push'] = self.status_push.stats()
+        if self.reconciler:
+            stats['reconciler'] = self.reconciler.stats()
+        if self.delete_queue:
+            stats['snapshot_deletes'] = self.delete_queue.stats()
+        if self.image_cache:
+            stats['image_cache'] = self.image_cache.stats()
+        if self.restore_cache:
+            stats['restore_cache'] = self.restore_cache.stats()
+        if self.warm_pool:
+            stats['warm_pool'] = self.warm_pool.stats()
+        if self.exports:
+            stats['exports'] = self.exports.stats()
+        if self.speculative_exports:
+            stats['speculative_exports'] = self.speculative_exports.stats()
         return stats
@@ -0,0 +1,112 @@
+"""
+Registry of the LUNR exports initialize_connection already set up.
+"""
+
+from collections import OrderedDict
+from copy import deepcopy
+from time import time
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrError
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.exports')
+
+
+class Export(object):
+
+    def __init__(self, info):
+        self.info = info
+        self.checked = time()
+
+
+class ExportRegistry(object):
+    """
+    Connection info by (lunr volume id, connector ip), so initialize
+    connection can skip the export create and hostname lookup when nova
+    retries or reattaches.
+
+    Lunr binds the export of a volume to one connector ip at a time, so
+    only the info of the last connector a volume was exported to is kept.
+    Info younger than `ttl` seconds is handed out as is, older info is
+    checked with a GET of the export first. Past `max_size` entries the
+    least recently used are dropped.
+    """
+
+    def __init__(self, ttl=60, max_size=4096):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.validated = 0
+        self.misses = 0
+        self.invalidations = 0
+        # oldest used first
+        self._exports = OrderedDict()
+
+    def get(self, client, volume_id, connector, deadline=None):
+        """
+        :returns: connection info, or None if the export has to be made
+        """
+        key = (volume_id, connector.get('ip'))
+        export = self._exports.pop(key, None)
+        if not export:
+            self.misses += 1
+            return None
+        if time() - export.checked > self.ttl:
+            try:
+                resp = client.exports.get(volume_id, deadline=deadline)
+            except LunrError, e:
+                if e.code != 404:
+                    LOG.warning('unable to check export of %s: %s' %
+                                (volume_id, e))
+                self.misses += 1
+                return None
+            target_name = resp.body.get('target_name')
+            if target_name and \
+                    target_name != export.info['data']['target_iqn']:
+                self.misses += 1
+                return None
+            ip = resp.body.get('ip')
+            if ip and ip != key[1]:
+                # bound to some other connector since
+                self.misses += 1
+                return None
+            export.checked = time()
+            self.validated += 1
+        else:
+            self.hits += 1
+        # most recently used goes last
+        self._exports[key] = export
+        return deepcopy(export.info)
+
+    def put(self, volume_id, connector, info):
+        # the export was just bound to this connector, any other one of
+        # the volume's is stale
+        self.invalidate(volume_id, count=False)
+        key = (volume_id, connector.get('ip'))
+        self._exports[key] = Export(deepcopy(info))
+        while len(self._exports) > self.max_size:
+            self._exports.popitem(last=False)
+
+    def invalidate(self, volume_id, count=True):
+        """
+        Forget every export of a volume.
+        """
+        for key in self._exports.keys():
+            if key[0] == volume_id:
+                del self._exports[key]
+                if count:
+                    self.invalidations += 1
+
+    def stats(self):
+        return {
+            'size': len(self._exports),
+            'hits': self.hits,
+            'validated': self.validated,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
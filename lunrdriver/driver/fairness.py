@@ -0,0 +1,217 @@
+"""
+Fair sharing of the driver between projects.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from time import time
+
+try:
+    from eventlet.semaphore import Semaphore as Lock
+except ImportError:
+    from threading import Lock
+
+from lunrdriver.lunr.compat import Queue
+from lunrdriver.lunr.schedule import Histogram
+
+
+# operations somebody is waiting on right now, they go before the rest
+LATENCY_SENSITIVE = frozenset([
+    'initialize_connection',
+    'terminate_connection',
+    'attach_volume',
+    'detach_volume',
+])
+
+# upper bounds of the wait time histogram buckets, in seconds
+WAIT_BOUNDS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class ProjectQueue(object):
+
+    def __init__(self, project_id, weight=1.0):
+        self.project_id = project_id
+        self.weight = weight
+        # (arrival, waiter) by priority, latency sensitive first
+        self.waiting = (deque(), deque())
+        # virtual time of the project, the least served go first
+        self.passes = 0.0
+        self.running = 0
+        self.served = 0
+        self.waits = Histogram(bounds=WAIT_BOUNDS)
+
+    def depth(self):
+        return len(self.waiting[0]) + len(self.waiting[1])
+
+    def stats(self):
+        stats = self.waits.stats()
+        return {
+            'queued': self.depth(),
+            'running': self.running,
+            'served': self.served,
+            'weight': self.weight,
+            'mean_wait': stats['mean'],
+            'wait': stats['buckets'],
+        }
+
+
+class FairScheduler(object):
+    """
+    Lets at most `slots` driver operations run at once, and when they're
+    all taken queues the rest by project.
+
+    Free slots go to latency sensitive operations first, and within a
+    priority to the project that got the least of them for it's weight, so
+    projects are served round robin when they all weigh the same. Projects
+    not in `weights` weigh 1, with the 'round_robin' policy weights are
+    ignored. Past `max_projects` the idle projects are forgotten.
+
+    Operations like create_volume hold their slot while they wait on Lunr,
+    so `reserved` of the slots are kept for the latency sensitive ones
+    that would otherwise queue up behind them.
+    """
+
+    def __init__(self, slots=20, policy='round_robin', weights=None,
+                 max_projects=1024, reserved=0):
+        if policy not in ('round_robin', 'weighted'):
+            raise ValueError('unknown scheduling policy %s' % policy)
+        if not 0 <= reserved < slots:
+            raise ValueError('reserved slots must be fewer than the %s '
+                             'slots' % slots)
+        self.slots = slots
+        self.reserved = reserved
+        self.policy = policy
+        self.weights = dict((project_id, float(weight)) for
+                            project_id, weight in (weights or {}).items())
+        self.max_projects = max_projects
+        self.running = 0
+        # by priority
+        self._running = [0, 0]
+        self._arrivals = 0
+        self._projects = {}
+        self._lock = Lock()
+
+    def _project(self, project_id):
+        queue = self._projects.get(project_id)
+        if not queue:
+            weight = 1.0
+            if self.policy == 'weighted':
+                weight = self.weights.get(project_id, 1.0)
+            if len(self._projects) >= self.max_projects:
+                self._forget_idle()
+            queue = self._projects[project_id] = ProjectQueue(project_id,
+                                                              weight)
+        if not queue.depth() and not queue.running:
+            # idle projects don't get to bank time
+            active = [q.passes for q in self._projects.values()
+                      if q.depth() or q.running]
+            if active:
+                queue.passes = max(queue.passes, min(active))
+        return queue
+
+    def _forget_idle(self):
+        for project_id, queue in self._projects.items():
+            if not queue.depth() and not queue.running:
+                del self._projects[project_id]
+
+    def _free(self, priority):
+        """
+        :returns: True if there's a slot for an operation of priority
+        """
+        if self.running >= self.slots:
+            return False
+        return priority == 0 or \
+            self._running[priority] < self.slots - self.reserved
+
+    def _next(self):
+        """
+        :returns: the ProjectQueue and priority of the next waiter
+        """
+        for priority in (0, 1):
+            if not self._free(priority):
+                continue
+            queues = [q for q in self._projects.values()
+                      if q.waiting[priority]]
+            if queues:
+                # ties go to whoever has been waiting longest
+                return min(queues, key=lambda q: (
+                    q.passes, q.waiting[priority][0][0])), priority
+        return None, None
+
+    def _grant(self, queue, priority):
+        queue.passes += 1.0 / queue.weight
+        queue.running += 1
+        queue.served += 1
+        self.running += 1
+        self._running[priority] += 1
+
+    def acquire(self, project_id, operation):
+        start = time()
+        priority = 0 if operation in LATENCY_SENSITIVE else 1
+        with self._lock:
+            queue = self._project(project_id)
+            # freed slots are handed straight to waiters, so there are
+            # none waiting while a slot they could have is free
+            if self._free(priority):
+                self._grant(queue, priority)
+                queue.waits.add(0.0)
+                return
+            waiter = Queue()
+            self._arrivals += 1
+            entry = (self._arrivals, waiter)
+            queue.waiting[priority].append(entry)
+        # whoever releases a slot hands it to us
+        woken = False
+        try:
+            waiter.get()
+            woken = True
+        finally:
+            if not woken:
+                self._abandon(queue, priority, entry, operation)
+        queue.waits.add(time() - start)
+
+    def _abandon(self, queue, priority, entry, operation):
+        """
+        Take a waiter that was killed out of the queue.
+        """
+        with self._lock:
+            try:
+                queue.waiting[priority].remove(entry)
+                return
+            except ValueError:
+                # the slot was handed to it on the way out
+                pass
+        self.release(queue.project_id, operation)
+
+    def release(self, project_id, operation):
+        priority = 0 if operation in LATENCY_SENSITIVE else 1
+        with self._lock:
+            self._projects[project_id].running -= 1
+            self.running -= 1
+            self._running[priority] -= 1
+            queue, priority = self._next()
+            if queue:
+                self._grant(queue, priority)
+                arrival, waiter = queue.waiting[priority].popleft()
+                waiter.put(True)
+
+    @contextmanager
+    def slot(self, project_id, operation):
+        """
+        Wait for a slot to run operation for project_id in.
+        """
+        self.acquire(project_id, operation)
+        try:
+            yield
+        finally:
+            self.release(project_id, operation)
+
+    def stats(self):
+        return {
+            'slots': self.slots,
+            'reserved': self.reserved,
+            'running': self.running,
+            'queued': sum(q.depth() for q in self._projects.values()),
+            'projects': dict((project_id, q.stats()) for project_id, q in
+                             self._projects.items()),
+        }
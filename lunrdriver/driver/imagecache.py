@@ -0,0 +1,104 @@
+"""
+Cache of golden LUNR volumes to clone image volumes from.
+"""
+
+from hashlib import md5
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.driver.volumecache import Entry, VolumeCache
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.imagecache')
+
+# lunr volume names of golden volumes are PREFIX<image id>-<version hash>
+PREFIX = 'image-cache-'
+
+
+def image_version(image_meta):
+    """
+    Something that changes when the image does.
+    """
+    version = image_meta.get('checksum') or image_meta.get('updated_at')
+    return md5(str(version)).hexdigest()[:8]
+
+
+def golden_name(image_id, version):
+    return '%s%s-%s' % (PREFIX, image_id, version)
+
+
+def parse_golden_name(name):
+    """
+    :returns: (image id, version), or None if it's not a golden volume
+    """
+    if not name or not name.startswith(PREFIX):
+        return None
+    image_id, sep, version = name[len(PREFIX):].rpartition('-')
+    if not sep:
+        return None
+    return image_id, version
+
+
+class ImageCache(VolumeCache):
+    """
+    Golden Lunr volumes with an image on them, to clone new volumes of the
+    image from instead of copying it out of glance again.
+
+    There's one golden volume per (project, volume type, image). The first
+    volume of an image is made the usual way while a golden volume is built
+    in the background, later ones big enough to hold it are cloned. Golden
+    volumes that don't match the image anymore are thrown out, past the
+    limits the least recently used are deleted.
+    """
+
+    prefix = PREFIX
+
+    def __init__(self, clients, max_count=50, max_gb=1000):
+        super(ImageCache, self).__init__(clients, max_count=max_count,
+                                         max_gb=max_gb)
+        self.invalidations = 0
+
+    def _adopt_entry(self, project_id, volume):
+        parsed = parse_golden_name(volume['name'])
+        if not parsed:
+            return None
+        image_id, version = parsed
+        key = (project_id, volume.get('volume_type_name'), image_id)
+        return Entry(key, volume['id'], volume['size'], version=version,
+                     ready=True)
+
+    def lookup(self, volume, volume_type_name, image_meta):
+        """
+        Find a golden volume to clone the volume from, starts building one
+        if there isn't any.
+
+        :returns: the lunr id of the golden volume, or None on a miss
+        """
+        project_id = volume['project_id']
+        key = (project_id, volume_type_name, image_meta['id'])
+        version = image_version(image_meta)
+        self._adopt(project_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.version != version:
+                LOG.info('image %s changed, dropping golden volume %s' %
+                         (image_meta['id'], entry.volume_id))
+                self.invalidations += 1
+                self._evict(entry)
+                entry = None
+            if entry and entry.ready and entry.size <= volume['size']:
+                return self._hit(entry)
+            self.misses += 1
+            if not entry:
+                self._add(key, golden_name(image_meta['id'], version),
+                          volume['size'], version=version,
+                          image_id=image_meta['id'])
+        return None
+
+    def stats(self):
+        stats = super(ImageCache, self).stats()
+        stats['invalidations'] = self.invalidations
+        return stats
@@ -0,0 +1,170 @@
+"""
+Background completion of LUNR volume creates the driver returned early from.
+"""
+
+try:
+    from eventlet import sleep
+    from eventlet.queue import LightQueue as Queue
+except ImportError:
+    from Queue import Queue
+    from time import sleep
+
+from cinder.context import get_admin_context
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrError, StatusError
+from lunrdriver.lunr.compat import spawn_n
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.reconciler')
+
+
+class Job(object):
+
+    def __init__(self, volume, lunr_id, statuses, deadline=None):
+        self.volume = volume
+        self.volume_id = volume['id']
+        self.size = volume.get('size')
+        self.lunr_id = lunr_id
+        self.statuses = statuses
+        self.deadline = deadline
+
+
+class Reconciler(object):
+    """
+    Wait for Lunr to finish volumes and tell Cinder how they turned out.
+
+    Cinder marks a volume available as soon as the driver returns, so once
+    Cinder is done with it a volume Lunr is still building is put back to
+    creating, and set to available or error when Lunr is done. At most
+    `concurrency` volumes are waited on at once, the rest queue up.
+
+    Until the reconciler gets to a volume it's available in Cinder while
+    Lunr may still be building it, so whoever uses a volume should check
+    `pending` first.
+    """
+
+    def __init__(self, db, clients, concurrency=20, flow_timeout=60):
+        self.db = db
+        self.clients = clients
+        self.concurrency = concurrency
+        self.flow_timeout = flow_timeout
+        self.queue = Queue()
+        # by lunr id, until they're reconciled
+        self._jobs = {}
+        self.workers = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def track(self, volume, lunr_id, statuses=('ACTIVE',), deadline=None):
+        """
+        Queue up a volume that Lunr accepted but hasn't finished.
+
+        :param volume: the cinder volume
+        :param lunr_id: the id of the volume in Lunr
+        :param statuses: Lunr statuses that mean it's done
+        :param deadline: optional Deadline on the whole thing
+        """
+        job = Job(volume, lunr_id, statuses, deadline=deadline)
+        self._jobs[lunr_id] = job
+        self.queue.put(job)
+        if self.workers < self.concurrency:
+            self.workers += 1
+            spawn_n(self._work)
+
+    def _work(self):
+        try:
+            while True:
+                job = self.queue.get()
+                self.running += 1
+                try:
+                    self.reconcile(job)
+                except Exception:
+                    LOG.exception('failed to reconcile volume %s' %
+                                  job.volume_id)
+                finally:
+                    self.running -= 1
+                    if self._jobs.get(job.lunr_id) is job:
+                        del self._jobs[job.lunr_id]
+        finally:
+            self.workers -= 1
+
+    def pending(self, lunr_id):
+        """
+        :returns: the Job of a volume Lunr may not have finished yet, or
+                  None
+        """
+        return self._jobs.get(lunr_id)
+
+    def _set_status(self, context, volume_id, status):
+        """
+        Set the status of the volume, unless somebody attached, deleted or
+        otherwise moved it on since we last looked.
+
+        :returns: True if the status was set
+        """
+        current = self.db.volume_get(context, volume_id)['status']
+        if current not in ('creating', 'available'):
+            LOG.warning('volume %s went %s while Lunr was finishing it, '
+                        'not setting it %s' % (volume_id, current, status))
+            return False
+        self.db.volume_update(context, volume_id, {'status': status})
+        return True
+
+    def _wait_for_flow(self, context, volume_id):
+        """
+        Wait for Cinder to be done creating the volume, which it considers
+        available once the driver returned.
+
+        :returns: the status Cinder gave the volume
+        """
+        waited = 0
+        while True:
+            status = self.db.volume_get(context, volume_id)['status']
+            if status != 'creating' or waited >= self.flow_timeout:
+                return status
+            sleep(1)
+            waited += 1
+
+    def reconcile(self, job):
+        context = get_admin_context()
+        client = self.clients.get(job.volume)
+        status = self._wait_for_flow(context, job.volume_id)
+        if status not in ('available', 'creating'):
+            LOG.warning('volume %s went %s before Lunr finished it, leaving '
+                        'it alone' % (job.volume_id, status))
+            return
+        # whether we put it back to creating, and so owe it available
+        creating = False
+        try:
+            resp = client.volumes.get(job.lunr_id, deadline=job.deadline)
+            if resp.body['status'] not in job.statuses:
+                # not ready for anyone to use yet
+                creating = self._set_status(context, job.volume_id,
+                                            'creating')
+                client.volumes.wait_on_status(job.lunr_id, *job.statuses,
+                                              deadline=job.deadline,
+                                              size=job.size)
+        except (LunrError, StatusError), e:
+            LOG.error('Lunr failed to finish volume %s: %s' %
+                      (job.volume_id, e))
+            self.failed += 1
+            self._set_status(context, job.volume_id, 'error')
+            return
+        self.completed += 1
+        if creating:
+            self._set_status(context, job.volume_id, 'available')
+        LOG.info('Lunr finished volume %s' % job.volume_id)
+
+    def stats(self):
+        return {
+            'queued': self.queue.qsize(),
+            'pending': len(self._jobs),
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
@@ -0,0 +1,137 @@
+"""
+Cache of restored LUNR volumes of hot snapshots.
+"""
+
+from collections import deque
+from time import time
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.driver.volumecache import Entry, VolumeCache
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.restorecache')
+
+# lunr volume names of restored volumes are PREFIX<snapshot id>
+PREFIX = 'restore-cache-'
+
+
+class RestoreCache(VolumeCache):
+    """
+    A restored Lunr volume per snapshot that gets restored a lot, to clone
+    new volumes of the snapshot from instead of restoring it from backup
+    storage again.
+
+    A snapshot restored `threshold` times within `window` seconds is hot,
+    and gets a volume restored from it in the background. Restored volumes
+    not used for `ttl` seconds are deleted, past the limits the ones used
+    the least often are. Lookups expire them as they go, and so does the
+    sweep every quarter of the `ttl`, so a cache nobody looks in doesn't
+    hold on to them.
+    """
+
+    prefix = PREFIX
+
+    def __init__(self, clients, max_count=20, max_gb=2000, threshold=3,
+                 window=3600, ttl=3600):
+        super(RestoreCache, self).__init__(clients, max_count=max_count,
+                                           max_gb=max_gb)
+        self.threshold = threshold
+        self.window = window
+        self.ttl = ttl
+        self.sweep_interval = max(ttl / 4.0, 1)
+        self.expirations = 0
+        # when snapshots that aren't hot yet were restored
+        self._restores = {}
+
+    def _adopt_entry(self, project_id, volume):
+        snapshot_id = volume['name'][len(PREFIX):]
+        key = (project_id, volume.get('volume_type_name'), snapshot_id)
+        # ttl decides if it's still wanted
+        return Entry(key, volume['id'], volume['size'], ready=True)
+
+    def _expire(self, now):
+        for entry in self._entries.values():
+            if entry.ready and now - entry.last_used > self.ttl:
+                LOG.info('restored volume %s of snapshot %s went cold' %
+                         (entry.volume_id, entry.key[2]))
+                self.expirations += 1
+                self._evict(entry)
+        cutoff = now - self.window
+        for key, restores in self._restores.items():
+            while restores and restores[0] < cutoff:
+                restores.popleft()
+            if not restores:
+                del self._restores[key]
+
+    def expire(self):
+        """
+        Delete the restored volumes that went cold.
+        """
+        with self._lock:
+            self._expire(time())
+
+    def sweep(self):
+        # so what's adopted expires too
+        self.adopt_all()
+        self.expire()
+        super(RestoreCache, self).sweep()
+
+    def _victim(self, ready):
+        now = time()
+
+        def frequency(entry):
+            return entry.uses / max(now - entry.created, 1.0)
+        # the least often used, least recently used on ties
+        return min(ready, key=frequency)
+
+    def lookup(self, volume, volume_type_name, snapshot):
+        """
+        Find a restored volume to clone the volume from, starts restoring
+        one if the snapshot just got hot.
+
+        :returns: the lunr id of the restored volume, or None on a miss
+        """
+        project_id = volume['project_id']
+        key = (project_id, volume_type_name, snapshot['id'])
+        now = time()
+        self._adopt(project_id)
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry and entry.ready and entry.size <= volume['size']:
+                return self._hit(entry)
+            self.misses += 1
+            if entry:
+                return None
+            restores = self._restores.setdefault(key, deque())
+            restores.append(now)
+            if len(restores) >= self.threshold:
+                del self._restores[key]
+                size = snapshot.get('volume_size') or volume['size']
+                LOG.info('snapshot %s is hot, restoring a volume of it to '
+                         'clone from' % snapshot['id'])
+                self._add(key, PREFIX + snapshot['id'], size,
+                          backup=snapshot['id'])
+        return None
+
+    def discard_snapshot(self, snapshot_id):
+        """
+        Drop the restored volumes of a snapshot that's going away.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.key[2] == snapshot_id:
+                    self._evict(entry)
+            for key in self._restores.keys():
+                if key[2] == snapshot_id:
+                    del self._restores[key]
+
+    def stats(self):
+        stats = super(RestoreCache, self).stats()
+        stats['expirations'] = self.expirations
+        stats['tracked'] = len(self._restores)
+        return stats
@@ -0,0 +1,245 @@
+"""
+Exports made ahead of initialize_connection for volumes about to be booted.
+"""
+
+from time import time
+
+try:
+    from eventlet import sleep
+except ImportError:
+    from time import sleep
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.driver.utils import connection_info
+from lunrdriver.lunr.client import LunrError, StatusError
+from lunrdriver.lunr.compat import spawn_n
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.speculative')
+
+
+class Speculation(object):
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.info = None
+        self.created = time()
+        # connector ip of an initialize_connection that came in while the
+        # export was being made
+        self.claimed_ip = None
+
+
+class SpeculativeExports(object):
+    """
+    Exports made in the background once a volume is ready, so all that's
+    left for initialize_connection is binding the connector to it.
+
+    Lunr opens an export made without an ip to every initiator, so until
+    it's claimed the export is restricted to `acl_ip`, an address no
+    initiator should have. Exports nobody asked for within `timeout`
+    seconds are deleted. Speculations are only kept in memory, exports
+    left restricted to `acl_ip` by a restart are deleted along with their
+    volume by `remove_leftover`.
+    """
+
+    def __init__(self, clients, timeout=600, acl_ip='127.0.0.1'):
+        self.clients = clients
+        self.timeout = timeout
+        self.acl_ip = acl_ip
+        self.running = False
+        self.created = 0
+        self.claimed = 0
+        self.reclaimed = 0
+        self.cancelled = 0
+        self.failures = 0
+        # by lunr volume id, registered before the export is made so
+        # initialize_connection can tell one is on the way
+        self._exports = {}
+
+    def _client(self, project_id):
+        return self.clients.get({'project_id': project_id})
+
+    def prepare(self, volume, volume_id, statuses=('ACTIVE',)):
+        """
+        Export the volume once Lunr has it in one of statuses.
+
+        :param volume: the cinder volume
+        :param volume_id: the id of the volume in Lunr
+        """
+        if volume_id in self._exports:
+            return
+        speculation = Speculation(volume['project_id'])
+        self._exports[volume_id] = speculation
+        spawn_n(self._export, volume_id, speculation, statuses)
+
+    def _current(self, volume_id, speculation):
+        return self._exports.get(volume_id) is speculation
+
+    def _export(self, volume_id, speculation, statuses):
+        client = self._client(speculation.project_id)
+        try:
+            client.volumes.wait_on_status(volume_id, *statuses)
+            if not self._current(volume_id, speculation):
+                # the volume was attached or deleted in the meantime
+                return
+            try:
+                client.exports.get(volume_id)
+            except LunrError, e:
+                if e.code != 404:
+                    raise
+            else:
+                # somebody else exported it, it's theirs
+                self._drop(volume_id, speculation)
+                return
+            resp = client.exports.create(volume_id, ip=self.acl_ip)
+            # resolves the portal now rather than while nova waits
+            info = connection_info(volume_id, resp.body)
+        except (LunrError, StatusError), e:
+            LOG.warning('unable to export volume %s ahead of time: %s' %
+                        (volume_id, e))
+            self.failures += 1
+            self._drop(volume_id, speculation)
+            return
+        if not self._current(volume_id, speculation):
+            # cancelled while the export was being made
+            self._abandon(client, volume_id, speculation)
+            return
+        self.created += 1
+        speculation.info = info
+
+    def _drop(self, volume_id, speculation):
+        if self._current(volume_id, speculation):
+            del self._exports[volume_id]
+
+    def _abandon(self, client, volume_id, speculation):
+        """
+        Deal with an export made for a speculation that was cancelled.
+        """
+        if speculation.claimed_ip:
+            # initialize_connection made the real export alongside ours,
+            # make sure it's bound to the connector and not to acl_ip
+            try:
+                client.exports.update(volume_id, ip=speculation.claimed_ip)
+            except LunrError, e:
+                LOG.warning('unable to rebind export of %s to %s: %s' %
+                            (volume_id, speculation.claimed_ip, e))
+        else:
+            self._delete(volume_id, speculation)
+
+    def claim(self, client, volume_id, connector, deadline=None):
+        """
+        Bind the connector to the export made ahead of time.
+
+        :returns: connection info, or None if there's no export to use
+        """
+        speculation = self._exports.pop(volume_id, None)
+        if not speculation:
+            return None
+        if not speculation.info:
+            # still on it's way, the caller makes the export instead
+            speculation.claimed_ip = connector.get('ip')
+            self.cancelled += 1
+            return None
+        try:
+            client.exports.update(volume_id, ip=connector.get('ip'),
+                                  deadline=deadline)
+        except LunrError, e:
+            LOG.warning('unable to use export of %s made ahead of time: %s' %
+                        (volume_id, e))
+            return None
+        self.claimed += 1
+        return speculation.info
+
+    def _delete(self, volume_id, speculation):
+        try:
+            self._client(speculation.project_id).exports.delete(volume_id)
+        except LunrError, e:
+            if e.code != 404:
+                LOG.warning('failed to delete unused export of %s: %s' %
+                            (volume_id, e))
+
+    def discard(self, volume_id, delete=True):
+        """
+        Forget the export of a volume that's going away, or being detached.
+
+        :param delete: False if the caller deletes the export itself
+        :returns: True if there was a speculative export of the volume
+        """
+        speculation = self._exports.pop(volume_id, None)
+        if not speculation:
+            return False
+        if not speculation.info:
+            # _export cleans up after itself once it sees it's cancelled
+            self.cancelled += 1
+        elif delete:
+            self._delete(volume_id, speculation)
+        return True
+
+    def remove_leftover(self, client, volume_id, deadline=None):
+        """
+        Delete an export of the volume made ahead of time before a restart,
+        which Lunr still has restricted to acl_ip.
+        """
+        try:
+            resp = client.exports.get(volume_id, deadline=deadline)
+            if resp.body.get('ip') != self.acl_ip:
+                # no export, or somebody's using it
+                return
+            client.exports.delete(volume_id, deadline=deadline)
+        except LunrError, e:
+            if e.code != 404:
+                LOG.warning('unable to remove leftover export of %s: %s' %
+                            (volume_id, e))
+            return
+        LOG.info('deleted leftover export of volume %s' % volume_id)
+        self.reclaimed += 1
+
+    def reclaim(self):
+        """
+        Delete the exports nobody used in time.
+        """
+        cutoff = time() - self.timeout
+        for volume_id, speculation in self._exports.items():
+            if not speculation.info or speculation.created >= cutoff:
+                # exports still being made are bounded by their wait
+                continue
+            if not self._current(volume_id, speculation):
+                # somebody just claimed it
+                continue
+            del self._exports[volume_id]
+            LOG.info('deleting unused export of volume %s' % volume_id)
+            self.reclaimed += 1
+            self._delete(volume_id, speculation)
+
+    def _reclaim_forever(self):
+        while self.running:
+            sleep(max(self.timeout / 4.0, 1))
+            try:
+                self.reclaim()
+            except Exception:
+                LOG.exception('failed to reclaim unused exports')
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        spawn_n(self._reclaim_forever)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        ready = len([s for s in self._exports.values() if s.info])
+        return {
+            'pending': len(self._exports) - ready,
+            'ready': ready,
+            'created': self.created,
+            'claimed': self.claimed,
+            'reclaimed': self.reclaimed,
+            'cancelled': self.cancelled,
+            'failures': self.failures,
+        }
@@ -0,0 +1,150 @@
+"""
+Keeps the volume types in Cinder in line with the ones in LUNR.
+"""
+
+from time import time
+
+try:
+    from eventlet import sleep
+except ImportError:
+    from time import sleep
+
+from cinder import exception
+from cinder.context import get_admin_context
+from cinder.volume import volume_types
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.compat import spawn_n
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.typesync')
+
+# the lunr account volume types are listed from
+ADMIN_CONTEXT = {'project_id': 'admin'}
+
+
+class TypeSync(object):
+    """
+    Create the Cinder volume types of the ACTIVE Lunr types Cinder doesn't
+    have yet, from one list of each.
+
+    Cinder types of Lunr types that are no longer ACTIVE are destroyed if
+    `remove` is set, otherwise just reported. Types Lunr doesn't know about
+    belong to some other backend and are left alone.
+
+    The first sync runs in the background as soon as the driver starts, a
+    failed list of the Lunr types is retried `attempts` times. After that
+    the types are synced every `interval` seconds, or never again if it's
+    0.
+    """
+
+    def __init__(self, clients, interval=3600, remove=False, attempts=3,
+                 deadline=None):
+        """
+        :param deadline: optional callable that returns the Deadline of a
+                         list of the Lunr types
+        """
+        self.clients = clients
+        self.interval = interval
+        self.remove = remove
+        self.attempts = attempts
+        self.deadline = deadline or (lambda: None)
+        self.running = False
+        self.syncs = 0
+        self.failures = 0
+        self.created = 0
+        self.removed = 0
+        self.last_sync = None
+        # names of the cinder types of lunr types that are gone
+        self.stale = set()
+
+    def _lunr_types(self):
+        client = self.clients.get(ADMIN_CONTEXT)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return client.types.list(deadline=self.deadline()).body
+            except Exception:
+                if attempt >= self.attempts:
+                    LOG.error('Unable up to read volume types from Lunr '
+                              'after %s attempts.' % attempt)
+                    raise
+                LOG.exception('failed attempt %s to retrieve volume types '
+                              'from Lunr, will retry.' % attempt)
+                sleep(attempt ** 2)
+
+    def sync(self):
+        """
+        :returns: (names of types created, names of types removed)
+        """
+        lunr_types = self._lunr_types()
+        context = get_admin_context()
+        cinder_types = volume_types.get_all_types(context)
+        active = set(vtype['name'] for vtype in lunr_types
+                     if vtype['status'] == 'ACTIVE')
+        gone = set(vtype['name'] for vtype in lunr_types
+                   if vtype['status'] != 'ACTIVE') - active
+        created = []
+        for name in sorted(active - set(cinder_types)):
+            try:
+                volume_types.create(context, name)
+            except exception.VolumeTypeExists:
+                # another volume manager beat us to it
+                continue
+            LOG.info('volume type %s successfully created' % name)
+            created.append(name)
+        removed = []
+        self.stale = set()
+        for name in sorted(gone & set(cinder_types)):
+            if not self.remove:
+                self.stale.add(name)
+                continue
+            try:
+                volume_types.destroy(context, cinder_types[name]['id'])
+            except exception.VolumeTypeInUse:
+                LOG.warning('volume type %s is gone from Lunr but still '
+                            'in use' % name)
+                self.stale.add(name)
+                continue
+            LOG.info('volume type %s removed' % name)
+            removed.append(name)
+        if self.stale:
+            LOG.warning('volume types %s are gone from Lunr' %
+                        ', '.join(sorted(self.stale)))
+        self.created += len(created)
+        self.removed += len(removed)
+        self.syncs += 1
+        self.last_sync = time()
+        return created, removed
+
+    def _sync_forever(self):
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                self.failures += 1
+                LOG.exception('failed to sync volume types')
+            if not self.interval:
+                break
+            sleep(self.interval)
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        spawn_n(self._sync_forever)
+
+    def stats(self):
+        return {
+            'syncs': self.syncs,
+            'failures': self.failures,
+            'created': self.created,
+            'removed': self.removed,
+            'stale': sorted(self.stale),
+            'age': time() - self.last_sync if self.last_sync else None,
+        }
@@ -0,0 +1,276 @@
+"""
+Base for caches of LUNR volumes kept around to clone new volumes from.
+"""
+
+from collections import OrderedDict
+from time import time
+from uuid import uuid4
+
+try:
+    from eventlet import sleep
+    from eventlet.semaphore import Semaphore as Lock
+except ImportError:
+    from threading import Lock
+    from time import sleep
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrError, StatusError
+from lunrdriver.lunr.compat import spawn_n
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.volumecache')
+
+# the lunr account the cached volumes of every project are listed from
+ADMIN_CONTEXT = {'project_id': 'admin'}
+
+
+class Entry(object):
+
+    def __init__(self, key, volume_id, size, version=None, ready=False):
+        self.key = key
+        self.volume_id = volume_id
+        self.size = size
+        self.version = version
+        self.ready = ready
+        self.evicted = False
+        self.uses = 0
+        self.created = self.last_used = time()
+
+
+class VolumeCache(object):
+    """
+    Lunr volumes the driver made for itself to clone new volumes from.
+
+    Cached volumes live in the project they were made for, keyed by
+    (project, volume type, ...). They're built in the background, and named
+    with `prefix` so they can be found again after a restart, the first
+    sweep picks up those of every project. Past `max_count` volumes or
+    `max_gb` GB the victim picked by `_victim` is deleted. Lunr won't
+    delete a volume that's still being cloned, those deletes are tried
+    again every `sweep_interval` seconds.
+    """
+
+    prefix = 'volume-cache-'
+    sweep_interval = 60
+
+    def __init__(self, clients, max_count=50, max_gb=1000):
+        self.clients = clients
+        self.max_count = max_count
+        self.max_gb = max_gb
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.failures = 0
+        self.running = False
+        # oldest used first
+        self._entries = OrderedDict()
+        self._adopted = set()
+        self._adopted_all = False
+        # evicted entries Lunr wouldn't delete the volumes of yet
+        self._undeleted = []
+        self._lock = Lock()
+
+    def _client(self, project_id):
+        return self.clients.get({'project_id': project_id})
+
+    def _adopt_entry(self, project_id, volume):
+        """
+        :returns: an Entry for a cached volume found in Lunr, or None if
+                  it's somebody else's
+        """
+        raise NotImplementedError()
+
+    def _adopt_volumes(self, project_id, volumes):
+        """
+        Called with the lock held.
+        """
+        self._adopted.add(project_id)
+        for volume in volumes:
+            name = volume.get('name') or ''
+            if not name.startswith(self.prefix) or \
+                    volume.get('status') != 'ACTIVE':
+                continue
+            entry = self._adopt_entry(project_id, volume)
+            if entry and entry.key not in self._entries:
+                self._entries[entry.key] = entry
+
+    def _adopt(self, project_id):
+        """
+        Pick up the cached volumes of a project made before a restart, if
+        the sweep hasn't yet.
+
+        Called without the lock held, if the volumes can't be listed it's
+        tried again on the next lookup.
+        """
+        if self._adopted_all or project_id in self._adopted:
+            return
+        try:
+            volumes = self._client(project_id).volumes.list().body
+        except LunrError, e:
+            LOG.warning('unable to find cached volumes of %s: %s' %
+                        (project_id, e))
+            return
+        with self._lock:
+            if project_id in self._adopted:
+                # somebody beat us to it
+                return
+            self._adopt_volumes(project_id, volumes)
+            self._evict_over_limits()
+
+    def adopt_all(self):
+        """
+        Pick up the cached volumes of every project made before a restart,
+        so they're expired and evicted even if nobody looks them up again.
+        If the volumes can't be listed it's tried again on the next sweep.
+        """
+        if self._adopted_all:
+            return
+        try:
+            volumes = self.clients.get(ADMIN_CONTEXT).volumes.list().body
+        except LunrError, e:
+            LOG.warning('unable to find cached volumes: %s' % e)
+            return
+        by_project = {}
+        for volume in volumes:
+            if volume.get('account_id'):
+                by_project.setdefault(volume['account_id'], []).append(
+                    volume)
+        with self._lock:
+            for project_id, project_volumes in by_project.items():
+                if project_id not in self._adopted:
+                    self._adopt_volumes(project_id, project_volumes)
+            self._adopted_all = True
+            self._evict_over_limits()
+
+    def _hit(self, entry):
+        # most recently used goes last
+        self._entries[entry.key] = self._entries.pop(entry.key)
+        entry.uses += 1
+        entry.last_used = time()
+        self.hits += 1
+        return entry.volume_id
+
+    def _add(self, key, name, size, version=None, **params):
+        """
+        Start building a cached volume.
+        """
+        entry = Entry(key, str(uuid4()), size, version=version)
+        self._entries[key] = entry
+        self._evict_over_limits()
+        spawn_n(self._build, entry, name, **params)
+        return entry
+
+    def discard(self, volume_id):
+        """
+        Forget a cached volume that turned out to be unusable.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.volume_id == volume_id:
+                    self._evict(entry)
+
+    def _build(self, entry, name, **params):
+        project_id, volume_type_name = entry.key[:2]
+        client = self._client(project_id)
+        try:
+            client.volumes.create(entry.volume_id, name=name,
+                                  size=entry.size,
+                                  volume_type_name=volume_type_name,
+                                  **params)
+            client.volumes.wait_on_status(entry.volume_id, 'ACTIVE',
+                                          size=entry.size)
+        except (LunrError, StatusError), e:
+            LOG.error('failed to build cached volume %s: %s' % (name, e))
+            self.failures += 1
+            with self._lock:
+                self._evict(entry)
+            return
+        if entry.evicted:
+            # thrown out while it was being built
+            self._delete(entry)
+            return
+        entry.ready = True
+        LOG.info('cached volume %s (%s) is ready' % (entry.volume_id, name))
+
+    def _delete(self, entry):
+        try:
+            self._client(entry.key[0]).volumes.delete(entry.volume_id)
+        except LunrError, e:
+            if e.code != 404:
+                LOG.warning('failed to delete cached volume %s, will try '
+                            'again: %s' % (entry.volume_id, e))
+                self._undeleted.append(entry)
+
+    def sweep(self):
+        """
+        Adopt what's left from before a restart, and try the deletes Lunr
+        turned down again.
+        """
+        self.adopt_all()
+        undeleted, self._undeleted = self._undeleted, []
+        for entry in undeleted:
+            self._delete(entry)
+
+    def _sweep_forever(self):
+        while self.running:
+            try:
+                self.sweep()
+            except Exception:
+                LOG.exception('failed to sweep cached volumes')
+            sleep(self.sweep_interval)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        spawn_n(self._sweep_forever)
+
+    def stop(self):
+        self.running = False
+
+    def _evict(self, entry):
+        if self._entries.get(entry.key) is entry:
+            del self._entries[entry.key]
+        if entry.evicted:
+            return
+        entry.evicted = True
+        if entry.ready:
+            spawn_n(self._delete, entry)
+        # the build deletes the ones still building when it's done
+
+    def _over_limits(self):
+        size = sum(e.size for e in self._entries.values())
+        return len(self._entries) > self.max_count or size > self.max_gb
+
+    def _victim(self, ready):
+        """
+        Pick what to throw out, least recently used by default.
+        """
+        return ready[0]
+
+    def _evict_over_limits(self):
+        while self._over_limits():
+            ready = [e for e in self._entries.values() if e.ready]
+            if not ready:
+                break
+            self.evictions += 1
+            self._evict(self._victim(ready))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        entries = self._entries.values()
+        return {
+            'count': len(entries),
+            'building': len([e for e in entries if not e.ready]),
+            'size_gb': sum(e.size for e in entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'undeleted': len(self._undeleted),
+            'failures': self.failures,
+        }
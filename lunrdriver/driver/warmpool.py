@@ -0,0 +1,259 @@
+"""
+Pools of empty LUNR volumes made ahead of time for create_volume to claim.
+"""
+
+import math
+from collections import deque
+from time import time
+from uuid import uuid4
+
+try:
+    from eventlet import sleep
+except ImportError:
+    from time import sleep
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrError, StatusError
+from lunrdriver.lunr.compat import spawn_n
+
+
+LOG = logging.getLogger('cinder.volume.driver.lunr.warmpool')
+
+# lunr name of the volumes waiting in a pool
+POOL_NAME = 'warm-pool'
+
+
+def parse_pools(specs):
+    """
+    :param specs: list of 'volume_type:size' strings
+    :returns: list of (volume type name, size)
+    """
+    pools = []
+    for spec in specs:
+        volume_type_name, sep, size = spec.rpartition(':')
+        if not sep or not volume_type_name:
+            raise ValueError("warm pool '%s' isn't volume_type:size" % spec)
+        pools.append((volume_type_name, int(size)))
+    return pools
+
+
+class Pool(object):
+
+    def __init__(self, volume_type_name, size):
+        self.volume_type_name = volume_type_name
+        self.size = size
+        self.ready = deque()
+        self.building = 0
+        self.target = 0
+        self.hits = 0
+        self.misses = 0
+        # when volumes of this type and size were asked for
+        self.requests = deque()
+        # when the pool last dropped below target, None when it's full
+        self.below_since = None
+
+    def stats(self):
+        lag = 0
+        if self.below_since is not None:
+            lag = time() - self.below_since
+        return {
+            'ready': len(self.ready),
+            'building': self.building,
+            'target': self.target,
+            'hits': self.hits,
+            'misses': self.misses,
+            'refill_lag': lag,
+        }
+
+
+class WarmPool(object):
+    """
+    Empty Lunr volumes kept ready in `project_id` for each configured
+    (volume type, size), so create_volume can hand one over to the volume's
+    project with volumes.update instead of waiting for Lunr to allocate one.
+
+    Each pool aims to hold enough volumes for `lead_time` seconds worth of
+    creates at the rate seen over the last `window` seconds, between
+    `min_size` and `max_size`. Pools are topped up every `refill_interval`
+    seconds, and right after a volume is claimed.
+    """
+
+    def __init__(self, clients, project_id, pools, min_size=1, max_size=10,
+                 lead_time=300, window=3600, refill_interval=10):
+        self.clients = clients
+        self.project_id = project_id
+        self.min_size = min_size
+        self.max_size = max_size
+        self.lead_time = lead_time
+        self.window = window
+        self.refill_interval = refill_interval
+        self.running = False
+        self.failures = 0
+        self.pools = dict(((volume_type_name, size),
+                           Pool(volume_type_name, size))
+                          for volume_type_name, size in pools)
+
+    def _client(self):
+        return self.clients.get({'project_id': self.project_id})
+
+    def _adopt(self):
+        """
+        Pick up pool volumes made before a restart.
+        """
+        try:
+            volumes = self._client().volumes.list().body
+        except LunrError, e:
+            LOG.warning('unable to find warm pool volumes: %s' % e)
+            return
+        for volume in volumes:
+            if volume.get('name') != POOL_NAME or \
+                    volume.get('status') != 'ACTIVE':
+                continue
+            pool = self.pools.get((volume.get('volume_type_name'),
+                                   volume.get('size')))
+            if pool and volume['id'] not in pool.ready:
+                pool.ready.append(volume['id'])
+
+    def target(self, pool):
+        """
+        How many volumes the pool should hold for the create rate.
+        """
+        cutoff = time() - self.window
+        while pool.requests and pool.requests[0] < cutoff:
+            pool.requests.popleft()
+        rate = float(len(pool.requests)) / self.window
+        target = int(math.ceil(rate * self.lead_time))
+        return max(self.min_size, min(target, self.max_size))
+
+    def claim(self, volume, volume_type_name, deadline=None):
+        """
+        Hand a volume from the pool over to the project of volume.
+
+        :returns: (lunr id, LunrResponse of the update), or None if there
+                  isn't a pool volume to be had
+        """
+        pool = self.pools.get((volume_type_name, volume['size']))
+        if not pool:
+            return None
+        pool.requests.append(time())
+        client = self._client()
+        while pool.ready:
+            lunr_id = pool.ready.popleft()
+            try:
+                resp = client.volumes.update(
+                    lunr_id, account_id=volume['project_id'],
+                    name=volume['id'], deadline=deadline)
+            except LunrError, e:
+                if e.code == 404:
+                    # gone, try the next one
+                    continue
+                LOG.warning('unable to claim warm pool volume %s: %s' %
+                            (lunr_id, e))
+                resp = self._recover(pool, lunr_id, volume, deadline)
+                if not resp:
+                    break
+            pool.hits += 1
+            spawn_n(self.refill, pool)
+            return lunr_id, resp
+        pool.misses += 1
+        spawn_n(self.refill, pool)
+        return None
+
+    def _recover(self, pool, lunr_id, volume, deadline=None):
+        """
+        Find out where a pool volume went after a failed update, it may
+        have gone through anyway.
+
+        :returns: LunrResponse of the volume if it's the project's now
+        """
+        try:
+            resp = self.clients.get(volume).volumes.get(lunr_id,
+                                                        deadline=deadline)
+        except LunrError, e:
+            if e.code == 404:
+                # still in the pool
+                pool.ready.appendleft(lunr_id)
+            else:
+                # no telling, don't hand it to anyone else
+                LOG.warning('unable to find warm pool volume %s: %s' %
+                            (lunr_id, e))
+                spawn_n(self._delete, lunr_id)
+            return None
+        name = resp.body.get('name')
+        if name == volume['id']:
+            return resp
+        if name == POOL_NAME:
+            pool.ready.appendleft(lunr_id)
+        return None
+
+    def _build(self, pool):
+        lunr_id = str(uuid4())
+        client = self._client()
+        try:
+            client.volumes.create(lunr_id, name=POOL_NAME, size=pool.size,
+                                  volume_type_name=pool.volume_type_name)
+            client.volumes.wait_on_status(lunr_id, 'ACTIVE', size=pool.size)
+        except (LunrError, StatusError), e:
+            LOG.error('failed to build %s GB %s warm pool volume: %s' %
+                      (pool.size, pool.volume_type_name, e))
+            self.failures += 1
+            return
+        finally:
+            pool.building -= 1
+        pool.ready.append(lunr_id)
+        if len(pool.ready) >= pool.target:
+            pool.below_since = None
+
+    def _delete(self, lunr_id):
+        try:
+            self._client().volumes.delete(lunr_id)
+        except LunrError, e:
+            if e.code != 404:
+                LOG.warning('failed to delete warm pool volume %s: %s' %
+                            (lunr_id, e))
+
+    def refill(self, pool):
+        """
+        Build or delete volumes to get the pool to its target.
+        """
+        pool.target = self.target(pool)
+        have = len(pool.ready) + pool.building
+        if len(pool.ready) < pool.target:
+            if pool.below_since is None:
+                pool.below_since = time()
+        else:
+            pool.below_since = None
+        for i in range(pool.target - have):
+            pool.building += 1
+            spawn_n(self._build, pool)
+        while len(pool.ready) > pool.target:
+            spawn_n(self._delete, pool.ready.pop())
+
+    def _refill_forever(self):
+        while self.running:
+            for pool in self.pools.values():
+                try:
+                    self.refill(pool)
+                except Exception:
+                    LOG.exception('failed to refill warm pool')
+            sleep(self.refill_interval)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._adopt()
+        spawn_n(self._refill_forever)
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        stats = {'failures': self.failures}
+        for (volume_type_name, size), pool in self.pools.items():
+            stats['%s:%s' % (volume_type_name, size)] = pool.stats()
+        return stats
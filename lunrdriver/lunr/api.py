@@ -28,10 +28,14 @@ except ImportError:
 from cinder.volume import volume_types
 from lunrdriver.lunr.client import LunrClient, LunrError
 from lunrdriver.lunr.flags import CONF
+from lunrdriver.lunr.singleflight import SingleFlight
 
 
 LOG = logging.getLogger('cinder.lunr.api')
 
+# a burst of creates looks up the same volume type, once is enough
+single_flight = SingleFlight()
+
 
 class SnapshotConflict(exception.Invalid):
     message = _("Existing snapshot operation on volume %(volume_id)s in "
@@ -55,7 +59,8 @@ class API(CinderAPI):
         lunr_context = {'project_id': 'admin'}
         try:
             client = LunrClient(CONF.lunr_api_endpoint,
-                                lunr_context, logger=LOG)
+                                lunr_context, logger=LOG,
+                                single_flight=single_flight)
             resp = client.types.get(volume_type['name'])
         except LunrError, e:
             LOG.error(_('unable to fetch volume type from LunR: %s'),
@@ -0,0 +1,175 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from urllib2 import Request
+
+try:
+    from eventlet import sleep
+except ImportError:
+    from time import sleep
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.breaker import CircuitBreaker, CLOSED
+from lunrdriver.lunr.compat import spawn_n
+from lunrdriver.lunr.pool import urlopen
+
+
+LOG = logging.getLogger('cinder.volume.lunr.balancer')
+
+
+class Endpoint(object):
+
+    def __init__(self, url, breaker):
+        self.url = url.rstrip('/')
+        self.breaker = breaker
+        self.outstanding = 0
+        self.requests = 0
+        self.latency = None
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'latency': self.latency,
+            'circuit_breaker': self.breaker.stats(),
+        }
+
+
+class LoadBalancer(object):
+    """
+    Spread requests over one or more Lunr api endpoints.
+
+    Endpoints with a closed circuit breaker are preferred, among those the
+    `least_outstanding` strategy picks the one with the fewest requests in
+    flight and the `ewma` strategy the one with the lowest moving average
+    latency weighted by it's requests in flight. Ties go to the endpoint
+    that has served the fewest requests, so idle endpoints take turns.
+    """
+
+    strategies = ('least_outstanding', 'ewma')
+    # weight of the newest latency sample in the moving average
+    decay = 0.3
+
+    def __init__(self, urls, strategy='least_outstanding',
+                 breaker_factory=CircuitBreaker):
+        if isinstance(urls, basestring):
+            urls = [urls]
+        if not urls:
+            raise ValueError('No Lunr api endpoints supplied')
+        if strategy not in self.strategies:
+            raise ValueError('Unknown balancer strategy %r' % strategy)
+        self.strategy = strategy
+        self.endpoints = [Endpoint(url, breaker_factory()) for url in urls]
+        self.probing = False
+
+    @property
+    def primary(self):
+        return self.endpoints[0]
+
+    def urls(self):
+        return [endpoint.url for endpoint in self.endpoints]
+
+    def score(self, endpoint):
+        if self.strategy == 'ewma':
+            load = (endpoint.latency or 0) * (endpoint.outstanding + 1)
+        else:
+            load = endpoint.outstanding
+        return (load, endpoint.requests)
+
+    def choose(self, exclude=()):
+        """
+        Pick an endpoint for the next request.
+
+        :param exclude: endpoints to avoid unless there's nothing else
+
+        :returns: an Endpoint, or None if every circuit breaker is open
+        """
+        candidates = [e for e in self.endpoints if e not in exclude]
+        healthy = [e for e in candidates if e.breaker.state == CLOSED]
+        if not healthy:
+            healthy = [e for e in self.endpoints if e.breaker.state == CLOSED]
+        for endpoint in sorted(healthy or candidates or self.endpoints,
+                               key=self.score):
+            if endpoint.breaker.allow():
+                return endpoint
+        return None
+
+    def start(self, endpoint):
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+
+    def finish(self, endpoint, elapsed, success):
+        """
+        :param success: True or False, None if the request was cancelled
+        """
+        endpoint.outstanding -= 1
+        if success is None:
+            endpoint.breaker.cancel()
+            return
+        if success:
+            if endpoint.latency is None:
+                endpoint.latency = elapsed
+            else:
+                endpoint.latency = (self.decay * elapsed +
+                                    (1 - self.decay) * endpoint.latency)
+        endpoint.breaker.record(success)
+
+    def probe(self, timeout=5):
+        """
+        Send a trial request to every endpoint that's out of rotation and
+        due for one.
+
+        Any response short of a server error means the api is back up.
+        """
+        for endpoint in self.endpoints:
+            if endpoint.breaker.state == CLOSED:
+                continue
+            if not endpoint.breaker.allow():
+                continue
+            try:
+                urlopen(Request(endpoint.url), timeout=timeout).read()
+            except Exception, e:
+                success = not endpoint.breaker.is_failure(e)
+            else:
+                success = True
+            LOG.info('probe of %s %s' % (
+                endpoint.url, 'succeeded' if success else 'failed'))
+            endpoint.breaker.record(success)
+
+    def _probe_forever(self, interval, timeout):
+        while self.probing:
+            sleep(interval)
+            try:
+                self.probe(timeout=timeout)
+            except Exception:
+                LOG.exception('Lunr endpoint probe failed')
+
+    def start_probing(self, interval=10, timeout=5):
+        if self.probing:
+            return
+        self.probing = True
+        spawn_n(self._probe_forever, interval, timeout)
+
+    def stop_probing(self):
+        self.probing = False
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
@@ -0,0 +1,164 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import deque
+from httplib import HTTPException
+from time import time
+from urllib2 import HTTPError
+
+try:
+    from eventlet.semaphore import Semaphore as Lock
+except ImportError:
+    from threading import Lock
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Fail fast while a Lunr endpoint is unhealthy.
+
+    The breaker opens once at least `min_requests` were made in the last
+    `window` seconds and `error_rate` of them failed. After `reset_timeout`
+    seconds it lets `trial_requests` through half-open, if they all succeed
+    the breaker closes again, any failure opens it for another
+    `reset_timeout`. Trials that haven't all been heard from after another
+    `reset_timeout` are given up on and a new round is let through, so a
+    lost trial can't keep the endpoint out of rotation for good.
+    """
+
+    def __init__(self, window=60, min_requests=20, error_rate=0.5,
+                 reset_timeout=30, trial_requests=3):
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.reset_timeout = reset_timeout
+        self.trial_requests = trial_requests
+        self.state = CLOSED
+        self.opened_at = None
+        self.half_opened_at = None
+        self.opened = 0
+        self.rejected = 0
+        self._buckets = deque()
+        self._trials = 0
+        self._trial_successes = 0
+        self._lock = Lock()
+
+    def is_failure(self, e):
+        """
+        Server errors and connection errors count against the endpoint,
+        a 4xx means it's up and doing it's job.
+        """
+        if isinstance(e, HTTPError):
+            return e.code >= 500
+        # URLError and socket.error are both IOErrors
+        return isinstance(e, (IOError, HTTPException))
+
+    def _prune(self, now):
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+
+    def _counts(self, now):
+        self._prune(now)
+        total = sum(bucket[1] for bucket in self._buckets)
+        failures = sum(bucket[2] for bucket in self._buckets)
+        return total, failures
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.opened += 1
+
+    def _half_open(self, now):
+        self.state = HALF_OPEN
+        self.half_opened_at = now
+        self._trials = 0
+        self._trial_successes = 0
+
+    def allow(self):
+        """
+        :returns: True if a request may be sent to the endpoint
+        """
+        now = time()
+        with self._lock:
+            if self.state == OPEN:
+                if now - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self._half_open(now)
+            if self.state == HALF_OPEN:
+                if now - self.half_opened_at >= self.reset_timeout:
+                    # the last round of trials never finished
+                    self._half_open(now)
+                if self._trials >= self.trial_requests:
+                    self.rejected += 1
+                    return False
+                self._trials += 1
+            return True
+
+    def cancel(self):
+        """
+        A request let through by allow was abandoned before it finished.
+        """
+        with self._lock:
+            if self.state == HALF_OPEN and self._trials:
+                self._trials -= 1
+
+    def record(self, success):
+        now = time()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if not success:
+                    self._open(now)
+                    return
+                self._trial_successes += 1
+                if self._trial_successes >= self.trial_requests:
+                    self.state = CLOSED
+                    self._buckets.clear()
+                return
+            if self.state == OPEN:
+                # a request that was let through before we opened
+                return
+            second = int(now)
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0])
+            bucket = self._buckets[-1]
+            bucket[1] += 1
+            if not success:
+                bucket[2] += 1
+                total, failures = self._counts(now)
+                if total >= self.min_requests and \
+                        float(failures) / total >= self.error_rate:
+                    self._open(now)
+
+    def stats(self):
+        with self._lock:
+            total, failures = self._counts(time())
+        return {
+            'state': self.state,
+            'requests': total,
+            'failures': failures,
+            'error_rate': float(failures) / total if total else 0.0,
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
@@ -0,0 +1,182 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from time import time
+
+try:
+    from eventlet.semaphore import Semaphore
+except ImportError:
+    from threading import Semaphore
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.compat import Empty, Queue, spawn
+from lunrdriver.lunr.recheck import Unsupported
+from lunrdriver.lunr.schedule import Histogram
+
+
+LOG = logging.getLogger('cinder.volume.lunr.bulk')
+
+
+class BulkResult(object):
+    """
+    How one item of a bulk operation turned out.
+    """
+
+    def __init__(self, key, resp=None, error=None, latency=0.0):
+        self.key = key
+        self.resp = resp
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class BulkReport(object):
+    """
+    The results of a bulk operation, in the order the items were given.
+    """
+
+    def __init__(self, results, elapsed):
+        self.results = results
+        self.elapsed = elapsed
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    def stats(self):
+        latencies = [result.latency for result in self.results]
+        return {
+            'items': len(self.results),
+            'succeeded': len(self.succeeded),
+            'failed': len(self.failed),
+            'elapsed': self.elapsed,
+            'mean_latency': (sum(latencies) / len(latencies)
+                             if latencies else 0.0),
+            'max_latency': max(latencies) if latencies else 0.0,
+        }
+
+
+def run(func, items, concurrency=10, key=None, slots=None):
+    """
+    Call func on every item, at most `concurrency` at once.
+
+    :param key: called on an item to get the key of it's result, the item
+                itself by default
+    :param slots: an optional Semaphore every call holds while it runs, to
+                  bound the calls of several bulk operations together
+    :returns: a BulkReport
+    """
+    key = key or (lambda item: item)
+    start = time()
+    items = list(items)
+    if not items:
+        return BulkReport([], 0.0)
+    todo = Queue()
+    for i, item in enumerate(items):
+        todo.put((i, item))
+    done = Queue()
+
+    def work():
+        while True:
+            try:
+                i, item = todo.get(block=False)
+            except Empty:
+                return
+            item_start = time()
+            try:
+                if slots:
+                    with slots:
+                        resp = func(item)
+                else:
+                    resp = func(item)
+            except Exception, e:
+                result = BulkResult(key(item), error=e)
+            else:
+                result = BulkResult(key(item), resp=resp)
+            result.latency = time() - item_start
+            done.put((i, result))
+
+    for n in range(min(concurrency, len(items))):
+        spawn(work)
+    results = [None] * len(items)
+    for n in range(len(items)):
+        i, result = done.get()
+        results[i] = result
+    return BulkReport(results, time() - start)
+
+
+class BulkPolicy(object):
+    """
+    How bulk operations on Lunr are run.
+
+    Items are sent at most `concurrency` at a time across every bulk
+    operation of the clients sharing the policy, which should be no more
+    than the connection pool keeps per endpoint. Lunr apis that turn out
+    not to have a bulk endpoint for a resource get one request per item
+    for the next `recheck` seconds.
+    """
+
+    def __init__(self, concurrency=10, recheck=300):
+        self.concurrency = concurrency
+        self.recheck = recheck
+        self.slots = Semaphore(concurrency)
+        self.operations = 0
+        self.items = 0
+        self.failures = 0
+        self.bulk_requests = 0
+        self.latency = Histogram()
+        self._unsupported = Unsupported(
+            'Lunr has no bulk endpoint for %s (%s), sending one request per '
+            'item for the next %ss', LOG, recheck=recheck)
+
+    def supported(self, resource):
+        return self._unsupported.supported(resource)
+
+    def unsupported(self, resource, reason):
+        self._unsupported.unsupported(resource, reason)
+
+    def run(self, func, items, key=None):
+        return run(func, items, concurrency=self.concurrency, key=key,
+                   slots=self.slots)
+
+    def record(self, report):
+        self.operations += 1
+        self.items += len(report.results)
+        self.failures += len(report.failed)
+        self.latency.add(report.elapsed)
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'operations': self.operations,
+            'items': self.items,
+            'failures': self.failures,
+            'bulk_requests': self.bulk_requests,
+            'fallbacks': self._unsupported.fallbacks,
+            'unsupported': self._unsupported.names(),
+            'latency': self.latency.stats(),
+        }
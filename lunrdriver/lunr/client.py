@@ -2,9 +2,12 @@ import json
 import socket
 import urllib2
 
+from collections import OrderedDict
+from StringIO import StringIO
+from time import time
 from httplib import HTTPException, BadStatusLine
 from urllib import urlencode
-from urllib2 import Request, urlopen, URLError, HTTPError
+from urllib2 import Request, URLError, HTTPError
 from webob import exc
 
 try:
@@ -12,6 +15,11 @@ try:
 except ImportError:
     from time import sleep
 
+try:
+    from eventlet.semaphore import Semaphore as Lock
+except ImportError:
+    from threading import Lock
+
 try:
     from oslo_log import log as logging
 except ImportError:
@@ -22,6 +30,15 @@ try:
 except ImportError:
     from cinder.openstack.common import local
 
+from lunrdriver.lunr.balancer import LoadBalancer
+from lunrdriver.lunr.breaker import CircuitOpen
+from lunrdriver.lunr.bulk import BulkPolicy, BulkReport, BulkResult
+from lunrdriver.lunr.compat import Empty, Queue, cancel, spawn
+from lunrdriver.lunr.pool import urlopen
+from lunrdriver.lunr.ratelimit import RateLimited
+from lunrdriver.lunr.retry import RetryPolicy
+from lunrdriver.lunr.schedule import PollSchedule
+from lunrdriver.lunr.timeouts import DeadlineExceeded, Timeouts
 
 LOG = logging.getLogger('cinder.volume.lunr.client')
 
@@ -33,16 +50,108 @@ def request_id():
         return local.store.context.request_id
 
 
+def get_project_id(context):
+    try:
+        return context.project_id
+    except AttributeError:
+        return context['project_id']
+
+
 class StatusError(Exception):
     pass
 
 
+JSON_BACKENDS = ('ujson', 'simplejson', 'json')
+json_loads = json.loads
+
+
+def set_json_backend(name='auto'):
+    """
+    Pick the module that decodes response bodies.
+
+    :param name: one of JSON_BACKENDS, or 'auto' for the first of them
+                 that's installed
+    :raises ImportError: if the named backend isn't installed
+    """
+    global json_loads
+    if name == 'auto':
+        names = JSON_BACKENDS
+    elif name in JSON_BACKENDS:
+        names = (name,)
+    else:
+        raise ValueError('Unknown json backend %r' % name)
+    for module_name in names:
+        try:
+            module = __import__(module_name)
+        except ImportError:
+            if name != 'auto':
+                raise
+        else:
+            json_loads = module.loads
+            return module_name
+
+
+def check_status(poll, resp):
+    """
+    :param poll: the Poll of a wait on resp's resource
+
+    :returns: True if resp has the resource in one of the statuses waited on
+    :raises StatusError: if it's in some other status that isn't
+                         transitional
+    """
+    status = resp.body['status']
+    if status in poll.statuses:
+        poll.finish(status)
+        return True
+    poll.observe(status)
+    if not status.endswith('ING'):
+        raise StatusError('resource entered %s status while waiting on %s' %
+                          (status, poll.statuses))
+    return False
+
+
+_missing = object()
+
+
+class LunrResponse(object):
+    """
+    A Lunr api response.
+
+    The body is read in full before the response is handed out, so the
+    connection goes back to the pool right away, and the json is decoded
+    on first access to `body`. Callers that only care about success never
+    pay for it.
+    """
+
+    __slots__ = ('status', 'headers', 'raw', '_body')
+
+    def __init__(self, status, headers, raw, body=_missing):
+        self.status = status
+        self.headers = headers
+        self.raw = raw
+        self._body = body
+
+    @property
+    def body(self):
+        if self._body is _missing:
+            self._body = json_loads(self.raw)
+        return self._body
+
+    def getcode(self):
+        return self.status
+
+    def copy(self):
+        return LunrResponse(self.status, self.headers, self.raw)
+
+
 class LunrResource(object):
     """
     Base class for Lunr api resource CRUD.
 
     Concrete classes need to define a `resource_path` attribute for the
-    benifit of `get_path`.
+    benifit of `get_path`, and a `name` to pick their request timeouts.
+
+    Every method accepts an optional `deadline` keyword argument.
     """
 
     def __init__(self, client):
@@ -53,70 +162,204 @@ class LunrResource(object):
             return self.resource_path + '/%s' % _id
         return self.resource_path
 
-    def get(self, _id):
-        return self.client._execute('GET', self.get_path(_id))
+    def _execute(self, method, path, **kwargs):
+        return self.client._execute(method, path, resource=self.name,
+                                    **kwargs)
+
+    def get(self, _id, **kwargs):
+        return self._execute('GET', self.get_path(_id), **kwargs)
 
     def list(self, **kwargs):
-        return self.client._execute('GET', self.get_path(), **kwargs)
+        return self._execute('GET', self.get_path(), **kwargs)
 
     def create(self, _id, **params):
-        return self.client._execute('PUT', self.get_path(_id), **params)
+        return self._execute('PUT', self.get_path(_id), **params)
+
+    def delete(self, _id, **kwargs):
+        return self._execute('DELETE', self.get_path(_id), **kwargs)
+
+    def watch(self, _id, **params):
+        """
+        Ask Lunr to call back when the resource with _id changes status.
+        """
+        return self._execute('PUT', self.get_path(_id) + '/watch', **params)
+
+    def wait_on_status(self, _id, *statuses, **kwargs):
+        """
+        Wait until the resource with _id enters one of statuses.
 
-    def delete(self, _id):
-        return self.client._execute('DELETE', self.get_path(_id))
+        Accepts the optional keyword arguments `deadline`, and `size` for
+        the size of the volume involved, which goes into how long the wait
+        is expected to take.
 
-    def wait_on_status(self, _id, *statuses):
+        Lunr is asked to tell us about the status if the client has a
+        status_push, a StatusWatcher polls for it if the client has one,
+        otherwise we poll ourselves.
+        """
         if not statuses:
             raise ValueError("No statuses supplied")
-        backoff = 1
-        max_backoff = 30
+        deadline = kwargs.get('deadline')
+        poll = self.client.poll_schedule.start(self.name, statuses,
+                                               kwargs.get('size'))
+        try:
+            if self.client.status_push:
+                resp = self.client.status_push.wait(self, _id, poll,
+                                                    deadline=deadline)
+                if resp is not None:
+                    return resp
+            if self.client.watcher:
+                return self.client.watcher.wait(self, _id, poll,
+                                                deadline=deadline)
+        except DeadlineExceeded, e:
+            req = self.client._request(
+                self.client.endpoints.primary, 'GET', '%s/%s' % (
+                    self.client.project_id, self.get_path(_id)), {})
+            raise LunrError(req, e)
         while True:
-            resp = self.get(_id)
-            if resp.body['status'] in statuses:
+            delay = poll.delay()
+            if delay:
+                if deadline:
+                    # the next get will fail fast once this runs out
+                    sleep(min(delay, deadline.remaining()))
+                else:
+                    sleep(delay)
+            resp = self.get(_id, deadline=deadline, poll=True)
+            if check_status(poll, resp):
                 return resp
-            if resp.body['status'].endswith('ING'):
-                sleep(backoff)
-                backoff *= 2
-                if backoff > max_backoff:
-                    backoff = max_backoff
-            else:
-                raise StatusError('resource entered %s status while waiting '
-                                'on %s' % (resp.body['status'], statuses))
 
 
 class LunrVolumeResource(LunrResource):
 
+    name = 'volumes'
     resource_path = 'volumes'
 
     def update(self, _id, **params):
-        return self.client._execute('POST', self.get_path(_id), **params)
+        return self._execute('POST', self.get_path(_id), **params)
 
 
 class LunrExportResource(LunrResource):
 
+    name = 'exports'
+
     def get_path(self, _id):
         return 'volumes/%s/export' % _id
 
     def update(self, _id, **params):
-        return self.client._execute('POST', self.get_path(_id), **params)
+        return self._execute('POST', self.get_path(_id), **params)
 
     def delete(self, _id, force=False, **params):
         if force:
-            return self.client._execute('DELETE', self.get_path(_id),
-                                        force=True, **params)
-        return self.client._execute('DELETE', self.get_path(_id), **params)
+            return self._execute('DELETE', self.get_path(_id),
+                                 force=True, **params)
+        return self._execute('DELETE', self.get_path(_id), **params)
+
+    def _bulk(self, method, ids, deadline, params):
+        """
+        Send one request to the bulk exports endpoint of Lunr.
+
+        Lunr answers with the outcome of each volume by id, as a dict of
+        `code` and optionally `reason`.
+
+        :returns: a BulkReport, or None if Lunr has no bulk endpoint
+        """
+        bulk_policy = self.client.bulk_policy
+        if not bulk_policy.supported(self):
+            return None
+        path = 'exports'
+        start = time()
+        try:
+            with bulk_policy.slots:
+                resp = self._execute(method, path, deadline=deadline,
+                                     volumes=','.join(ids), **params)
+        except LunrError, e:
+            if e.code in (400, 404, 405, 501):
+                bulk_policy.unsupported(self, e.code)
+                return None
+            raise
+        bulk_policy.bulk_requests += 1
+        elapsed = time() - start
+        outcomes = resp.body or {}
+        results = []
+        for _id in ids:
+            outcome = outcomes.get(_id, {})
+            code = outcome.get('code', resp.status)
+            result = BulkResult(_id, latency=elapsed)
+            if code // 100 == 2:
+                result.resp = LunrResponse(code, resp.headers, None,
+                                           body=outcome)
+            else:
+                req = self.client._request(
+                    self.client.endpoints.primary, method, '%s/%s' % (
+                        self.client.project_id, self.get_path(_id)), {})
+                result.error = LunrError(req, HTTPError(
+                    req.get_full_url(), code, outcome.get('reason', ''), {},
+                    StringIO(json.dumps(outcome))))
+            results.append(result)
+        return BulkReport(results, elapsed)
+
+    def _many(self, method, ids, func, deadline, params):
+        ids = list(ids)
+        report = None
+        if len(ids) > 1:
+            report = self._bulk(method, ids, deadline, params)
+        if report is None:
+            report = self.client.bulk_policy.run(func, ids)
+        self.client.bulk_policy.record(report)
+        return report
+
+    def update_many(self, ids, deadline=None, **params):
+        """
+        Update the exports of many volumes alike.
+
+        :returns: a BulkReport of the LunrResponse or LunrError of each
+                  volume id
+        """
+        return self._many('POST', ids, lambda _id: self.update(
+            _id, deadline=deadline, **params), deadline, params)
+
+    def delete_many(self, ids, force=False, deadline=None, **params):
+        """
+        Delete the exports of many volumes.
+
+        :returns: a BulkReport of the LunrResponse or LunrError of each
+                  volume id
+        """
+        if force:
+            params['force'] = True
+        return self._many('DELETE', ids, lambda _id: self.delete(
+            _id, deadline=deadline, **params), deadline, params)
 
 
 class LunrBackupResource(LunrResource):
 
+    name = 'backups'
     resource_path = 'backups'
 
 
 class LunrTypeResource(LunrResource):
 
+    name = 'volume_types'
     resource_path = 'volume_types'
 
 
+class LunrNodeResource(LunrResource):
+
+    name = 'nodes'
+    resource_path = 'nodes'
+
+
+def shared_failure(e, deadline=None):
+    """
+    Failures of a coalesced GET everyone waiting on it gets. Running out of
+    time or rate limit is down to the caller that sent it, as is a timeout
+    cut short by it's deadline, the rest try for themselves.
+    """
+    if deadline and not deadline.remaining():
+        return False
+    return not isinstance(getattr(e, 'cause', None),
+                          (DeadlineExceeded, RateLimited))
+
+
 class LunrError(Exception):
     # Catch IOError to handle uncaught SSL Errors
     exceptions = (urllib2.URLError, HTTPException, urllib2.HTTPError, IOError)
@@ -129,6 +372,7 @@ class LunrError(Exception):
         self.method = req.get_method()
         self.url = req.get_full_url()
         self.detail = "%s on %s " % (self.method, self.url)
+        self.cause = e
 
         if type(e) is socket.timeout:
             self.detail += "failed with socket timeout"
@@ -155,6 +399,22 @@ class LunrError(Exception):
             self.detail += "failed with '%s'" % e.reason
             self.reason = e.reason
 
+        if type(e) is DeadlineExceeded:
+            self.detail += "failed with '%s'" % e
+            self.reason = str(e)
+            self.title = exc.HTTPGatewayTimeout.title
+            self.code = exc.HTTPGatewayTimeout.code
+
+        if type(e) is CircuitOpen:
+            self.detail += "failed with '%s'" % e
+            self.reason = str(e)
+
+        if type(e) is RateLimited:
+            self.detail += "failed with '%s'" % e
+            self.reason = str(e)
+            self.title = 'Too Many Requests'
+            self.code = 429
+
         if type(e) is IOError:
             self.detail += "failed with '%s'" % e
             self.reason = str(e)
@@ -181,43 +441,302 @@ class LunrError(Exception):
 
 class LunrClient(object):
 
-    def __init__(self, url, context, logger=None):
+    def __init__(self, url, context, logger=None, timeouts=None,
+                 retry_policy=None, hedge_policy=None, single_flight=None,
+                 watcher=None, poll_schedule=None, status_push=None,
+                 bulk_policy=None, rate_limiter=None):
         """
         Create a LunrClient object for the driver.
 
-        :param url: Lunr endpoint url
+        :param url: Lunr endpoint url, a list of them, or a LoadBalancer
+                    shared with other clients.
         :param context: can be a cinder context, or volume - anything with a
                         project_id attribute.
         :param logger: optionally use the callers logger to tie client debug
                        messages to the component instead of the module.
+        :param timeouts: a Timeouts instance, the default waits at most 10
+                         seconds to connect and 120 seconds on reads.
+        :param retry_policy: a RetryPolicy instance, by default failed
+                             requests are not retried.
+        :param hedge_policy: an optional HedgePolicy, slow GETs are sent a
+                             second time according to it.
+        :param single_flight: an optional SingleFlight, concurrent identical
+                              GETs share one request through it.
+        :param watcher: an optional StatusWatcher, wait_on_status registers
+                        with it instead of polling on it's own.
+        :param poll_schedule: a PollSchedule shared with other clients, so
+                              they learn how long waits take together.
+        :param status_push: an optional LongPoller or CallbackListener,
+                            to have Lunr tell us about status changes
+                            instead of polling for them.
+        :param bulk_policy: a BulkPolicy shared with other clients, so bulk
+                            operations are bounded together.
+        :param rate_limiter: an optional RateLimiter shared with other
+                             clients, requests wait their turn on it.
         """
-        try:
-            self.project_id = context.project_id
-        except AttributeError:
-            self.project_id = context['project_id']
+        self.project_id = get_project_id(context)
         self.logger = logger or LOG
-        self.url = url
+        if isinstance(url, LoadBalancer):
+            self.endpoints = url
+        else:
+            self.endpoints = LoadBalancer(url)
+        self.timeouts = timeouts or Timeouts()
+        self.retry_policy = retry_policy or RetryPolicy(attempts=1)
+        self.hedge_policy = hedge_policy
+        self.single_flight = single_flight
+        self.watcher = watcher
+        self.poll_schedule = poll_schedule or PollSchedule()
+        self.status_push = status_push
+        self.bulk_policy = bulk_policy or BulkPolicy()
+        self.rate_limiter = rate_limiter
         self.volumes = LunrVolumeResource(self)
         self.exports = LunrExportResource(self)
         self.backups = LunrBackupResource(self)
         self.types = LunrTypeResource(self)
+        self.nodes = LunrNodeResource(self)
 
-    def _execute(self, method, path, **kwargs):
-        # TODO consider retrying on bad HTTP code
-        path = '%s/%s/%s?%s' % (self.url,
-                                self.project_id, path, urlencode(kwargs))
+    def _request(self, endpoint, method, path, headers):
+        req = Request('%s/%s' % (endpoint.url, path), headers=headers)
+        req.get_method = lambda *args, **kwargs: method
+        return req
+
+    def _execute(self, method, path, resource=None, deadline=None,
+                 hedge=True, poll=False, **kwargs):
+        path = '%s/%s?%s' % (self.project_id, path, urlencode(kwargs))
         try:
             headers = {'X-Request-Id': request_id()}
         except AttributeError:
             self.logger.warning('No threadlocal context!')
             headers = {}
-        req = Request(path, headers=headers)
-        req.get_method = lambda *args, **kwargs: method
+        if method == 'GET' and self.single_flight:
+            # the path has the project and query, so it's all there is to
+            # tell concurrent GETs apart
+            try:
+                resp = self.single_flight.do(
+                    path, lambda: self._send(method, path, headers, resource,
+                                             deadline, hedge, poll),
+                    deadline=deadline,
+                    shared=lambda e: shared_failure(e, deadline))
+            except DeadlineExceeded, e:
+                req = self._request(self.endpoints.primary, method, path,
+                                    headers)
+                raise LunrError(req, e)
+            # everyone gets their own body to decode
+            return resp.copy()
+        return self._send(method, path, headers, resource, deadline, hedge,
+                          poll)
+
+    def _send(self, method, path, headers, resource, deadline, hedge=True,
+              poll=False):
+        attempt = 0
+        waited = 0
+        failed = set()
+        while True:
+            attempt += 1
+            connect_timeout, read_timeout = self.timeouts.get(resource,
+                                                              method)
+            if deadline:
+                remaining = deadline.remaining()
+                if not remaining:
+                    req = self._request(self.endpoints.primary, method, path,
+                                        headers)
+                    raise LunrError(req, DeadlineExceeded(deadline))
+                connect_timeout = min(connect_timeout, remaining)
+                read_timeout = min(read_timeout, remaining)
+            endpoint = self.endpoints.choose(exclude=failed)
+            if not endpoint:
+                req = self._request(self.endpoints.primary, method, path,
+                                    headers)
+                raise LunrError(req, CircuitOpen(
+                    'circuit open for %s' % ', '.join(self.endpoints.urls())))
+            req = self._request(endpoint, method, path, headers)
+            if self.rate_limiter:
+                turn = False
+                try:
+                    self.rate_limiter.wait(method, endpoint.url, poll=poll,
+                                           deadline=deadline)
+                    turn = True
+                except RateLimited, e:
+                    raise LunrError(req, e)
+                finally:
+                    if not turn:
+                        # the request never went out, give back what
+                        # choose took from the breaker
+                        endpoint.breaker.cancel()
+                if deadline:
+                    # the wait came out of it
+                    connect_timeout = min(connect_timeout,
+                                          deadline.remaining())
+                    read_timeout = min(read_timeout, deadline.remaining())
+            req.connect_timeout = connect_timeout
+            try:
+                if method == 'GET' and hedge and self.hedge_policy:
+                    resp = self._hedged_urlopen(endpoint, req, path,
+                                                read_timeout, resource,
+                                                failed)
+                else:
+                    resp = self._urlopen(endpoint, req, read_timeout)
+                resp = self._read(resp)
+                self.logger.debug("%s on %s succeeded with %s" %
+                    (req.get_method(), req.get_full_url(), resp.status))
+                self.retry_policy.succeeded(attempt)
+                return resp
+            except (HTTPError, URLError, HTTPException), e:
+                if endpoint.breaker.is_failure(e):
+                    # fail over to another endpoint if there is one
+                    failed.add(endpoint)
+                delay = self.retry_policy.get_delay(method, e, attempt,
+                                                    waited)
+                if delay is None or (deadline and
+                                     delay >= deadline.remaining()):
+                    raise LunrError(req, e)
+                self.logger.warning("%s on %s failed with '%s', retrying "
+                                    "in %.2fs" % (method, req.get_full_url(),
+                                                  e, delay))
+                sleep(delay)
+                waited += delay
+
+    def _read(self, resp):
+        try:
+            info = getattr(resp, 'info', None)
+            return LunrResponse(resp.getcode(), dict(info()) if info else {},
+                                resp.read())
+        finally:
+            close = getattr(resp, 'close', None)
+            if close:
+                close()
+
+    def _urlopen(self, endpoint, req, timeout):
+        self.endpoints.start(endpoint)
+        start = time()
+        success = None
         try:
-            resp = urlopen(req)
-            resp.body = json.loads(resp.read())
-            self.logger.debug("%s on %s succeeded with %s" %
-                (req.get_method(), req.get_full_url(), resp.getcode()))
+            resp = urlopen(req, timeout=timeout)
+            success = True
             return resp
-        except (HTTPError, URLError, HTTPException), e:
-            raise LunrError(req, e)
+        except Exception, e:
+            success = not endpoint.breaker.is_failure(e)
+            raise
+        finally:
+            # success is still None if we were cancelled
+            self.endpoints.finish(endpoint, time() - start, success)
+
+    def _hedged_urlopen(self, endpoint, req, path, timeout, resource,
+                        failed):
+        """
+        Send a GET, and a second copy of it to another endpoint, or over
+        another connection, if the first is slower than the hedge policy
+        allows for. The first response wins, the loser is cancelled.
+        """
+        delay = self.hedge_policy.delay(resource)
+        if delay is None or delay >= timeout:
+            return self._timed_urlopen(endpoint, req, timeout, resource)
+        results = Queue()
+        started = set()
+
+        def run(endpoint, req, hedge):
+            started.add(hedge)
+            try:
+                resp = self._timed_urlopen(endpoint, req, timeout, resource)
+            except Exception, e:
+                results.put((hedge, req, None, e))
+            else:
+                results.put((hedge, req, resp, None))
+
+        # (thread, hedge, the endpoint whose breaker let it through)
+        threads = [(spawn(run, endpoint, req, False), False, endpoint)]
+        try:
+            try:
+                result = results.get(timeout=delay)
+            except Empty:
+                self.hedge_policy.hedged += 1
+                allowed = self.endpoints.choose(
+                    exclude=failed | set([endpoint]))
+                hedge_endpoint = allowed or endpoint
+                hedge_req = self._request(hedge_endpoint, 'GET', path,
+                                          req.headers)
+                hedge_req.connect_timeout = req.connect_timeout
+                threads.append((spawn(run, hedge_endpoint, hedge_req, True),
+                                True, allowed))
+                result = results.get()
+                if result[3] is not None:
+                    # the first to finish failed, give the other a chance
+                    result = results.get()
+            hedge, req, resp, e = result
+            if hedge:
+                self.hedge_policy.wins += 1
+            if e is not None:
+                raise e
+            return resp
+        finally:
+            for thread, hedge, allowed in threads:
+                cancel(thread)
+                if hedge not in started and allowed:
+                    # killed before it got to _urlopen, which would have
+                    # given back it's trial
+                    allowed.breaker.cancel()
+
+    def _timed_urlopen(self, endpoint, req, timeout, resource):
+        start = time()
+        resp = self._urlopen(endpoint, req, timeout)
+        self.hedge_policy.record(resource, time() - start)
+        return resp
+
+
+class ClientRegistry(object):
+    """
+    Bounded LRU of LunrClients keyed by project.
+
+    Clients are cheap to share, they hold no per-request state. Every
+    client in the registry balances over the same endpoints, and every
+    client in the process goes through the same keep-alive connection
+    pools.
+    """
+
+    def __init__(self, url, logger=None, max_size=1024, **options):
+        """
+        :param url: Lunr endpoint url, a list of them, or a LoadBalancer
+        :param options: passed on to each LunrClient
+        """
+        if isinstance(url, LoadBalancer):
+            self.endpoints = url
+        else:
+            self.endpoints = LoadBalancer(url)
+        self.logger = logger or LOG
+        self.max_size = max_size
+        self.options = options
+        self.hits = 0
+        self.misses = 0
+        self._clients = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, context):
+        """
+        Get the LunrClient for the project of context.
+
+        :param context: anything LunrClient accepts as a context
+        """
+        project_id = get_project_id(context)
+        with self._lock:
+            client = self._clients.pop(project_id, None)
+            if client:
+                self.hits += 1
+                self._clients[project_id] = client
+                return client
+            self.misses += 1
+            client = LunrClient(self.endpoints, {'project_id': project_id},
+                                logger=self.logger, **self.options)
+            self._clients[project_id] = client
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+        return client
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._clients),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
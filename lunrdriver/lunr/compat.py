@@ -0,0 +1,45 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# greenthreads under eventlet, plain threads without it
+try:
+    import eventlet
+    from eventlet import spawn_n
+    from eventlet.queue import LightQueue as Queue, Empty
+
+    def spawn(func, *args):
+        return eventlet.spawn(func, *args)
+
+    def cancel(thread):
+        thread.kill()
+except ImportError:
+    from Queue import Queue, Empty
+    from threading import Thread
+
+    def spawn(func, *args):
+        thread = Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def spawn_n(func, *args, **kwargs):
+        thread = Thread(target=func, args=args, kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+
+    def cancel(thread):
+        # threads can't be killed, the loser just runs to completion
+        pass
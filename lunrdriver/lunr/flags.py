@@ -21,8 +21,9 @@ except ImportError:
 
 
 lunr_opts = [
-    cfg.StrOpt('lunr_api_endpoint', default='http://127.0.0.1:8080/v1.0',
-               help='Lunr API endpoint'),
+    cfg.ListOpt('lunr_api_endpoint', default=['http://127.0.0.1:8080/v1.0'],
+                help='Lunr API endpoints, requests are balanced across all '
+                     'of them'),
     cfg.ListOpt('lunr_volume_types', default=[],
                help='Types belonging to Lunr'),
     cfg.BoolOpt('lunr_volume_clone_enabled', default=True,
@@ -0,0 +1,71 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import defaultdict, deque
+
+
+class HedgePolicy(object):
+    """
+    When to send a second copy of a slow GET.
+
+    A GET that hasn't been answered after the `percentile` of recent
+    latencies for it's resource gets a hedge request, whichever answers
+    first wins and the other is cancelled. Hedging waits for `min_samples`
+    latencies of a resource and is capped at `max_rate` of GET requests so
+    an overloaded api doesn't get twice the load.
+    """
+
+    def __init__(self, percentile=95, min_delay=0.05, max_rate=0.1,
+                 window=200, min_samples=20):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_rate = max_rate
+        self.window = window
+        self.min_samples = min_samples
+        self.requests = 0
+        self.hedged = 0
+        self.wins = 0
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+
+    def record(self, resource, latency):
+        self._samples[resource].append(latency)
+
+    def delay(self, resource):
+        """
+        :returns: seconds to wait before hedging a GET on resource, or None
+                  if the GET shouldn't be hedged
+        """
+        self.requests += 1
+        if self.hedged >= self.max_rate * self.requests:
+            return None
+        samples = self._samples[resource]
+        if len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1,
+                    int(len(ordered) * self.percentile / 100.0))
+        return max(self.min_delay, ordered[index])
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'hedge_rate': (float(self.hedged) / self.requests
+                           if self.requests else 0.0),
+            'wins': self.wins,
+            'win_ratio': (float(self.wins) / self.hedged
+                          if self.hedged else 0.0),
+        }
@@ -0,0 +1,287 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import errno
+import httplib
+import socket
+import urllib2
+
+from StringIO import StringIO
+from time import time
+from urllib2 import URLError, addinfourl
+
+try:
+    from eventlet.semaphore import Semaphore as Lock
+except ImportError:
+    from threading import Lock
+
+
+# methods that are safe to send again if the server might have seen them
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'DELETE')
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive connections to a single host:port.
+
+    Idle connections are handed out most recently used first, connections
+    that sat idle longer than `idle_timeout` or served `max_requests`
+    requests are closed instead of reused.
+    """
+
+    def __init__(self, conn_class, host, size=10, idle_timeout=60,
+                 max_requests=100):
+        self.conn_class = conn_class
+        self.host = host
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.hits = 0
+        self.misses = 0
+        self._idle = []
+        self._lock = Lock()
+
+    def get(self, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, fresh=False):
+        """
+        Checkout a connection.
+
+        :param timeout: connect timeout for new connections
+        :param fresh: skip the idle connections and open a new one
+
+        :returns: (conn, reused)
+        """
+        now = time()
+        expired = []
+        conn = None
+        with self._lock:
+            while self._idle and not fresh:
+                candidate = self._idle.pop()
+                if now - candidate.last_used > self.idle_timeout:
+                    expired.append(candidate)
+                    continue
+                conn = candidate
+                self.hits += 1
+                break
+            else:
+                self.misses += 1
+        for stale in expired:
+            stale.close()
+        if conn:
+            return conn, True
+        conn = self.conn_class(self.host, timeout=timeout)
+        conn.requests = 0
+        return conn, False
+
+    def put(self, conn):
+        """
+        Checkin a connection after it's response has been fully read.
+        """
+        if conn.requests >= self.max_requests:
+            conn.close()
+            return
+        conn.last_used = time()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'idle': len(self._idle),
+        }
+
+
+class PoolManager(object):
+    """
+    Shared registry of ConnectionPools, one per scheme and host:port.
+    """
+
+    def __init__(self, size=10, idle_timeout=60, max_requests=100):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.pools = {}
+        self._lock = Lock()
+        self.opener = urllib2.build_opener(KeepAliveHandler(self),
+                                           KeepAliveHTTPSHandler(self))
+
+    def configure(self, size=None, idle_timeout=None, max_requests=None):
+        if size is not None:
+            self.size = size
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        if max_requests is not None:
+            self.max_requests = max_requests
+        with self._lock:
+            pools = self.pools.values()
+        for pool in pools:
+            pool.size = self.size
+            pool.idle_timeout = self.idle_timeout
+            pool.max_requests = self.max_requests
+
+    def get_pool(self, conn_class, host):
+        key = (conn_class, host)
+        with self._lock:
+            try:
+                return self.pools[key]
+            except KeyError:
+                pool = ConnectionPool(conn_class, host, size=self.size,
+                                      idle_timeout=self.idle_timeout,
+                                      max_requests=self.max_requests)
+                self.pools[key] = pool
+                return pool
+
+    def clear(self):
+        with self._lock:
+            pools, self.pools = self.pools.values(), {}
+        for pool in pools:
+            pool.close()
+
+    def stats(self):
+        stats = {'hits': 0, 'misses': 0, 'idle': 0, 'pools': 0}
+        with self._lock:
+            pools = self.pools.values()
+        for pool in pools:
+            stats['pools'] += 1
+            for key, value in pool.stats().items():
+                stats[key] += value
+        return stats
+
+    def _request(self, pool, req, headers, fresh=False):
+        """
+        :returns: (response, body) or None if a reused connection had
+                  already been closed by the server, and the request can
+                  be sent again
+        """
+        connect_timeout = getattr(req, 'connect_timeout', req.timeout)
+        conn, reused = pool.get(connect_timeout, fresh=fresh)
+        conn.requests += 1
+        sent = False
+        try:
+            if not conn.sock:
+                conn.connect()
+            _settimeout(conn, req.timeout)
+            conn.request(req.get_method(), req.get_selector(), req.data,
+                         headers)
+            sent = True
+            r = conn.getresponse()
+            body = r.read()
+        except (httplib.BadStatusLine, socket.error), e:
+            conn.close()
+            # once the whole request went out the server may have acted
+            # on it, only requests that can safely run twice are resent
+            if reused and _is_stale(e) and \
+                    (not sent or req.get_method() in IDEMPOTENT_METHODS):
+                return None
+            raise
+        except BaseException:
+            # including the GreenletExit of a cancelled request
+            conn.close()
+            raise
+        if r.will_close:
+            conn.close()
+        else:
+            pool.put(conn)
+        return r, body
+
+    def do_open(self, conn_class, req):
+        """
+        Pooled version of urllib2.AbstractHTTPHandler.do_open
+
+        The response body is read before the connection is returned to the
+        pool, the addinfourl we give back to the opener is backed by a
+        StringIO and holds no reference to the socket.
+        """
+        host = req.get_host()
+        if not host:
+            raise URLError('no host given')
+        pool = self.get_pool(conn_class, host)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+
+        try:
+            result = self._request(pool, req, headers)
+            if result is None:
+                # the server closed an idle keep-alive connection out from
+                # under us, that's worth one more go on a new connection
+                result = self._request(pool, req, headers, fresh=True)
+        except socket.error, e:
+            raise URLError(e)
+        r, body = result
+
+        resp = addinfourl(StringIO(body), r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
+
+
+def _settimeout(conn, timeout):
+    conn.timeout = timeout
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = socket.getdefaulttimeout()
+    conn.sock.settimeout(timeout)
+
+
+def _is_stale(e):
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    if isinstance(e, socket.timeout):
+        return False
+    return e.errno in (errno.ECONNRESET, errno.EPIPE)
+
+
+class KeepAliveHandler(urllib2.HTTPHandler):
+
+    def __init__(self, manager):
+        urllib2.HTTPHandler.__init__(self)
+        self.manager = manager
+
+    def http_open(self, req):
+        return self.manager.do_open(httplib.HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(urllib2.HTTPSHandler):
+
+    def __init__(self, manager):
+        urllib2.HTTPSHandler.__init__(self)
+        self.manager = manager
+
+    def https_open(self, req):
+        return self.manager.do_open(httplib.HTTPSConnection, req)
+
+
+manager = PoolManager()
+
+
+def urlopen(req, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """
+    Drop in replacement for urllib2.urlopen using the shared keep-alive
+    connection pools.
+    """
+    return manager.opener.open(req, timeout=timeout)
@@ -0,0 +1,255 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import math
+import socket
+from uuid import uuid4
+
+from webob import exc, Response
+from webob.dec import wsgify
+
+try:
+    import eventlet
+    import eventlet.wsgi
+    from eventlet.queue import LightQueue as Queue, Empty
+
+    def serve(host, port, app):
+        sock = eventlet.listen((host, port))
+        thread = eventlet.spawn(eventlet.wsgi.server, sock, app,
+                                log_output=False)
+
+        def stop():
+            thread.kill()
+            sock.close()
+        return sock.getsockname()[1], stop
+except ImportError:
+    from Queue import Queue, Empty
+    from threading import Thread
+    from wsgiref.simple_server import make_server
+
+    def serve(host, port, app):
+        server = make_server(host, port, app)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return server.server_port, stop
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrError, LunrResponse, check_status
+from lunrdriver.lunr.recheck import Unsupported
+from lunrdriver.lunr.timeouts import DeadlineExceeded
+
+
+LOG = logging.getLogger('cinder.volume.lunr.push')
+
+# set by a Lunr api that held on to a GET with wait_for
+LONG_POLL_HEADER = 'X-Lunr-Long-Poll'
+
+
+class StatusPush(object):
+    """
+    Base class for ways of having Lunr tell us about status changes.
+
+    Endpoints that turn out not to support it are left alone for `recheck`
+    seconds, waits on them return None so the caller can poll instead.
+    """
+
+    def __init__(self, recheck=300):
+        self.recheck = recheck
+        self.requests = 0
+        self.pushed = 0
+        self._unsupported = Unsupported(
+            'Lunr can not push %s status (%s), polling instead for the '
+            'next %ss', LOG, recheck=recheck)
+
+    def supported(self, resource):
+        return self._unsupported.supported(resource)
+
+    def unsupported(self, resource, reason):
+        self._unsupported.unsupported(resource, reason)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'pushed': self.pushed,
+            'fallbacks': self._unsupported.fallbacks,
+            'unsupported': self._unsupported.names(),
+        }
+
+
+class LongPoller(StatusPush):
+    """
+    Have the Lunr api hold on to a GET until the status shows up.
+
+    The GET carries `wait_for`, the statuses waited on, and `timeout`, the
+    seconds the api may hold on to it. An api that knows how answers with
+    the LONG_POLL_HEADER set, without it we fall back to polling.
+    """
+
+    def __init__(self, timeout=30, **kwargs):
+        super(LongPoller, self).__init__(**kwargs)
+        self.timeout = timeout
+
+    def wait(self, resource, _id, poll, deadline=None):
+        """
+        :returns: a LunrResponse with the resource in one of the statuses of
+                  poll, or None if the endpoint can't do long polls
+        """
+        if not self.supported(resource):
+            return None
+        while True:
+            timeout = self.timeout
+            if deadline:
+                timeout = min(timeout, deadline.remaining())
+            try:
+                # hedging a request that's slow on purpose would be silly
+                resp = resource.get(_id, deadline=deadline, hedge=False,
+                                    poll=True,
+                                    wait_for=','.join(poll.statuses),
+                                    timeout=int(math.ceil(timeout)))
+            except LunrError, e:
+                if e.code in (400, 501):
+                    self.unsupported(resource, e.code)
+                    return None
+                raise
+            self.requests += 1
+            if check_status(poll, resp):
+                self.pushed += 1
+                return resp
+            if LONG_POLL_HEADER.lower() not in resp.headers:
+                self.unsupported(resource, 'no %s header' % LONG_POLL_HEADER)
+                return None
+
+
+class Callback(object):
+
+    def __init__(self):
+        self.updates = Queue()
+
+
+class CallbackListener(StatusPush):
+    """
+    Have the Lunr api call us back when a status changes.
+
+    Waits register a callback url with the api through
+    LunrResource.watch, the api POSTs the resource to it as json whenever
+    it's status changes. Callbacks can get lost, so a wait still polls the
+    resource every `safety_interval` seconds.
+
+    :param host: address to listen on
+    :param port: port to listen on, 0 for any free one
+    :param advertise: address the Lunr api can reach us on, defaults to
+                      host, or the hostname if host is 0.0.0.0
+    """
+
+    def __init__(self, host='0.0.0.0', port=0, advertise=None,
+                 safety_interval=60, **kwargs):
+        super(CallbackListener, self).__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.advertise = advertise
+        self.safety_interval = safety_interval
+        self.url = None
+        self._stop = None
+        self._callbacks = {}
+
+    def start(self):
+        if self.url:
+            return
+        port, self._stop = serve(self.host, self.port, self)
+        address = self.advertise or self.host
+        if address == '0.0.0.0':
+            address = socket.gethostname()
+        self.url = 'http://%s:%s' % (address, port)
+        LOG.info('listening for Lunr status callbacks on %s' % self.url)
+
+    def stop(self):
+        if self._stop:
+            self._stop()
+        self._stop = self.url = None
+
+    @wsgify
+    def __call__(self, req):
+        if req.method != 'POST':
+            return exc.HTTPMethodNotAllowed()
+        callback = self._callbacks.get(req.path_info.strip('/'))
+        if not callback:
+            # done waiting, or never heard of it
+            return exc.HTTPNotFound()
+        try:
+            body = json.loads(req.body)
+            body['status']
+        except (ValueError, KeyError, TypeError):
+            return exc.HTTPBadRequest()
+        callback.updates.put(body)
+        return Response(status=204)
+
+    def wait(self, resource, _id, poll, deadline=None):
+        """
+        :returns: a LunrResponse with the resource in one of the statuses of
+                  poll, or None if the endpoint can't do callbacks
+        """
+        if not self.url or not self.supported(resource):
+            return None
+        token = uuid4().hex
+        callback = self._callbacks[token] = Callback()
+        try:
+            try:
+                self.requests += 1
+                resp = resource.watch(_id, deadline=deadline,
+                                      callback_url='%s/%s' % (self.url,
+                                                              token),
+                                      wait_for=','.join(poll.statuses))
+            except LunrError, e:
+                if e.code in (400, 404, 405, 501):
+                    self.unsupported(resource, e.code)
+                    return None
+                raise
+            # the api answers with where the resource is at right now
+            if check_status(poll, resp):
+                return resp
+            while True:
+                timeout = self.safety_interval
+                if deadline:
+                    timeout = min(timeout, deadline.remaining())
+                    if timeout <= 0:
+                        raise DeadlineExceeded(deadline)
+                try:
+                    body = callback.updates.get(timeout=timeout)
+                except Empty:
+                    resp = resource.get(_id, deadline=deadline, poll=True)
+                else:
+                    self.pushed += 1
+                    resp = LunrResponse(200, {}, None, body=body)
+                if check_status(poll, resp):
+                    return resp
+        finally:
+            del self._callbacks[token]
+
+    def stats(self):
+        stats = super(CallbackListener, self).stats()
+        stats['url'] = self.url
+        stats['waiting'] = len(self._callbacks)
+        return stats
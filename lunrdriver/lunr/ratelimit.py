@@ -0,0 +1,162 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from time import time
+
+try:
+    from eventlet import sleep
+    from eventlet.semaphore import Semaphore as Lock
+except ImportError:
+    from threading import Lock
+    from time import sleep
+
+from lunrdriver.lunr.schedule import Histogram
+
+
+# kinds of requests with a rate of their own
+METHOD_CLASSES = ('reads', 'writes', 'polls')
+
+# upper bounds of the wait time histogram buckets, in seconds
+WAIT_BOUNDS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30)
+
+
+class RateLimited(Exception):
+
+    def __init__(self, method_class, endpoint, wait):
+        self.method_class = method_class
+        self.endpoint = endpoint
+        self.wait = wait
+        super(RateLimited, self).__init__(
+            'rate limit of %s to %s exceeded, next request allowed in '
+            '%.2fs' % (method_class, endpoint, wait))
+
+
+def method_class(method, poll=False):
+    if poll:
+        return 'polls'
+    if method in ('GET', 'HEAD'):
+        return 'reads'
+    return 'writes'
+
+
+class TokenBucket(object):
+    """
+    Lets `rate` requests a second through, and up to `burst` at once after
+    a quiet spell.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.updated = time()
+
+    def reserve(self, max_wait):
+        """
+        Take a token, maybe one that hasn't come in yet.
+
+        :returns: seconds until the token is in, or None if that's longer
+                  than max_wait and nothing was taken
+        """
+        now = time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+
+    def next_token(self):
+        """
+        :returns: seconds until a token is free
+        """
+        tokens = self.tokens + (time() - self.updated) * self.rate
+        return max(0.0, (1 - tokens) / self.rate)
+
+
+class RateLimiter(object):
+    """
+    Token buckets for each method class of request to each Lunr endpoint.
+
+    `rates` has the requests a second allowed of each method class, a
+    class without one isn't limited. Requests over the rate wait for their
+    token up to `max_wait` seconds, or until their deadline, and fail with
+    RateLimited if it would take longer. With `max_wait` 0 they fail
+    right away.
+    """
+
+    def __init__(self, rates=None, burst=10, max_wait=10):
+        self.rates = dict((cls, rate) for cls, rate in (rates or {}).items()
+                          if rate and rate > 0)
+        self.burst = burst
+        self.max_wait = max_wait
+        self.requests = dict((cls, 0) for cls in METHOD_CLASSES)
+        self.throttled = dict((cls, 0) for cls in METHOD_CLASSES)
+        self.rejected = dict((cls, 0) for cls in METHOD_CLASSES)
+        self.waits = dict((cls, Histogram(bounds=WAIT_BOUNDS))
+                          for cls in METHOD_CLASSES)
+        self._buckets = {}
+        self._lock = Lock()
+
+    def _bucket(self, cls, endpoint):
+        key = (cls, endpoint)
+        bucket = self._buckets.get(key)
+        if not bucket:
+            bucket = self._buckets[key] = TokenBucket(self.rates[cls],
+                                                      self.burst)
+        return bucket
+
+    def wait(self, method, endpoint, poll=False, deadline=None):
+        """
+        Wait for the turn of a request to endpoint.
+
+        :param endpoint: the url of the endpoint
+        :param poll: True if the request is polling for a status
+        :raises RateLimited: if the turn is too far off
+        """
+        cls = method_class(method, poll=poll)
+        self.requests[cls] += 1
+        if cls not in self.rates:
+            return
+        max_wait = self.max_wait
+        if deadline:
+            max_wait = min(max_wait, deadline.remaining())
+        with self._lock:
+            bucket = self._bucket(cls, endpoint)
+            wait = bucket.reserve(max_wait)
+            if wait is None:
+                self.rejected[cls] += 1
+                raise RateLimited(cls, endpoint, bucket.next_token())
+        self.waits[cls].add(wait)
+        if wait:
+            self.throttled[cls] += 1
+            sleep(wait)
+
+    def stats(self):
+        stats = {}
+        for cls in METHOD_CLASSES:
+            waits = self.waits[cls].stats()
+            stats[cls] = {
+                'rate': self.rates.get(cls),
+                'requests': self.requests[cls],
+                'throttled': self.throttled[cls],
+                'rejected': self.rejected[cls],
+                'mean_wait': waits['mean'],
+                'wait': waits['buckets'],
+            }
+        return stats
@@ -0,0 +1,58 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from time import time
+
+
+class Unsupported(object):
+    """
+    The Lunr resources an api turned out not to support something for.
+
+    They're left alone for `recheck` seconds, after that the next caller
+    gets to try again.
+    """
+
+    def __init__(self, message, logger, recheck=300):
+        """
+        :param message: warning logged when a resource is first found out,
+                        formatted with the resource name, the reason and
+                        recheck
+        """
+        self.message = message
+        self.logger = logger
+        self.recheck = recheck
+        self.fallbacks = 0
+        self._since = {}
+
+    def supported(self, resource):
+        since = self._since.get(resource.name)
+        if since is None:
+            return True
+        if time() - since >= self.recheck:
+            del self._since[resource.name]
+            return True
+        self.fallbacks += 1
+        return False
+
+    def unsupported(self, resource, reason):
+        if resource.name not in self._since:
+            self.logger.warning(self.message % (resource.name, reason,
+                                                self.recheck))
+        self._since[resource.name] = time()
+        self.fallbacks += 1
+
+    def names(self):
+        return sorted(self._since)
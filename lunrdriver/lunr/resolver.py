@@ -0,0 +1,216 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import socket
+from time import time
+
+try:
+    from eventlet import Timeout, sleep, tpool
+    from eventlet.semaphore import Semaphore
+
+    def call_with_timeout(timeout, func, *args):
+        """
+        Run func in a native thread so it can't block the hub.
+        """
+        with Timeout(timeout, ResolveTimeout()):
+            return tpool.execute(func, *args)
+except ImportError:
+    from threading import Semaphore, Thread
+    from time import sleep
+
+    def call_with_timeout(timeout, func, *args):
+        result = {}
+
+        def run():
+            try:
+                result['value'] = func(*args)
+            except Exception, e:
+                result['error'] = e
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            raise ResolveTimeout()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.compat import spawn_n
+from lunrdriver.lunr.schedule import Histogram
+from lunrdriver.lunr.singleflight import SingleFlight
+
+
+LOG = logging.getLogger('cinder.volume.lunr.resolver')
+
+# upper bounds of the lookup latency histogram buckets, in seconds
+LATENCY_BOUNDS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2, 5)
+
+
+class ResolveTimeout(Exception):
+    pass
+
+
+class Resolver(object):
+    """
+    Shared, caching hostname resolver.
+
+    Lookups run in at most `workers` native threads at once, and give up
+    after `timeout` seconds. Addresses are cached for `ttl` seconds,
+    failures for `negative_ttl`. If a lookup fails an expired address is
+    used rather than none. With prefetch on, hostnames that were looked up
+    before are looked up again in the background before they expire.
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, timeout=2, workers=4,
+                 prefetch=False):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.workers = workers
+        self.prefetch = prefetch
+        self._workers = Semaphore(workers)
+        self._single_flight = SingleFlight()
+        self._prefetching = False
+        self.clear()
+
+    def configure(self, ttl=None, negative_ttl=None, timeout=None,
+                  workers=None, prefetch=None):
+        if ttl is not None:
+            self.ttl = ttl
+        if negative_ttl is not None:
+            self.negative_ttl = negative_ttl
+        if timeout is not None:
+            self.timeout = timeout
+        if workers is not None and workers != self.workers:
+            self.workers = workers
+            self._workers = Semaphore(workers)
+        if prefetch is not None:
+            self.prefetch = prefetch
+        if self.prefetch and not self._prefetching:
+            self._prefetching = True
+            spawn_n(self._prefetch_forever)
+
+    def clear(self):
+        # hostname: (address or None, expires)
+        self._cache = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.stale = 0
+        self.latency = Histogram(bounds=LATENCY_BOUNDS)
+
+    def _gethostbyname(self, hostname):
+        with self._workers:
+            start = time()
+            try:
+                return call_with_timeout(self.timeout, socket.gethostbyname,
+                                         hostname)
+            finally:
+                self.latency.add(time() - start)
+
+    def _lookup(self, hostname):
+        """
+        Look the hostname up and cache what comes of it.
+        """
+        try:
+            address = self._gethostbyname(hostname)
+        except (socket.error, ResolveTimeout), e:
+            if isinstance(e, ResolveTimeout):
+                self.timeouts += 1
+                LOG.warning('looking up %s took more than %ss' %
+                            (hostname, self.timeout))
+            else:
+                self.failures += 1
+            cached = self._cache.get(hostname)
+            if cached and cached[0]:
+                # better than nothing
+                self.stale += 1
+                address = cached[0]
+            else:
+                address = None
+            self._cache[hostname] = (address, time() + self.negative_ttl)
+            return address
+        self._cache[hostname] = (address, time() + self.ttl)
+        return address
+
+    def resolve(self, hostname):
+        """
+        :returns: the ip of hostname, or None if it can't be resolved
+        """
+        cached = self._cache.get(hostname)
+        if cached and cached[1] > time():
+            if cached[0]:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return cached[0]
+        self.misses += 1
+        return self._single_flight.do(hostname,
+                                      lambda: self._lookup(hostname))
+
+    def resolve_portal(self, target_portal):
+        """
+        :param target_portal: a string, in the format "hostname:port"
+
+        :returns: "host_ip:port" or "hostname:port" if lookup fails
+        """
+        hostname, port = target_portal.split(':')
+        host_ip = self.resolve(hostname)
+        if not host_ip:
+            # this host can't resolve, just pass the name through
+            return target_portal
+        return ':'.join((host_ip, port))
+
+    def _prefetch_forever(self):
+        while self.prefetch:
+            # look up whatever expires before we're back
+            horizon = time() + self.ttl / 2.0
+            for hostname, (address, expires) in self._cache.items():
+                if expires <= horizon:
+                    try:
+                        self._single_flight.do(
+                            hostname, lambda: self._lookup(hostname))
+                    except Exception:
+                        LOG.exception('failed to prefetch %s' % hostname)
+            sleep(max(self.ttl / 4.0, 1))
+        self._prefetching = False
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'cached': len(self._cache),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': (float(self.hits + self.negative_hits) / lookups
+                         if lookups else 0.0),
+            'timeouts': self.timeouts,
+            'failures': self.failures,
+            'stale': self.stale,
+            'latency': self.latency.stats(),
+        }
+
+
+# shared by everything that resolves target portals in the process
+resolver = Resolver()
@@ -0,0 +1,112 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+import socket
+
+from email.utils import mktime_tz, parsedate_tz
+from httplib import HTTPException
+from time import time
+from urllib2 import HTTPError, URLError
+
+
+class RetryPolicy(object):
+    """
+    Decides if and when a failed Lunr api request is tried again.
+
+    Only idempotent methods are retried, POST never is. Connection errors
+    and 502/503/504 responses are retried with full jitter exponential
+    backoff, a Retry-After header from the server wins over the backoff.
+    A read timeout may mean the server is still working on the request, so
+    those are only retried for GET.
+
+    Retries stop after `attempts` total tries, or once the sleeps between
+    them would add up to more than `budget` seconds.
+    """
+
+    idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE')
+    retry_codes = (502, 503, 504)
+
+    def __init__(self, attempts=3, backoff=0.5, max_backoff=10, budget=30):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.retries = 0
+        self.recovered = 0
+        self.exhausted = 0
+
+    def is_retryable(self, method, e):
+        if method not in self.idempotent_methods:
+            return False
+        if isinstance(e, HTTPError):
+            return e.code in self.retry_codes
+        if isinstance(e, URLError):
+            if isinstance(e.reason, socket.timeout):
+                return method == 'GET'
+            return True
+        return isinstance(e, HTTPException)
+
+    def retry_after(self, e):
+        """
+        Seconds the server asked us to wait in it's Retry-After header.
+        """
+        if not isinstance(e, HTTPError) or not e.hdrs:
+            return None
+        value = e.hdrs.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0, int(value))
+        except ValueError:
+            date = parsedate_tz(value)
+            if not date:
+                return None
+            return max(0, mktime_tz(date) - time())
+
+    def get_delay(self, method, e, attempt, waited):
+        """
+        :param method: http method of the failed request
+        :param e: the exception the request failed with
+        :param attempt: number of tries made so far
+        :param waited: seconds already spent sleeping between tries
+
+        :returns: seconds to sleep before the next try, or None to give up
+        """
+        if attempt >= self.attempts or not self.is_retryable(method, e):
+            if attempt > 1:
+                self.exhausted += 1
+            return None
+        delay = self.retry_after(e)
+        if delay is None:
+            ceiling = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            delay = random.uniform(0, ceiling)
+        if waited + delay > self.budget:
+            self.exhausted += 1
+            return None
+        self.retries += 1
+        return delay
+
+    def succeeded(self, attempt):
+        if attempt > 1:
+            self.recovered += 1
+
+    def stats(self):
+        return {
+            'retries': self.retries,
+            'recovered': self.recovered,
+            'exhausted': self.exhausted,
+        }
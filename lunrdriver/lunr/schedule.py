@@ -0,0 +1,227 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from bisect import bisect_left
+from collections import defaultdict, deque
+from time import time
+
+try:
+    from eventlet.semaphore import Semaphore as Lock
+except ImportError:
+    from threading import Lock
+
+
+# upper bounds of the time in state histogram buckets, in seconds
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def size_bucket(size):
+    """
+    Group volume sizes by order of magnitude, 1, 10, 100, ... GB
+    """
+    if not size:
+        return None
+    bucket = 1
+    while bucket < size:
+        bucket *= 10
+    return bucket
+
+
+def size_label(bucket):
+    if bucket is None:
+        return 'any size'
+    return 'up to %sGB' % bucket
+
+
+def percentile(ordered, pct):
+    index = min(len(ordered) - 1, int(len(ordered) * pct / 100.0))
+    return ordered[index]
+
+
+class Histogram(object):
+
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def stats(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'buckets': zip(self.bounds + ('+Inf',), self.counts),
+        }
+
+
+class Poll(object):
+    """
+    The polling of one resource while waiting on it's status.
+    """
+
+    def __init__(self, schedule, resource, statuses, bucket, expected):
+        self.schedule = schedule
+        self.resource = resource
+        self.statuses = statuses
+        self.bucket = bucket
+        self.expected = expected
+        self.started = time()
+        self.backoff = None
+        self.first_status = None
+        self.status = None
+        self.since = None
+
+    def delay(self):
+        """
+        :returns: seconds to wait before the next poll
+        """
+        elapsed = time() - self.started
+        if self.expected:
+            low, high = self.expected
+            if elapsed < low:
+                # nothing to see before then
+                return low - elapsed
+            if elapsed < high:
+                return max(self.schedule.min_interval,
+                           (high - low) / self.schedule.tight_polls)
+        elif self.backoff is None:
+            # never done this before, have a look right away
+            self.backoff = self.schedule.initial
+            return 0
+        if self.backoff is None:
+            self.backoff = self.schedule.initial
+        delay = self.backoff
+        self.backoff = min(self.backoff * 2, self.schedule.max_backoff)
+        return delay
+
+    def observe(self, status):
+        now = time()
+        if self.status is None:
+            self.first_status = status
+            self.status = status
+            self.since = self.started
+        elif status != self.status:
+            self.schedule.record_state(self.resource, self.status,
+                                       now - self.since)
+            self.status = status
+            self.since = now
+
+    def finish(self, status):
+        self.observe(status)
+        self.schedule.record(self, status, time() - self.started)
+
+
+class PollSchedule(object):
+    """
+    Learn how long Lunr takes to get resources where they're waited on.
+
+    Durations are kept for each resource type, transition and volume size
+    bucket. Once `min_samples` of a kind are in, the first poll waits for
+    the 10th percentile of them and polls `tight_polls` times until the
+    90th, after that it backs off like it would with no history. Time spent
+    in each status is kept in histograms.
+
+    A wait that was already over by the first poll only says it took at
+    most that long, so it isn't kept as a duration. Instead the first poll
+    of the next wait comes twice as early, until one catches the resource
+    still on it's way and the real duration gets in.
+    """
+
+    def __init__(self, initial=1, max_backoff=30, min_interval=1,
+                 tight_polls=4, window=50, min_samples=3):
+        self.initial = initial
+        self.max_backoff = max_backoff
+        self.min_interval = min_interval
+        self.tight_polls = tight_polls
+        self.min_samples = min_samples
+        self._durations = defaultdict(lambda: deque(maxlen=window))
+        # what a wait on some statuses turned out to be the last time
+        self._transitions = {}
+        # waits in a row that were over by the first poll
+        self._censored = defaultdict(int)
+        self._time_in_state = defaultdict(Histogram)
+        self._lock = Lock()
+
+    def start(self, resource, statuses, size=None):
+        """
+        :param resource: name of the resource type
+        :param statuses: the statuses being waited on
+        :param size: volume size in GB, if there's one involved
+
+        :returns: a Poll
+        """
+        bucket = size_bucket(size)
+        return Poll(self, resource, statuses, bucket,
+                    self.expected(resource, statuses, bucket))
+
+    def expected(self, resource, statuses, bucket):
+        """
+        :returns: (low, high) seconds a wait is expected to take, or None
+        """
+        with self._lock:
+            transition = self._transitions.get((resource, statuses, bucket))
+            if not transition:
+                return None
+            samples = self._durations[(resource,) + transition + (bucket,)]
+            if len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+            censored = self._censored[(resource, statuses, bucket)]
+        return (percentile(ordered, 10) * 0.5 ** censored,
+                percentile(ordered, 90))
+
+    def record(self, poll, status, duration):
+        key = (poll.resource, poll.statuses, poll.bucket)
+        if poll.first_status == status:
+            if poll.expected:
+                # we held off the first poll and it was done by then, it
+                # might have been done long before
+                with self._lock:
+                    self._censored[key] += 1
+            # it was done before we looked, nothing learned
+            return
+        transition = (poll.first_status, status)
+        with self._lock:
+            self._censored.pop(key, None)
+            self._transitions[key] = transition
+            self._durations[(poll.resource,) + transition +
+                            (poll.bucket,)].append(duration)
+
+    def record_state(self, resource, status, duration):
+        with self._lock:
+            self._time_in_state[(resource, status)].add(duration)
+
+    def stats(self):
+        with self._lock:
+            durations = dict(
+                ('%s %s->%s %s' % (key[:3] + (size_label(key[3]),)), {
+                    'samples': len(samples),
+                    'p10': percentile(sorted(samples), 10),
+                    'p50': percentile(sorted(samples), 50),
+                    'p90': percentile(sorted(samples), 90),
+                }) for key, samples in self._durations.items() if samples)
+            time_in_state = dict(
+                ('%s %s' % key, histogram.stats())
+                for key, histogram in self._time_in_state.items())
+        return {
+            'durations': durations,
+            'time_in_state': time_in_state,
+        }
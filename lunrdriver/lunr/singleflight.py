@@ -0,0 +1,119 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sys
+
+try:
+    from eventlet.event import Event
+    from eventlet.semaphore import Semaphore as Lock
+
+    def notify(event):
+        event.send()
+except ImportError:
+    from threading import Event, Lock
+
+    def notify(event):
+        event.set()
+
+from lunrdriver.lunr.timeouts import DeadlineExceeded
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = Event()
+        self.done = False
+        self.abandoned = False
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """
+    Share one call between everyone that asks for the same key while it's
+    in flight.
+
+    The first caller for a key runs the call, callers that arrive before it
+    finishes wait for it and get the same result, or the same exception.
+    If the running caller is killed, or fails in a way that's its own, the
+    next waiter takes over.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.saved = 0
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, func, deadline=None, shared=None):
+        """
+        :param key: identifies calls that can share a result
+        :param func: makes the call
+        :param deadline: optional Deadline on waiting for someone else's
+                         call
+        :param shared: optional callable that returns False for exceptions
+                       of func the waiters shouldn't get
+
+        :raises DeadlineExceeded: if the deadline runs out while waiting
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    self.leaders += 1
+                    break
+                self.saved += 1
+            if deadline:
+                call.event.wait(deadline.remaining())
+            else:
+                call.event.wait()
+            if not call.done:
+                raise DeadlineExceeded(deadline)
+            if call.abandoned:
+                with self._lock:
+                    self.saved -= 1
+                continue
+            if call.exc_info:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+        try:
+            call.result = func()
+        except Exception, e:
+            if shared and not shared(e):
+                call.abandoned = True
+            else:
+                call.exc_info = sys.exc_info()
+            raise
+        except BaseException:
+            call.abandoned = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done = True
+            notify(call.event)
+        return call.result
+
+    def stats(self):
+        in_flight = len(self._calls)
+        calls = self.leaders + self.saved
+        return {
+            'in_flight': in_flight,
+            'requests': calls,
+            'saved': self.saved,
+            'saved_rate': float(self.saved) / calls if calls else 0.0,
+        }
@@ -0,0 +1,78 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from time import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline(object):
+    """
+    Time budget for a whole operation.
+
+    A Deadline is handed down through the client, every request and every
+    wait_on_status sleep is capped at whatever budget is left.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.expires = time() + timeout
+
+    def remaining(self):
+        return max(0.0, self.expires - time())
+
+    @property
+    def expired(self):
+        return time() >= self.expires
+
+    def __str__(self):
+        return 'deadline of %ss exceeded' % self.timeout
+
+
+class Timeouts(object):
+    """
+    Connect and read timeouts for Lunr api requests.
+
+    Overrides are keyed by "resource.METHOD", "resource" or "METHOD" and
+    the most specific match wins, e.g. {'backups.GET': 5, 'DELETE': 60}
+    """
+
+    def __init__(self, connect=10, read=120, connect_overrides=None,
+                 read_overrides=None):
+        self.connect = float(connect)
+        self.read = float(read)
+        self.connect_overrides = self._parse(connect_overrides)
+        self.read_overrides = self._parse(read_overrides)
+
+    def _parse(self, overrides):
+        return dict((key, float(value))
+                    for key, value in (overrides or {}).items())
+
+    def _lookup(self, overrides, keys, default):
+        for key in keys:
+            if key in overrides:
+                return overrides[key]
+        return default
+
+    def get(self, resource, method):
+        """
+        :returns: (connect_timeout, read_timeout)
+        """
+        keys = ('%s.%s' % (resource, method), resource, method)
+        return (self._lookup(self.connect_overrides, keys, self.connect),
+                self._lookup(self.read_overrides, keys, self.read))
@@ -14,28 +14,22 @@
 # limitations under the License.
 
 
-import socket
-
 from client import LunrClient
+from resolver import resolver
 
 
 def resolve_hostname(target_portal):
     """
     Try to lookup the ip of the of the hostname in target_portal.
 
-    Thin wrapper around the socket module's gethostbyname function.
+    Goes through the shared resolver, which caches lookups and keeps slow
+    ones from blocking everyone else.
 
     :param target_portal: a string, in the format "hostname:port"
 
     :returns: "host_ip:port" or "hostname:port" if lookup fails
     """
-    hostname, port = target_portal.split(':')
-    try:
-        host_ip = socket.gethostbyname(hostname)
-    except socket.gaierror:
-        # this host can't resolve, just pass the name through
-        return target_portal
-    return ':'.join((host_ip, port))
+    return resolver.resolve_portal(target_portal)
 
 
 def initialize_connection(client, volume_id):
@@ -0,0 +1,234 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sys
+from time import time
+
+try:
+    from eventlet import sleep
+    from eventlet.event import Event
+    from eventlet.semaphore import Semaphore as Lock
+
+    def notify(event):
+        event.send()
+except ImportError:
+    from threading import Event, Lock
+    from time import sleep
+
+    def notify(event):
+        event.set()
+
+try:
+    from oslo_log import log as logging
+except ImportError:
+    from cinder.openstack.common import log as logging
+
+from lunrdriver.lunr.client import LunrResponse, StatusError, check_status
+from lunrdriver.lunr.compat import spawn_n
+from lunrdriver.lunr.timeouts import DeadlineExceeded
+
+
+LOG = logging.getLogger('cinder.volume.lunr.watcher')
+
+
+class Waiter(object):
+
+    def __init__(self, poll):
+        self.poll = poll
+        # seconds until this waiter wants it's resource looked up
+        self.due = poll.delay()
+        self.event = Event()
+        self.done = False
+        self.resp = None
+        self.exc_info = None
+
+
+class StatusWatcher(object):
+    """
+    Wait on the status of many Lunr resources with a few requests.
+
+    Everyone waiting on a status registers here instead of polling on their
+    own. One greenthread wakes up at least every `interval` seconds and
+    looks up the resources of every project and resource type that has a
+    waiter whose Poll says it's due, and wakes up the waiters whose status
+    showed up. A list of the whole project costs as much as a lot of
+    single lookups, so only once `list_threshold` resources of a group are
+    waited on do they share one list request, fewer are fetched one at a
+    time. Resources missing from the list are fetched one at a time too.
+    """
+
+    def __init__(self, interval=2, list_threshold=5):
+        self.interval = interval
+        self.list_threshold = list_threshold
+        self.running = False
+        self.polls = 0
+        self.requests = 0
+        # (project_id, resource name) -> (resource, {id: [waiters]})
+        self._groups = {}
+        self._lock = Lock()
+
+    def wait(self, resource, _id, poll, deadline=None):
+        """
+        Wait until the resource with _id enters one of the statuses of poll.
+
+        :param resource: a LunrResource of the client of the waiting project
+        :param poll: a Poll from the PollSchedule of the client
+        :param deadline: optional Deadline on the wait
+
+        :returns: a LunrResponse with the resource in one of statuses
+        :raises StatusError: if the resource enters some other status that
+                             isn't transitional
+        :raises DeadlineExceeded: if the deadline runs out
+        """
+        waiter = Waiter(poll)
+        key = (resource.client.project_id, resource.name)
+        with self._lock:
+            group = self._groups.setdefault(key, (resource, {}))
+            group[1].setdefault(_id, []).append(waiter)
+            if not self.running:
+                self.running = True
+                spawn_n(self._run)
+        try:
+            if deadline:
+                waiter.event.wait(deadline.remaining())
+            else:
+                waiter.event.wait()
+        finally:
+            if not waiter.done:
+                self._discard(key, _id, waiter)
+        if not waiter.done:
+            raise DeadlineExceeded(deadline)
+        if waiter.exc_info:
+            raise waiter.exc_info[0], waiter.exc_info[1], waiter.exc_info[2]
+        return waiter.resp
+
+    def _discard(self, key, _id, waiter):
+        with self._lock:
+            group = self._groups.get(key)
+            if not group:
+                return
+            waiters = group[1].get(_id, [])
+            if waiter in waiters:
+                waiters.remove(waiter)
+            if not waiters:
+                group[1].pop(_id, None)
+            if not group[1]:
+                del self._groups[key]
+
+    def _finish(self, key, _id, waiter, resp=None, exc_info=None):
+        self._discard(key, _id, waiter)
+        waiter.resp = resp
+        waiter.exc_info = exc_info
+        waiter.done = True
+        notify(waiter.event)
+
+    def _due(self):
+        """
+        :returns: the groups with a waiter that's due, and seconds until
+                  the next waiter is due
+        """
+        groups = []
+        next_due = self.interval
+        with self._lock:
+            if not self._groups:
+                self.running = False
+                return None, None
+            for key, (resource, ids) in self._groups.items():
+                waiters = [w for waiting in ids.values() for w in waiting]
+                if any(w.due <= 0 for w in waiters):
+                    groups.append((key, resource,
+                                   dict((_id, list(waiting))
+                                        for _id, waiting in ids.items())))
+                    for waiter in waiters:
+                        if waiter.due <= 0:
+                            waiter.due = waiter.poll.delay()
+                next_due = min([next_due] + [w.due for w in waiters])
+        return groups, max(next_due, 0)
+
+    def _run(self):
+        try:
+            while True:
+                groups, wait = self._due()
+                if groups is None:
+                    return
+                if groups:
+                    self.polls += 1
+                for key, resource, waiting in groups:
+                    try:
+                        self._poll(key, resource, waiting)
+                    except Exception:
+                        LOG.exception('status poll of %s failed' % (key,))
+                start = time()
+                sleep(wait)
+                slept = max(wait, time() - start)
+                with self._lock:
+                    for resource, ids in self._groups.values():
+                        for waiting in ids.values():
+                            for waiter in waiting:
+                                waiter.due -= slept
+        except BaseException:
+            self.running = False
+            raise
+
+    def _lookup(self, resource, ids):
+        """
+        :returns: dict of id to (LunrResponse, None) or (None, exc_info)
+        """
+        results = {}
+        missing = set(ids)
+        if len(ids) >= max(self.list_threshold, 2):
+            self.requests += 1
+            try:
+                resp = resource.list(poll=True)
+                items = resp.body
+            except Exception:
+                LOG.exception('listing %s failed, falling back to fetching '
+                              'them one at a time' % resource.name)
+            else:
+                for item in items:
+                    if item.get('id') in missing:
+                        missing.discard(item['id'])
+                        results[item['id']] = (LunrResponse(
+                            resp.status, resp.headers, None, body=item), None)
+        for _id in missing:
+            self.requests += 1
+            try:
+                results[_id] = (resource.get(_id, poll=True), None)
+            except Exception:
+                results[_id] = (None, sys.exc_info())
+        return results
+
+    def _poll(self, key, resource, waiting):
+        for _id, (resp, exc_info) in self._lookup(resource, waiting).items():
+            for waiter in waiting[_id]:
+                if exc_info:
+                    self._finish(key, _id, waiter, exc_info=exc_info)
+                    continue
+                try:
+                    if check_status(waiter.poll, resp):
+                        self._finish(key, _id, waiter, resp=resp)
+                except StatusError:
+                    self._finish(key, _id, waiter, exc_info=sys.exc_info())
+
+    def stats(self):
+        with self._lock:
+            waiting = sum(len(waiters) for resource, ids in
+                          self._groups.values() for waiters in ids.values())
+        return {
+            'waiting': waiting,
+            'polls': self.polls,
+            'requests': self.requests,
+        }
@@ -0,0 +1,7 @@
+from StringIO import StringIO
+
+
+class MockResponse(StringIO):
+
+    def getcode(self):
+        return 200
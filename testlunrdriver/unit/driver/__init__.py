@@ -1,3 +1,4 @@
+import json
 import unittest
 
 import __builtin__
@@ -6,8 +7,14 @@ setattr(__builtin__, '_', lambda x: x)
 from StringIO import StringIO
 from cgi import parse_qsl
 from contextlib import contextmanager
+from urllib2 import HTTPError
+from urlparse import urlparse
 
+from lunrdriver.driver import volumecache
 from lunrdriver.lunr import client
+from lunrdriver.lunr.client import ClientRegistry
+
+from testlunrdriver.unit import MockResponse
 
 
 @contextmanager
@@ -25,13 +32,6 @@ def urldecode(qs):
     return dict(parse_qsl(qs))
 
 
-class MockResponse(StringIO):
-
-    def getcode(self):
-        return 200
-
-
-
 class ClientTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -86,7 +86,7 @@ class ClientTestCase(unittest.TestCase):
         if hasattr(self, '_callback'):
             del self._callback
 
-    def mock_urlopen(self, req):
+    def mock_urlopen(self, req, *args, **kwargs):
         self.request_callback(req)
         resp = self.resp  # get next resp
         if isinstance(resp, Exception):
@@ -95,3 +95,66 @@ class ClientTestCase(unittest.TestCase):
         if not hasattr(resp, 'read'):
             resp = MockResponse(resp)
         return resp
+
+
+def run_now(func, *args, **kwargs):
+    func(*args, **kwargs)
+
+
+class MockLunrTestCase(unittest.TestCase):
+    """
+    Just enough of a Lunr to make volumes in, cached volumes get built right
+    away.
+    """
+
+    def setUp(self):
+        self._orig_urlopen = client.urlopen
+        self._orig_spawn_n = volumecache.spawn_n
+        client.urlopen = self.mock_urlopen
+        volumecache.spawn_n = run_now
+        self.clients = ClientRegistry('http://127.0.0.1:8080/v1.0')
+        # what lunr has, by id
+        self.volumes = {}
+        self.requests = []
+        self.volume = {'id': 'vol1', 'project_id': 'fake', 'size': 5}
+
+    def tearDown(self):
+        client.urlopen = self._orig_urlopen
+        volumecache.spawn_n = self._orig_spawn_n
+
+    def mock_urlopen(self, req, *args, **kwargs):
+        url = urlparse(req.get_full_url())
+        method = req.get_method()
+        self.requests.append((method, url.path))
+        parts = url.path.strip('/').split('/')
+        if len(parts) == 3 and parts[1] == 'admin':
+            # the admin account lists the volumes of every account
+            volumes = [dict(v, account_id=v.get('project_id', 'fake'))
+                       for v in self.volumes.values()]
+            return MockResponse(json.dumps(volumes))
+        if len(parts) == 3:
+            volumes = [v for v in self.volumes.values()
+                       if v.get('project_id', 'fake') == parts[1]]
+            return MockResponse(json.dumps(volumes))
+        _id = parts[3]
+        if method == 'PUT':
+            params = urldecode(url.query)
+            self.volumes[_id] = {
+                'id': _id, 'project_id': parts[1], 'name': params['name'],
+                'status': 'ACTIVE',
+                'size': int(params['size']),
+                'volume_type_name': params['volume_type_name'],
+                'image_id': params.get('image_id'),
+                'backup': params.get('backup'),
+            }
+        elif _id not in self.volumes:
+            raise HTTPError(req.get_full_url(), 404, 'Not Found', {},
+                            StringIO('{"reason": "Not Found"}'))
+        elif method == 'POST':
+            params = urldecode(url.query)
+            self.volumes[_id]['project_id'] = params['account_id']
+            self.volumes[_id]['name'] = params['name']
+        elif method == 'DELETE':
+            self.volumes.pop(_id)['status'] = 'DELETING'
+            return MockResponse(json.dumps({'id': _id}))
+        return MockResponse(json.dumps(self.volumes[_id]))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+from urlparse import urlparse
+
+from lunrdriver.driver import capacity
+from lunrdriver.lunr.client import ClientRegistry
+
+from testlunrdriver.unit.driver import ClientTestCase
+
+
+NODES = json.dumps([
+    {'id': 'node1', 'status': 'ACTIVE', 'volume_type_name': 'ssd',
+     'size': 1000, 'storage_free': 400},
+    {'id': 'node2', 'status': 'ACTIVE', 'volume_type_name': 'ssd',
+     'size': 1000, 'storage_used': 900},
+    {'id': 'node3', 'status': 'ACTIVE', 'volume_type_name': 'sata',
+     'size': 5000, 'storage_free': 5000},
+    {'id': 'node4', 'status': 'DELETED', 'volume_type_name': 'sata',
+     'size': 5000, 'storage_free': 5000},
+])
+
+
+class TestCapacityMonitor(ClientTestCase):
+
+    def setUp(self):
+        super(TestCapacityMonitor, self).setUp()
+        self._orig_time = capacity.time
+        self.now = 1000.0
+        capacity.time = lambda: self.now
+        self.clients = ClientRegistry('http://127.0.0.1:8080/v1.0')
+
+    def tearDown(self):
+        super(TestCapacityMonitor, self).tearDown()
+        capacity.time = self._orig_time
+
+    def test_refresh(self):
+        def callback(req):
+            self.assertEquals(req.get_method(), 'GET')
+            self.assertEquals(urlparse(req.get_full_url()).path,
+                              '/v1.0/admin/nodes')
+        self.request_callback = callback
+        self.resp = NODES
+        monitor = capacity.CapacityMonitor(self.clients)
+        monitor.refresh()
+        self.assertEquals(monitor.get(), (7000, 5500))
+        stats = monitor.stats()
+        self.assertEquals(stats['types'], {
+            'ssd': {'nodes': 2, 'total_capacity_gb': 2000,
+                    'free_capacity_gb': 500},
+            'sata': {'nodes': 1, 'total_capacity_gb': 5000,
+                     'free_capacity_gb': 5000},
+        })
+        self.assertEquals(stats['age'], 0)
+        self.assertFalse(stats['stale'])
+
+    def test_unknown_until_refreshed(self):
+        monitor = capacity.CapacityMonitor(self.clients)
+        self.assertEquals(monitor.get(), ('unknown', 'unknown'))
+        self.assert_(monitor.stats()['stale'])
+        # no request was made for it
+        self.assertEquals(len(self.request_callback.called), 0)
+
+    def test_stale(self):
+        self.resp = NODES
+        monitor = capacity.CapacityMonitor(self.clients, max_age=300)
+        monitor.refresh()
+        self.now += 300
+        self.assertEquals(monitor.get(), (7000, 5500))
+        self.now += 1
+        self.assertEquals(monitor.get(), ('unknown', 'unknown'))
+        self.assertEquals(monitor.stats()['age'], 301)
+
+    def test_failed_refresh_keeps_last(self):
+        monitor = capacity.CapacityMonitor(self.clients)
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 2:
+                monitor.stop()
+        self.resp = [NODES, IOError('connection refused')]
+        orig_sleep, orig_spawn_n = capacity.sleep, capacity.spawn_n
+        try:
+            capacity.sleep = sleep
+            capacity.spawn_n = lambda func: func()
+            monitor.start()
+        finally:
+            capacity.sleep, capacity.spawn_n = orig_sleep, orig_spawn_n
+        self.assertEquals(sleeps, [60, 60])
+        self.assertEquals(monitor.get(), (7000, 5500))
+        stats = monitor.stats()
+        self.assertEquals(stats['refreshes'], 1)
+        self.assertEquals(stats['failures'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
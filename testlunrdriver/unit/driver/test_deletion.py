@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError
+from urlparse import urlparse
+
+from lunrdriver.driver import deletion
+from lunrdriver.lunr import client
+from lunrdriver.lunr.client import ClientRegistry
+
+from testlunrdriver.unit import MockResponse
+
+
+class TestDeleteQueue(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_urlopen = client.urlopen
+        self._orig_sleep = deletion.sleep
+        deletion.sleep = lambda *args: None
+        client.urlopen = self.mock_urlopen
+        self.clients = ClientRegistry('http://127.0.0.1:8080/v1.0')
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, 'deletes.db')
+        # what lunr has, by id
+        self.backups = {}
+        self.requests = []
+
+    def tearDown(self):
+        client.urlopen = self._orig_urlopen
+        deletion.sleep = self._orig_sleep
+        shutil.rmtree(self.scratch)
+
+    def mock_urlopen(self, req, *args, **kwargs):
+        path = urlparse(req.get_full_url()).path
+        self.requests.append((req.get_method(), path))
+        parts = path.strip('/').split('/')
+        if req.get_method() == 'DELETE':
+            _id = parts[-1]
+            if _id not in self.backups:
+                raise HTTPError(req.get_full_url(), 404, 'Not Found', {},
+                                StringIO('{"reason": "Not Found"}'))
+            if self.backups[_id] == 'BROKEN':
+                raise HTTPError(req.get_full_url(), 500, 'Error', {},
+                                StringIO('{"reason": "Error"}'))
+            self.backups[_id] = 'DELETING'
+            body = {'id': _id, 'status': 'DELETING'}
+        else:
+            body = [{'id': _id, 'status': status}
+                    for _id, status in self.backups.items()]
+        return MockResponse(json.dumps(body))
+
+    def snapshot(self, _id, project_id='fake'):
+        return {'id': _id, 'project_id': project_id}
+
+    def test_delete_and_confirm(self):
+        self.backups = {'snap1': 'AVAILABLE', 'snap2': 'AVAILABLE'}
+        q = deletion.DeleteQueue(self.path, self.clients)
+        q.put(self.snapshot('snap1'))
+        q.put(self.snapshot('snap2'))
+        self.assertEquals(self.requests, [])
+        self.assertEquals(q.stats()['queued'], 2)
+        self.assertEquals(q.delete_next(), 2)
+        self.assertEquals(self.requests, [
+            ('DELETE', '/v1.0/fake/backups/snap1'),
+            ('DELETE', '/v1.0/fake/backups/snap2'),
+        ])
+        self.assertEquals(q.stats()['deleting'], 2)
+        # one still going
+        self.backups['snap1'] = 'AUDITING'
+        del self.requests[:]
+        self.assertEquals(q.confirm(), 1)
+        # one list for the whole project
+        self.assertEquals(self.requests, [('GET', '/v1.0/fake/backups')])
+        del self.backups['snap2']
+        self.assertEquals(q.confirm(), 1)
+        stats = q.stats()
+        self.assertEquals(stats['queued'], 0)
+        self.assertEquals(stats['deleting'], 0)
+        self.assertEquals(stats['completed'], 2)
+        self.assert_(stats['drain_rate'] > 0)
+
+    def test_no_rate_limit(self):
+        self.backups = dict(('snap%s' % i, 'AVAILABLE') for i in range(10))
+        q = deletion.DeleteQueue(self.path, self.clients, rate=0)
+        for _id in self.backups:
+            q.put(self.snapshot(_id))
+        sleeps = []
+        deletion.sleep = sleeps.append
+        # all at once, without waiting in between
+        self.assertEquals(q.delete_next(), 10)
+        self.assertEquals(sleeps, [])
+
+    def test_survives_restart(self):
+        self.backups = {'snap1': 'AVAILABLE', 'snap2': 'AVAILABLE'}
+        q = deletion.DeleteQueue(self.path, self.clients)
+        q.put(self.snapshot('snap1'))
+        q.put(self.snapshot('snap2'))
+        q.delete_next(limit=1)
+        q.close()
+        q = deletion.DeleteQueue(self.path, self.clients)
+        stats = q.stats()
+        self.assertEquals(stats['queued'], 1)
+        self.assertEquals(stats['deleting'], 1)
+        del self.requests[:]
+        q.delete_next()
+        self.assertEquals(self.requests,
+                          [('DELETE', '/v1.0/fake/backups/snap2')])
+
+    def test_commits_off_the_hub(self):
+        q = deletion.DeleteQueue(self.path, self.clients)
+        calls = []
+        _orig_execute = deletion.execute
+
+        def execute(func, *args):
+            calls.append(func)
+            return _orig_execute(func, *args)
+        deletion.execute = execute
+        try:
+            q.put(self.snapshot('snap1'))
+        finally:
+            deletion.execute = _orig_execute
+        self.assertEquals(calls, [q._run])
+        self.assertEquals(q.stats()['queued'], 1)
+
+    def test_not_found(self):
+        q = deletion.DeleteQueue(self.path, self.clients)
+        q.put(self.snapshot('snap1'))
+        q.delete_next()
+        stats = q.stats()
+        self.assertEquals(stats['queued'], 0)
+        self.assertEquals(stats['completed'], 1)
+
+    def test_retry(self):
+        self.backups = {'snap1': 'BROKEN'}
+        q = deletion.DeleteQueue(self.path, self.clients, max_attempts=2,
+                                 retry_backoff=0)
+        q.put(self.snapshot('snap1'))
+        q.delete_next()
+        self.assertEquals(q.stats()['queued'], 1)
+        q.delete_next()
+        stats = q.stats()
+        self.assertEquals(stats['queued'], 0)
+        self.assertEquals(stats['failed'], 1)
+
+    def test_retry_backoff(self):
+        self.backups = {'snap1': 'BROKEN'}
+        q = deletion.DeleteQueue(self.path, self.clients)
+        q.put(self.snapshot('snap1'))
+        q.delete_next()
+        # not due yet
+        self.assertEquals(q.delete_next(), 0)
+
+    def test_lunr_fails_delete(self):
+        self.backups = {'snap1': 'AVAILABLE'}
+        q = deletion.DeleteQueue(self.path, self.clients, retry_backoff=0)
+        q.put(self.snapshot('snap1'))
+        q.delete_next()
+        self.backups['snap1'] = 'ERROR'
+        q.confirm()
+        self.assertEquals(q.stats()['queued'], 1)
+        del self.requests[:]
+        q.delete_next()
+        self.assertEquals(self.requests,
+                          [('DELETE', '/v1.0/fake/backups/snap1')])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,6 +8,8 @@ from collections import namedtuple
 from datetime import datetime, timedelta
 import os
 import errno
+import shutil
+import tempfile
 from StringIO import StringIO
 from urlparse import urlparse
 from urllib2 import HTTPError, URLError
@@ -16,11 +18,15 @@ from cinder.volume import configuration as conf
 import json
 from uuid import uuid4
 
-from lunrdriver.driver import utils
 from lunrdriver.driver import driver
+from lunrdriver.driver import reconciler
+from lunrdriver.driver import typesync
 from lunrdriver.lunr import client
+from lunrdriver.lunr import resolver
+from lunrdriver.lunr import watcher
 
-from testlunrdriver.unit.driver import ClientTestCase, urldecode, patch
+from testlunrdriver.unit.driver import ClientTestCase, MockResponse, \
+    patch, run_now, urldecode
 
 
 def no_sleep(*args):
@@ -48,6 +54,10 @@ class MockVolumeTypes(object):
     def get_volume_type_by_name(self, context, name):
         return self.store[name]
 
+    def get_all_types(self, context):
+        return dict((name, dict(vtype, name=name))
+                    for name, vtype in self.store.items())
+
     def create(self, context, name, extra_specs={}):
         if name in self.store:
             self.duplicate_create_types.append(name)
@@ -61,15 +71,22 @@ class DriverTestCase(ClientTestCase):
 
     def setUp(self):
         super(DriverTestCase, self).setUp()
-        self._orig_volume_types = driver.volume_types
+        self._orig_volume_types = typesync.volume_types
         self.volume_types = MockVolumeTypes()
-        driver.volume_types = self.volume_types
+        typesync.volume_types = self.volume_types
+        self._orig_typesync_spawn_n = typesync.spawn_n
+        typesync.spawn_n = run_now
+        self._orig_watcher_sleep = watcher.sleep
+        watcher.sleep = no_sleep
+        resolver.resolver.clear()
         self.configuration = conf.Configuration([])
         self.connector = {'ip': '127.0.0.1'}
 
     def tearDown(self):
         super(DriverTestCase, self).tearDown()
-        driver.volume_types = self._orig_volume_types
+        typesync.volume_types = self._orig_volume_types
+        typesync.spawn_n = self._orig_typesync_spawn_n
+        watcher.sleep = self._orig_watcher_sleep
 
 
 class TestLunrDriver(DriverTestCase):
@@ -78,6 +95,115 @@ class TestLunrDriver(DriverTestCase):
         d = driver.LunrDriver(configuration=self.configuration)
         self.assertEquals(d.url, d.configuration.lunr_api_endpoint)
 
+    def test_client_registry(self):
+        d = driver.LunrDriver(configuration=self.configuration)
+        c1 = d.clients.get({'project_id': 'p1'})
+        self.assert_(d.clients.get({'project_id': 'p1'}) is c1)
+        c2 = d.clients.get({'project_id': 'p2'})
+        self.assertEquals(c2.project_id, 'p2')
+        stats = d.get_volume_stats()['client_registry']
+        self.assertEquals(stats['size'], 2)
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 2)
+
+    def test_volume_stats_capacity(self):
+        d = driver.LunrDriver(configuration=self.configuration)
+        stats = d.get_volume_stats()
+        self.assertEquals(stats['total_capacity_gb'], 'unknown')
+        self.resp = json.dumps([{'status': 'ACTIVE', 'size': 100,
+                                 'storage_free': 40,
+                                 'volume_type_name': 'vtype'}])
+        d.capacity.refresh()
+        stats = d.get_volume_stats()
+        self.assertEquals(stats['total_capacity_gb'], 100)
+        self.assertEquals(stats['free_capacity_gb'], 40)
+        # only the refresh asked lunr
+        self.assertEquals(len(self.request_callback.called), 1)
+
+    def test_volume_stats_capacity_disabled(self):
+        self.configuration.lunr_capacity_interval = 0
+        d = driver.LunrDriver(configuration=self.configuration)
+        stats = d.get_volume_stats()
+        self.assertEquals(stats['total_capacity_gb'], 'infinite')
+        self.assertEquals(stats['free_capacity_gb'], 'infinite')
+
+    def test_rate_limits(self):
+        d = driver.LunrDriver(configuration=self.configuration)
+        self.assertEquals(d.rate_limiter, None)
+        self.configuration.lunr_rate_limit_writes = 5
+        d = driver.LunrDriver(configuration=self.configuration)
+        self.assert_(d.clients.get({'project_id': 'p1'}).rate_limiter is
+                     d.rate_limiter)
+        stats = d.get_volume_stats()['rate_limits']
+        self.assertEquals(stats['writes']['rate'], 5)
+        self.assertEquals(stats['reads']['rate'], None)
+
+    def test_fair_scheduler(self):
+        self.configuration.lunr_fair_scheduler = True
+        d = driver.LunrDriver(configuration=self.configuration)
+        slots = []
+        orig_slot = d.scheduler.slot
+
+        def slot(project_id, operation):
+            slots.append((project_id, operation))
+            return orig_slot(project_id, operation)
+        d.scheduler.slot = slot
+        volume = {'id': 'vol1', 'project_id': 'p1'}
+        self.resp = ['{}', '{}']
+        d.attach_volume(None, volume, 'instance1', 'host1', '/dev/vdb')
+        d.detach_volume(None, volume=volume)
+        self.assertEquals(slots, [('p1', 'attach_volume'),
+                                  ('p1', 'detach_volume')])
+        stats = d.get_volume_stats()['scheduler']
+        self.assertEquals(stats['projects']['p1']['served'], 2)
+
+    def test_fair_scheduler_bulk(self):
+        self.configuration.lunr_fair_scheduler = True
+        d = driver.LunrDriver(configuration=self.configuration)
+        slots = []
+        orig_slot = d.scheduler.slot
+
+        def slot(project_id, operation):
+            slots.append((project_id, operation))
+            return orig_slot(project_id, operation)
+        d.scheduler.slot = slot
+        volumes = [{'id': 'vol1', 'project_id': 'p1'},
+                   {'id': 'vol2', 'project_id': 'p2'}]
+        self.resp = ['{}', '{}', '{}', '{}']
+        d.detach_volumes(None, volumes)
+        d.terminate_connections([(v, {'initiator': 'iqn-a'})
+                                 for v in volumes])
+        # a slot per project, same as one volume at a time
+        self.assertEquals(sorted(slots), [
+            ('p1', 'detach_volume'), ('p1', 'terminate_connection'),
+            ('p2', 'detach_volume'), ('p2', 'terminate_connection'),
+        ])
+        stats = d.get_volume_stats()['scheduler']
+        self.assertEquals(stats['running'], 0)
+        self.assertEquals(stats['projects']['p2']['served'], 2)
+
+    def test_client_registry_evicts(self):
+        self.configuration.lunr_client_cache_size = 2
+        d = driver.LunrDriver(configuration=self.configuration)
+        c1 = d.clients.get({'project_id': 'p1'})
+        d.clients.get({'project_id': 'p2'})
+        d.clients.get({'project_id': 'p1'})
+        d.clients.get({'project_id': 'p3'})
+        self.assertEquals(d.clients.stats()['size'], 2)
+        # p1 was used more recently than p2
+        self.assert_(d.clients.get({'project_id': 'p1'}) is c1)
+        self.assertEquals(d.clients.stats()['hits'], 2)
+        d.clients.get({'project_id': 'p2'})
+        self.assertEquals(d.clients.stats()['misses'], 4)
+
+    def test_operation_deadline(self):
+        self.configuration.lunr_operation_timeouts = {
+            'create_cloned_volume': '3600'}
+        d = driver.LunrDriver(configuration=self.configuration)
+        self.assertEquals(d._deadline('create_volume'), None)
+        deadline = d._deadline('create_cloned_volume')
+        self.assertEquals(deadline.timeout, 3600)
+
     def test_create_volume(self):
         volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
                   'id': '123-456', 'volume_type': {'name': 'vtype'}}
@@ -95,6 +221,27 @@ class TestLunrDriver(DriverTestCase):
         self.assert_(self.request_callback.called)
         self.assertEquals(update['host'], 'foo')
 
+    def test_create_volume_warm_pool(self):
+        self.configuration.lunr_warm_pool = ['vtype:1']
+        volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
+                  'id': '123-456', 'volume_type': {'name': 'vtype'}}
+        d = driver.LunrDriver(configuration=self.configuration)
+        claims = []
+
+        def claim(volume, volume_type_name, deadline=None):
+            claims.append(volume_type_name)
+            resp = client.LunrResponse(200, {}, None, body={
+                'id': 'warm1', 'size': 1, 'cinder_host': 'foo'})
+            return 'warm1', resp
+        d.warm_pool.claim = claim
+        update = d.create_volume(volume)
+        self.assertEquals(claims, ['vtype'])
+        self.assertEquals(update['_name_id'], 'warm1')
+        self.assertEquals(update['host'], 'foo')
+        # lunr wasn't asked to make one
+        self.assertEquals(len(self.request_callback.called), 0)
+        self.assert_('warm_pool' in d.get_volume_stats())
+
     def test_create_volume_duplicate(self):
         volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
                   'id': '123-456', 'volume_type': {'name': 'vtype'}}
@@ -106,6 +253,10 @@ class TestLunrDriver(DriverTestCase):
                 url = urlparse(req.get_full_url())
                 self.assertEquals(url.path, '/v1.0/100/volumes/%s' % volume['id'])
                 return
+            # Then a look at what's there
+            if len(self.request_callback.called) == 2:
+                self.assertEquals(req.get_method(), 'GET')
+                return
             # We need to capture the lunr_id from the retry
             self.assertEquals(req.get_method(), 'PUT')
             url = urlparse(req.get_full_url())
@@ -117,13 +268,39 @@ class TestLunrDriver(DriverTestCase):
 
         err = HTTPError('/v1.0/100/volumes/123-456', 409, 'Server Error', {},
                         StringIO('{"reason": "conflict"}'))
-        self.resp = [err, json.dumps({'size': 1, 'cinder_host': 'foo'})]
+        self.resp = [err, json.dumps({'id': '123-456', 'name': 'other'}),
+                     json.dumps({'size': 1, 'cinder_host': 'foo'})]
         d = driver.LunrDriver(configuration=self.configuration)
         update = d.create_volume(volume)
-        self.assertEquals(len(self.request_callback.called), 2)
+        self.assertEquals(len(self.request_callback.called), 3)
         self.assertEquals(1, len(lunr_id))
         self.assertEquals(update['_name_id'], lunr_id[0])
 
+    def test_create_volume_retried(self):
+        volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
+                  'id': '123-456', 'volume_type': {'name': 'vtype'}}
+        requests = []
+
+        def callback(req):
+            url = urlparse(req.get_full_url())
+            requests.append((req.get_method(), url.path))
+        self.request_callback = callback
+        # the first try made the volume, the reply got lost, so the retry
+        # ran into it
+        err = HTTPError('/v1.0/100/volumes/123-456', 409, 'Conflict', {},
+                        StringIO('{"reason": "conflict"}'))
+        self.resp = [err, json.dumps({'id': '123-456', 'name': '123-456',
+                                      'size': 1, 'cinder_host': 'foo'})]
+        d = driver.LunrDriver(configuration=self.configuration)
+        update = d.create_volume(volume)
+        self.assertEquals(requests, [
+            ('PUT', '/v1.0/100/volumes/123-456'),
+            ('GET', '/v1.0/100/volumes/123-456'),
+        ])
+        # no second volume
+        self.assert_('_name_id' not in update)
+        self.assertEquals(update['host'], 'foo')
+
     def test_create_volume_with_meta(self):
         MetaEntry = namedtuple('MetaEntry', ['key', 'value'])
         meta = MetaEntry('foo', 'bar')
@@ -228,6 +405,50 @@ class TestLunrDriver(DriverTestCase):
             d.create_cloned_volume(volume, source)
         self.assertEquals(len(self.request_callback.called), 3)
 
+    def test_create_cloned_volume_async(self):
+        self.configuration.lunr_async_clone = True
+        volume = {'name': 'vol1', 'size': 5, 'project_id': 100,
+                  'id': '123-456', 'volume_type': {'name': 'vtype'}}
+        source = {'name': 'vol2', 'size': 5, 'project_id': 100,
+                  'id': '234-567', 'volume_type': {'name': 'vtype'}}
+        self.resp = [json.dumps({'size': 5})]
+        d = driver.LunrDriver(configuration=self.configuration)
+        tracked = []
+        d.reconciler.track = lambda *args, **kwargs: tracked.append(args)
+        model_update = d.create_cloned_volume(volume, source)
+        self.assertEquals(model_update, {})
+        # returned as soon as Lunr accepted the create
+        self.assertEquals(len(self.request_callback.called), 1)
+        self.assertEquals(tracked, [(volume, '123-456', ('ACTIVE',))])
+
+    def test_clone_of_unfinished_volume_waits(self):
+        self.configuration.lunr_async_clone = True
+        volume = {'name': 'vol1', 'size': 5, 'project_id': 100,
+                  'id': '123-456', 'volume_type': {'name': 'vtype'}}
+        source = {'name': 'vol2', 'size': 5, 'project_id': 100,
+                  'id': '234-567', 'volume_type': {'name': 'vtype'}}
+        d = driver.LunrDriver(configuration=self.configuration)
+        # cinder has the source available, lunr is still building it
+        d.reconciler.pending = lambda lunr_id: reconciler.Job(
+            source, lunr_id, ('ACTIVE',)) if lunr_id == '234-567' else None
+        d.reconciler.track = lambda *args, **kwargs: None
+        requests = []
+
+        def callback(req):
+            url = urlparse(req.get_full_url())
+            requests.append((req.get_method(), url.path))
+        self.request_callback = callback
+        self.resp = [json.dumps({'id': '234-567', 'status': 'BUILDING'}),
+                     json.dumps({'id': '234-567', 'status': 'ACTIVE'}),
+                     json.dumps({'size': 5})]
+        with patch(client, 'sleep', no_sleep):
+            d.create_cloned_volume(volume, source)
+        self.assertEquals(requests, [
+            ('GET', '/v1.0/100/volumes/234-567'),
+            ('GET', '/v1.0/100/volumes/234-567'),
+            ('PUT', '/v1.0/100/volumes/123-456'),
+        ])
+
     def test_clone_image(self):
         volume = {'name': 'vol1', 'size': 5, 'project_id': 100,
                   'id': '123-456', 'volume_type': {'name': 'vtype'}}
@@ -256,6 +477,58 @@ class TestLunrDriver(DriverTestCase):
                           'image_service')
         self.assertEquals(len(self.request_callback.called), 3)
 
+    def test_clone_cached_image(self):
+        self.configuration.lunr_image_cache = True
+        volume = {'name': 'vol1', 'size': 5, 'project_id': 100,
+                  'id': '123-456', 'volume_type': {'name': 'vtype'}}
+        image_meta = {'id': 'image_id_1', 'checksum': 'abc'}
+        def callback(req):
+            if len(self.request_callback.called) > 1:
+                self.assertEquals(req.get_method(), 'GET')
+                return
+            self.assertEquals(req.get_method(), 'PUT')
+            data = urldecode(urlparse(req.get_full_url()).query)
+            self.assertEquals(data['source_volume'], 'golden')
+            self.assert_('image_id' not in data)
+        self.request_callback = callback
+        self.resp = [json.dumps({'size': 5}),
+                     json.dumps({'status': 'ACTIVE'})]
+        d = driver.LunrDriver(configuration=self.configuration)
+        lookups = []
+
+        def lookup(volume, volume_type_name, image_meta):
+            lookups.append((volume_type_name, image_meta['id']))
+            return 'golden'
+        d.image_cache.lookup = lookup
+        with patch(client, 'sleep', no_sleep):
+            d.clone_image('unused', volume, 'location', image_meta,
+                          'image_service')
+        self.assertEquals(lookups, [('vtype', 'image_id_1')])
+        self.assertEquals(len(self.request_callback.called), 2)
+        self.assert_('image_cache' in d.get_volume_stats())
+
+    def test_restore_cached_snapshot(self):
+        self.configuration.lunr_restore_cache = True
+        volume = {'name': 'vol1', 'size': 5, 'project_id': 100,
+                  'id': '123-456', 'volume_type': {'name': 'vtype'}}
+        snapshot = {'id': 'snap1', 'project_id': 100}
+        def callback(req):
+            if len(self.request_callback.called) > 1:
+                self.assertEquals(req.get_method(), 'GET')
+                return
+            data = urldecode(urlparse(req.get_full_url()).query)
+            self.assertEquals(data['source_volume'], 'restored')
+            self.assert_('backup' not in data)
+        self.request_callback = callback
+        self.resp = [json.dumps({'size': 5}),
+                     json.dumps({'status': 'ACTIVE'})]
+        d = driver.LunrDriver(configuration=self.configuration)
+        d.restore_cache.lookup = lambda *args: 'restored'
+        with patch(client, 'sleep', no_sleep):
+            d.create_volume_from_snapshot(volume, snapshot)
+        self.assertEquals(len(self.request_callback.called), 2)
+        self.assert_('restore_cache' in d.get_volume_stats())
+
     def test_failed_volume_create(self):
         # TODO: resp should be URLError'y
         self.resp = Exception('kaboom!')
@@ -278,14 +551,63 @@ class TestLunrDriver(DriverTestCase):
         d.delete_volume(volume)
         self.assert_(self.request_callback.called)
 
+    def test_delete_volume_leftover_speculative_export(self):
+        self.configuration.lunr_speculative_exports = True
+        volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
+                  'id': '345-678', 'volume_type': {'name': 'vtype'}}
+        requests = []
+
+        def callback(req):
+            url = urlparse(req.get_full_url())
+            requests.append((req.get_method(), url.path))
+        self.request_callback = callback
+        # exported ahead of time before a restart, never claimed
+        self.resp = [json.dumps({'id': '345-678', 'ip': '127.0.0.1'}),
+                     '{}', json.dumps({'status': 'DELETING'})]
+        d = driver.LunrDriver(configuration=self.configuration)
+        d.delete_volume(volume)
+        self.assertEquals(requests, [
+            ('GET', '/v1.0/100/volumes/345-678/export'),
+            ('DELETE', '/v1.0/100/volumes/345-678/export'),
+            ('DELETE', '/v1.0/100/volumes/345-678'),
+        ])
+
     def test_failed_delete_connection_error(self):
-        self.resp = URLError(OSError(errno.ECONNREFUSED,
-                                     os.strerror(errno.ECONNREFUSED)))
+        err = URLError(OSError(errno.ECONNREFUSED,
+                               os.strerror(errno.ECONNREFUSED)))
+        # DELETE is idempotent, so it's retried lunr_retry_attempts times
+        self.resp = [err, err, err]
         d = driver.LunrDriver(configuration=self.configuration)
         volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
                   'id': '456-789', 'volume_type': {'name': 'vtype'}}
-        self.assertRaises(client.LunrError, d.delete_volume, volume)
-        self.assert_(self.request_callback.called)
+        with patch(client, 'sleep', no_sleep):
+            self.assertRaises(client.LunrError, d.delete_volume, volume)
+        self.assertEquals(len(self.request_callback.called), 3)
+        stats = d.get_volume_stats()['retries']
+        self.assertEquals(stats['retries'], 2)
+        self.assertEquals(stats['exhausted'], 1)
+
+    def test_delete_retry_recovers(self):
+        err = HTTPError('/v1.0/100/volumes/456-789', 503, 'Unavailable',
+                        {'Retry-After': '0'}, StringIO('{}'))
+        self.resp = [err, json.dumps({'status': 'DELETING'})]
+        d = driver.LunrDriver(configuration=self.configuration)
+        volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
+                  'id': '456-789', 'volume_type': {'name': 'vtype'}}
+        with patch(client, 'sleep', no_sleep):
+            d.delete_volume(volume)
+        self.assertEquals(len(self.request_callback.called), 2)
+        self.assertEquals(d.get_volume_stats()['retries']['recovered'], 1)
+
+    def test_update_is_not_retried(self):
+        self.resp = HTTPError('/v1.0/100/volumes/456-789/export', 503,
+                              'Unavailable', {}, StringIO('{}'))
+        d = driver.LunrDriver(configuration=self.configuration)
+        volume = {'name': 'vol1', 'size': 1, 'project_id': 100,
+                  'id': '456-789', 'volume_type': {'name': 'vtype'}}
+        self.assertRaises(client.LunrError, d.attach_volume, None, volume,
+                          'instance1', 'host1', '/dev/vdb')
+        self.assertEquals(len(self.request_callback.called), 1)
 
     def test_failed_delete_server_error(self):
         # url, code, msg, hdrs, fp
@@ -330,12 +652,12 @@ class TestLunrDriver(DriverTestCase):
                               '/v1.0/dev/volumes/%s/export' % volume['id'])
         self.request_callback = callback
         d = driver.LunrDriver(configuration=self.configuration)
-        _orig_gethostbyname = utils.socket.gethostbyname
+        _orig_gethostbyname = resolver.socket.gethostbyname
         try:
-            utils.socket.gethostbyname = lambda *args: '10.0.0.1'
+            resolver.socket.gethostbyname = lambda *args: '10.0.0.1'
             connection_info = d.initialize_connection(volume, self.connector)
         finally:
-            utils.socket.gethostbyname = _orig_gethostbyname
+            resolver.socket.gethostbyname = _orig_gethostbyname
         self.assert_(self.request_callback.called)
         expected = {
             'driver_volume_type': 'iscsi',
@@ -348,6 +670,110 @@ class TestLunrDriver(DriverTestCase):
         }
         self.assertEquals(connection_info, expected)
 
+    def test_initialize_connection_reuses_export(self):
+        volume = {'id': 1, 'name': 'vol1', 'project_id': 'dev'}
+        export = json.dumps({
+            'id': 'vol1',
+            'target_portal': '10.0.0.1:3260',
+            'target_name': 'iqn-vol1',
+        })
+        self.resp = [export] * 4
+        d = driver.LunrDriver(configuration=self.configuration)
+        first = d.initialize_connection(volume, self.connector)
+        first['data']['mutated'] = True
+        second = d.initialize_connection(volume, self.connector)
+        self.assertEquals(len(self.request_callback.called), 1)
+        self.assert_('mutated' not in second['data'])
+        # another host has to get its own
+        d.initialize_connection(volume, {'ip': '10.0.0.2'})
+        self.assertEquals(len(self.request_callback.called), 2)
+        # terminate_connection gets rid of the export
+        d.terminate_connection(volume, self.connector)
+        d.initialize_connection(volume, self.connector)
+        self.assertEquals(len(self.request_callback.called), 4)
+        stats = d.get_volume_stats()['exports']
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 3)
+
+    def test_initialize_connection_speculative_export(self):
+        self.configuration.lunr_speculative_exports = True
+        MetaEntry = namedtuple('MetaEntry', ['key', 'value'])
+        volume = {'id': 'vol1', 'name': 'vol1', 'size': 1,
+                  'project_id': 'dev', 'volume_type': {'name': 'vtype'},
+                  'volume_metadata': [MetaEntry('boot', 'true')]}
+        d = driver.LunrDriver(configuration=self.configuration)
+        prepared = []
+        d.speculative_exports.prepare = \
+            lambda volume, volume_id, statuses: prepared.append(volume_id)
+        self.resp = json.dumps({'id': 'vol1', 'size': 1})
+        d.create_volume(volume)
+        self.assertEquals(prepared, ['vol1'])
+        claims = []
+
+        def claim(client, volume_id, connector, deadline=None):
+            claims.append(volume_id)
+            return {'driver_volume_type': 'iscsi', 'data': {}}
+        d.speculative_exports.claim = claim
+        d.initialize_connection(volume, self.connector)
+        self.assertEquals(claims, ['vol1'])
+        # only the create went to lunr
+        self.assertEquals(len(self.request_callback.called), 1)
+        self.assert_('speculative_exports' in d.get_volume_stats())
+
+    def test_terminate_connections(self):
+        pairs = [
+            ({'id': 'vol1', 'project_id': 'p1'}, {'initiator': 'iqn-a'}),
+            ({'id': 'vol2', 'project_id': 'p2'}, {'initiator': 'iqn-a'}),
+            ({'id': 'vol3', 'project_id': 'p1'}, {'initiator': 'iqn-a'}),
+        ]
+        requests = []
+
+        def urlopen(req, *args, **kwargs):
+            url = urlparse(req.get_full_url())
+            requests.append((req.get_method(), url.path))
+            data = urldecode(url.query)
+            self.assertEquals(data['initiator'], 'iqn-a')
+            if url.path == '/v1.0/p1/exports':
+                self.assertEquals(data['volumes'], 'vol1,vol3')
+                return MockResponse(json.dumps({
+                    'vol1': {'code': 200},
+                    'vol3': {'code': 404, 'reason': 'Not Found'},
+                }))
+            if url.path == '/v1.0/p2/volumes/vol2/export':
+                return MockResponse('{}')
+            raise HTTPError(req.get_full_url(), 404, 'Not Found', {},
+                            StringIO('{}'))
+        d = driver.LunrDriver(configuration=self.configuration)
+        with patch(client, 'urlopen', urlopen):
+            report = d.terminate_connections(pairs)
+        self.assertEquals([r.key for r in report.results],
+                          ['vol1', 'vol3', 'vol2'])
+        self.assertEquals([r.ok for r in report.results],
+                          [True, False, True])
+        self.assertEquals(report.results[1].error.code, 404)
+        # one request for all of p1, p2 has just the one volume
+        self.assertEquals(sorted(requests), [
+            ('DELETE', '/v1.0/p1/exports'),
+            ('DELETE', '/v1.0/p2/volumes/vol2/export'),
+        ])
+        stats = d.get_volume_stats()['bulk']
+        self.assertEquals(stats['operations'], 2)
+        self.assertEquals(stats['bulk_requests'], 1)
+
+    def test_detach_volumes(self):
+        volumes = [{'id': 'vol1', 'project_id': 'p1'},
+                   {'id': 'vol2', 'project_id': 'p1'}]
+        self.resp = [HTTPError('/v1.0/p1/exports', 501, 'Not Implemented',
+                               {}, StringIO('{}')), '{}', '{}']
+        d = driver.LunrDriver(configuration=self.configuration)
+        report = d.detach_volumes(None, volumes)
+        self.assertEquals([r.key for r in report.results], ['vol1', 'vol2'])
+        self.assertEquals(len(report.succeeded), 2)
+        # one per volume after the bulk endpoint turned out not to be there
+        self.assertEquals(len(self.request_callback.called), 3)
+        self.assertEquals(d.get_volume_stats()['bulk']['unsupported'],
+                          ['exports'])
+
     def test_target_portal_is_ip(self):
         volume = {'id': 1, 'name': 'vol1', 'project_id': 'dev'}
         self.resp = json.dumps({
@@ -362,14 +788,14 @@ class TestLunrDriver(DriverTestCase):
                               '/v1.0/dev/volumes/%s/export' % volume['id'])
         self.request_callback = callback
         d = driver.LunrDriver(configuration=self.configuration)
-        _orig_gethostbyname = utils.socket.gethostbyname
+        _orig_gethostbyname = resolver.socket.gethostbyname
         try:
             def mock_gethostbyname(*args):
                 raise Exception('driver should not call gethostbyname on ip')
-            utils.socket.gethostbyname = mock_gethostbyname
+            resolver.socket.gethostbyname = mock_gethostbyname
             connection_info = d.initialize_connection(volume, self.connector)
         finally:
-            utils.socket.gethostbyname = _orig_gethostbyname
+            resolver.socket.gethostbyname = _orig_gethostbyname
         self.assert_(self.request_callback.called)
         expected = {
             'driver_volume_type': 'iscsi',
@@ -397,14 +823,14 @@ class TestLunrDriver(DriverTestCase):
                               '/v1.0/dev/volumes/%s/export' % volume['id'])
         self.request_callback = callback
         d = driver.LunrDriver(configuration=self.configuration)
-        _orig_gethostbyname = utils.socket.gethostbyname
+        _orig_gethostbyname = resolver.socket.gethostbyname
         try:
             def mock_gethostbyname(*args):
-                raise utils.socket.gaierror(-5, 'No address associated with hostname')
-            utils.socket.gethostbyname = mock_gethostbyname
+                raise resolver.socket.gaierror(-5, 'No address associated with hostname')
+            resolver.socket.gethostbyname = mock_gethostbyname
             connection_info = d.initialize_connection(volume, self.connector)
         finally:
-            utils.socket.gethostbyname = _orig_gethostbyname
+            resolver.socket.gethostbyname = _orig_gethostbyname
         self.assert_(self.request_callback.called)
         expected = {
             'driver_volume_type': 'iscsi',
@@ -537,6 +963,40 @@ class TestLunrDriver(DriverTestCase):
             self.assertRaises(client.StatusError, d.create_snapshot, snapshot)
         self.assertEquals(len(self.request_callback.called), 3)
 
+    def test_snapshot_of_unfinished_volume_waits(self):
+        self.configuration.lunr_async_clone = True
+        snapshot = {'id': '0000-0000', 'volume_id': '0000-0001',
+                    'project_id': 'dev'}
+
+        class MockDB:
+            def volume_get(self, ctx, volume_id):
+                return {'id': volume_id, 'project_id': 'dev'}
+
+        d = driver.LunrDriver(configuration=self.configuration)
+        d.db = MockDB()
+        # cinder has the volume available, lunr is still building it
+        d.reconciler.pending = lambda lunr_id: reconciler.Job(
+            {'id': lunr_id}, lunr_id, ('ACTIVE',)) \
+            if lunr_id == '0000-0001' else None
+        requests = []
+
+        def callback(req):
+            url = urlparse(req.get_full_url())
+            requests.append((req.get_method(), url.path))
+        self.request_callback = callback
+        self.resp = [json.dumps({'id': '0000-0001', 'status': 'BUILDING'}),
+                     json.dumps({'id': '0000-0001', 'status': 'ACTIVE'}),
+                     json.dumps({'id': '0000-0000', 'status': 'SAVING'}),
+                     json.dumps({'id': '0000-0000', 'status': 'AVAILABLE'})]
+        with patch(client, 'sleep', no_sleep):
+            d.create_snapshot(snapshot)
+        self.assertEquals(requests, [
+            ('GET', '/v1.0/dev/volumes/0000-0001'),
+            ('GET', '/v1.0/dev/volumes/0000-0001'),
+            ('PUT', '/v1.0/dev/backups/0000-0000'),
+            ('GET', '/v1.0/dev/backups/0000-0000'),
+        ])
+
     def test_delete_snapshot_success(self):
         # args
         snapshot = {
@@ -584,6 +1044,19 @@ class TestLunrDriver(DriverTestCase):
             d.delete_snapshot(snapshot)
         self.assertEquals(len(self.request_callback.called), 3)
 
+    def test_delete_snapshot_queued(self):
+        scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch)
+        self.configuration.lunr_snapshot_delete_queue = os.path.join(
+            scratch, 'deletes.db')
+        d = driver.LunrDriver(configuration=self.configuration)
+        d.delete_snapshot({'id': '0000-0000', 'project_id': 'dev'})
+        # lunr hears about it later
+        self.assertEquals(len(self.request_callback.called), 0)
+        stats = d.get_volume_stats()['snapshot_deletes']
+        self.assertEquals(stats['queued'], 1)
+        self.assertEquals(stats['drain_rate'], 0)
+
     def test_check_for_setup_error(self):
         # setup mock response
         vtype1 = {
@@ -609,6 +1082,7 @@ class TestLunrDriver(DriverTestCase):
             url = urlparse(req.get_full_url())
             self.assertEquals(url.path, '/v1.0/admin/volume_types')
         self.request_callback = request_callback
+        self.configuration.lunr_volume_type_sync_interval = 0
         d = driver.LunrDriver(configuration=self.configuration)
         # mock cinder db call
         class MockVolumeTypeApi(object):
@@ -616,15 +1090,19 @@ class TestLunrDriver(DriverTestCase):
             def __init__(self):
                 self.types = []
 
+            def get_all_types(self, context):
+                return {}
+
             def create(self, context, name, extra_specs={}):
                 self.types.append(name)
 
         mock_volume_type_api = MockVolumeTypeApi()
 
-        with patch(driver, 'volume_types', mock_volume_type_api):
+        with patch(typesync, 'volume_types', mock_volume_type_api):
             d.check_for_setup_error()
         self.assert_(self.request_callback.called)
-        self.assert_(mock_volume_type_api.types, ['vtype1'])
+        self.assertEquals(mock_volume_type_api.types, ['vtype1'])
+        self.assertEquals(d.get_volume_stats()['type_sync']['syncs'], 1)
 
     def test_volume_type_already_exists(self):
         # setup mock response
@@ -652,6 +1130,11 @@ class TestLunrDriver(DriverTestCase):
             def __init__(self):
                 self.types = ['vtype1']
                 self.duplicate_create_types = []
+
+            def get_all_types(self, context):
+                return dict((name, {'id': i, 'name': name})
+                            for i, name in enumerate(self.types))
+
             def create(self, context, name, extra_specs={}):
                 if name in self.types:
                     self.duplicate_create_types.append(name)
@@ -661,21 +1144,22 @@ class TestLunrDriver(DriverTestCase):
 
         mock_volume_type_api = MockVolumeTypeApi()
 
+        self.configuration.lunr_volume_type_sync_interval = 0
         d = driver.LunrDriver(configuration=self.configuration)
-        with patch(driver, 'volume_types', mock_volume_type_api):
+        with patch(typesync, 'volume_types', mock_volume_type_api):
             d.check_for_setup_error()
             self.assert_(self.request_callback.called)
-            self.assert_(mock_volume_type_api.types, ['vtype1', 'vtype2'])
-            self.assert_(mock_volume_type_api.duplicate_create_types, ['vtype1'])
+            self.assertEquals(mock_volume_type_api.types, ['vtype1', 'vtype2'])
+            # types cinder already has aren't created again
+            self.assertEquals(mock_volume_type_api.duplicate_create_types, [])
             # call again
             self.resp = json.dumps([vtype1, vtype2])
             d.check_for_setup_error()
-            self.assert_(mock_volume_type_api.types, ['vtype1', 'vtype2'])
-            expected = ['vtype1',  # from first run
-                       'vtype1', 'vtype2']  # second time both raise
-            self.assert_(mock_volume_type_api.duplicate_create_types, expected)
+            self.assertEquals(mock_volume_type_api.types, ['vtype1', 'vtype2'])
+            self.assertEquals(mock_volume_type_api.duplicate_create_types, [])
 
     def test_check_for_setup_error_fails(self):
+        self.configuration.lunr_volume_type_sync_interval = 0
         d = driver.LunrDriver(configuration=self.configuration)
         # three unable to connects
         err = URLError(
@@ -684,8 +1168,10 @@ class TestLunrDriver(DriverTestCase):
             )
         ) 
         self.resp = [err for i in range(3)]
-        with patch(driver, 'sleep', no_sleep):
+        with patch(typesync, 'sleep', no_sleep), \
+                patch(client, 'sleep', no_sleep):
             d.check_for_setup_error()
+        self.assertEquals(d.get_volume_stats()['type_sync']['failures'], 1)
         # two errors, and one success!
         vtype = {
             'name': 'new_type',
@@ -698,7 +1184,8 @@ class TestLunrDriver(DriverTestCase):
             'last_modified': date_string(-2),
         }
         self.resp = [err, err, json.dumps([vtype])]
-        with patch(driver, 'sleep', no_sleep):
+        with patch(typesync, 'sleep', no_sleep), \
+                patch(client, 'sleep', no_sleep):
             d.check_for_setup_error()
             self.assert_('new_type' in self.volume_types.store)
 
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError
+
+from lunrdriver.driver import exports
+from lunrdriver.lunr import client
+
+from testlunrdriver.unit.driver import ClientTestCase
+
+
+INFO = {
+    'driver_volume_type': 'iscsi',
+    'data': {
+        'target_discovered': False,
+        'target_iqn': 'iqn-vol1',
+        'target_portal': '10.0.0.1:3260',
+        'volume_id': 'vol1',
+    }
+}
+
+
+class TestExportRegistry(ClientTestCase):
+
+    def setUp(self):
+        super(TestExportRegistry, self).setUp()
+        self._orig_time = exports.time
+        self.now = 1000.0
+        exports.time = lambda: self.now
+        self.client = client.LunrClient('http://127.0.0.1:8080/v1.0',
+                                        {'project_id': 'dev'})
+        self.connector = {'ip': '10.0.0.2'}
+
+    def tearDown(self):
+        super(TestExportRegistry, self).tearDown()
+        exports.time = self._orig_time
+
+    def test_hit(self):
+        registry = exports.ExportRegistry(ttl=60)
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          None)
+        registry.put('vol1', self.connector, INFO)
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          INFO)
+        self.assertEquals(registry.get(self.client, 'vol1', {'ip': 'x'}),
+                          None)
+        self.assertFalse(self.request_callback.called)
+        stats = registry.stats()
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 2)
+
+    def test_validates_when_old(self):
+        registry = exports.ExportRegistry(ttl=60)
+        registry.put('vol1', self.connector, INFO)
+        self.now += 61
+        self.resp = json.dumps({'id': 'vol1', 'target_name': 'iqn-vol1'})
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          INFO)
+        self.assertEquals(len(self.request_callback.called), 1)
+        # good for another ttl
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          INFO)
+        self.assertEquals(len(self.request_callback.called), 1)
+        self.assertEquals(registry.stats()['validated'], 1)
+
+    def test_export_gone(self):
+        registry = exports.ExportRegistry(ttl=0)
+        registry.put('vol1', self.connector, INFO)
+        self.now += 1
+        self.resp = HTTPError('/v1.0/dev/volumes/vol1/export', 404,
+                              'Not Found', {}, StringIO('{}'))
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          None)
+        self.assertEquals(registry.stats()['size'], 0)
+
+    def test_export_changed(self):
+        registry = exports.ExportRegistry(ttl=0)
+        registry.put('vol1', self.connector, INFO)
+        self.now += 1
+        self.resp = json.dumps({'id': 'vol1', 'target_name': 'iqn-other'})
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          None)
+
+    def test_export_rebound(self):
+        registry = exports.ExportRegistry(ttl=0)
+        registry.put('vol1', self.connector, INFO)
+        self.now += 1
+        self.resp = json.dumps({'id': 'vol1', 'target_name': 'iqn-vol1',
+                                'ip': '10.0.0.3'})
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          None)
+
+    def test_other_connector_replaces(self):
+        registry = exports.ExportRegistry(ttl=60)
+        registry.put('vol1', self.connector, INFO)
+        # lunr rebinds the export to the other host
+        registry.put('vol1', {'ip': '10.0.0.3'}, INFO)
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          None)
+        self.assertEquals(registry.get(self.client, 'vol1',
+                                       {'ip': '10.0.0.3'}), INFO)
+        self.assertFalse(self.request_callback.called)
+        self.assertEquals(registry.stats()['size'], 1)
+
+    def test_invalidate(self):
+        registry = exports.ExportRegistry()
+        registry.put('vol1', self.connector, INFO)
+        registry.put('vol2', self.connector, INFO)
+        registry.invalidate('vol1')
+        stats = registry.stats()
+        self.assertEquals(stats['size'], 1)
+        self.assertEquals(stats['invalidations'], 1)
+
+    def test_max_size(self):
+        registry = exports.ExportRegistry(max_size=2)
+        for volume_id in ('vol1', 'vol2', 'vol3'):
+            registry.put(volume_id, self.connector, INFO)
+        self.assertEquals(registry.get(self.client, 'vol1', self.connector),
+                          None)
+        self.assert_(registry.get(self.client, 'vol3', self.connector))
+
+
+if __name__ == "__main__":
+    unittest.main()
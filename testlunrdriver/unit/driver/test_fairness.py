@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+import unittest
+
+from eventlet import sleep, spawn
+
+from lunrdriver.driver import fairness
+
+
+class TestFairScheduler(unittest.TestCase):
+
+    def run_all(self, scheduler, jobs):
+        """
+        Run (project_id, operation) jobs with every slot taken, and return
+        the order they got a slot in.
+        """
+        order = []
+        blockers = []
+
+        def job(project_id, operation):
+            with scheduler.slot(project_id, operation):
+                order.append((project_id, operation))
+                sleep(0)
+        # take up every slot so the rest has to queue
+        for i in range(scheduler.slots):
+            scheduler.acquire('blocker', 'create_volume')
+            blockers.append('blocker')
+        threads = [spawn(job, *args) for args in jobs]
+        # let them all queue up
+        sleep(0)
+        for blocker in blockers:
+            scheduler.release(blocker, 'create_volume')
+        for thread in threads:
+            thread.wait()
+        return order
+
+    def test_runs_right_away(self):
+        scheduler = fairness.FairScheduler(slots=2)
+        with scheduler.slot('p1', 'create_volume'):
+            stats = scheduler.stats()
+            self.assertEquals(stats['running'], 1)
+            self.assertEquals(stats['projects']['p1']['running'], 1)
+        stats = scheduler.stats()
+        self.assertEquals(stats['running'], 0)
+        self.assertEquals(stats['projects']['p1']['served'], 1)
+        self.assertEquals(stats['projects']['p1']['mean_wait'], 0)
+
+    def test_round_robin(self):
+        scheduler = fairness.FairScheduler(slots=1)
+        jobs = [('greedy', 'create_volume')] * 4 + \
+            [('p1', 'create_volume'), ('p2', 'create_volume')]
+        order = self.run_all(scheduler, jobs)
+        self.assertEquals([project_id for project_id, op in order],
+                          ['greedy', 'p1', 'p2', 'greedy', 'greedy',
+                           'greedy'])
+
+    def test_latency_sensitive_first(self):
+        scheduler = fairness.FairScheduler(slots=1)
+        jobs = [('p1', 'create_volume'), ('p1', 'delete_volume'),
+                ('p2', 'initialize_connection')]
+        order = self.run_all(scheduler, jobs)
+        self.assertEquals(order[0], ('p2', 'initialize_connection'))
+
+    def test_weighted(self):
+        scheduler = fairness.FairScheduler(slots=1, policy='weighted',
+                                           weights={'big': '3'})
+        jobs = [('big', 'create_volume')] * 6 + \
+            [('small', 'create_volume')] * 2
+        order = self.run_all(scheduler, jobs)
+        projects = [project_id for project_id, op in order]
+        # big gets three turns for every one of small
+        self.assertEquals(projects[:4].count('big'), 3)
+        self.assertEquals(projects[4:].count('big'), 3)
+
+    def test_round_robin_ignores_weights(self):
+        scheduler = fairness.FairScheduler(slots=1, weights={'big': 3})
+        jobs = [('big', 'create_volume')] * 2 + [('small', 'create_volume')]
+        order = self.run_all(scheduler, jobs)
+        self.assertEquals([project_id for project_id, op in order],
+                          ['big', 'small', 'big'])
+
+    def test_queue_depth(self):
+        scheduler = fairness.FairScheduler(slots=1)
+        scheduler.acquire('p1', 'create_volume')
+        thread = spawn(scheduler.acquire, 'p2', 'create_volume')
+        sleep(0)
+        stats = scheduler.stats()
+        self.assertEquals(stats['queued'], 1)
+        self.assertEquals(stats['projects']['p2']['queued'], 1)
+        scheduler.release('p1', 'create_volume')
+        thread.wait()
+        stats = scheduler.stats()
+        self.assertEquals(stats['queued'], 0)
+        self.assertEquals(stats['projects']['p2']['running'], 1)
+
+    def test_forgets_idle_projects(self):
+        scheduler = fairness.FairScheduler(slots=1, max_projects=2)
+        for project_id in ('p1', 'p2', 'p3'):
+            with scheduler.slot(project_id, 'create_volume'):
+                pass
+        self.assertEquals(sorted(scheduler.stats()['projects']), ['p3'])
+
+    def test_reserved_slots(self):
+        scheduler = fairness.FairScheduler(slots=3, reserved=1)
+        scheduler.acquire('p1', 'create_volume')
+        scheduler.acquire('p1', 'create_volume')
+        # the last slot is kept for attaches
+        thread = spawn(scheduler.acquire, 'p2', 'create_volume')
+        sleep(0)
+        self.assertEquals(scheduler.stats()['queued'], 1)
+        with scheduler.slot('p3', 'initialize_connection'):
+            self.assertEquals(scheduler.stats()['running'], 3)
+        # which doesn't free one up for creates
+        self.assertEquals(scheduler.stats()['queued'], 1)
+        scheduler.release('p1', 'create_volume')
+        thread.wait()
+        stats = scheduler.stats()
+        self.assertEquals(stats['queued'], 0)
+        self.assertEquals(stats['projects']['p2']['running'], 1)
+        self.assertRaises(ValueError, fairness.FairScheduler, slots=2,
+                          reserved=2)
+
+    def test_killed_waiter(self):
+        scheduler = fairness.FairScheduler(slots=1)
+        scheduler.acquire('p1', 'create_volume')
+        thread = spawn(scheduler.acquire, 'p2', 'create_volume')
+        sleep(0)
+        thread.kill()
+        stats = scheduler.stats()
+        self.assertEquals(stats['queued'], 0)
+        # the slot isn't handed to the dead waiter
+        scheduler.release('p1', 'create_volume')
+        self.assertEquals(scheduler.stats()['running'], 0)
+        with scheduler.slot('p3', 'create_volume'):
+            pass
+
+    def test_killed_after_handoff(self):
+        scheduler = fairness.FairScheduler(slots=1)
+        scheduler.acquire('p1', 'create_volume')
+        thread = spawn(scheduler.acquire, 'p2', 'create_volume')
+        sleep(0)
+        # handed the slot, but killed before it got to run
+        scheduler.release('p1', 'create_volume')
+        thread.kill()
+        self.assertEquals(scheduler.stats()['running'], 0)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, fairness.FairScheduler,
+                          policy='lottery')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError
+
+from lunrdriver.driver import imagecache
+from lunrdriver.lunr import client
+
+from testlunrdriver.unit.driver import MockLunrTestCase
+
+
+class TestImageCache(MockLunrTestCase):
+
+    def setUp(self):
+        super(TestImageCache, self).setUp()
+        self.image = {'id': 'img1', 'checksum': 'abc'}
+
+    def test_miss_then_hit(self):
+        cache = imagecache.ImageCache(self.clients)
+        self.assertEquals(cache.lookup(self.volume, 'vtype', self.image),
+                          None)
+        # it built a golden volume of the image
+        self.assertEquals(len(self.volumes), 1)
+        golden = self.volumes.values()[0]
+        self.assertEquals(golden['image_id'], 'img1')
+        self.assertEquals(golden['size'], 5)
+        self.assertEquals(imagecache.parse_golden_name(golden['name']),
+                          ('img1', imagecache.image_version(self.image)))
+        self.assertEquals(cache.lookup(self.volume, 'vtype', self.image),
+                          golden['id'])
+        stats = cache.stats()
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 1)
+        self.assertEquals(stats['count'], 1)
+        self.assertEquals(stats['size_gb'], 5)
+
+    def test_too_small(self):
+        cache = imagecache.ImageCache(self.clients)
+        cache.lookup(self.volume, 'vtype', self.image)
+        small = dict(self.volume, size=1)
+        self.assertEquals(cache.lookup(small, 'vtype', self.image), None)
+        # still just the one
+        self.assertEquals(len(self.volumes), 1)
+
+    def test_keyed_by_type_and_project(self):
+        cache = imagecache.ImageCache(self.clients)
+        cache.lookup(self.volume, 'vtype', self.image)
+        self.assertEquals(cache.lookup(self.volume, 'ssd', self.image), None)
+        other = dict(self.volume, project_id='other')
+        self.assertEquals(cache.lookup(other, 'vtype', self.image), None)
+        self.assertEquals(cache.stats()['count'], 3)
+
+    def test_image_changed(self):
+        cache = imagecache.ImageCache(self.clients)
+        cache.lookup(self.volume, 'vtype', self.image)
+        old_id = self.volumes.keys()[0]
+        changed = dict(self.image, checksum='def')
+        self.assertEquals(cache.lookup(self.volume, 'vtype', changed), None)
+        self.assert_(old_id not in self.volumes)
+        self.assertEquals(len(self.volumes), 1)
+        self.assertEquals(cache.stats()['invalidations'], 1)
+        self.assertEquals(cache.lookup(self.volume, 'vtype', changed),
+                          self.volumes.keys()[0])
+
+    def test_lru_eviction(self):
+        cache = imagecache.ImageCache(self.clients, max_count=2)
+        images = [{'id': 'img%s' % i, 'checksum': 'abc'} for i in range(3)]
+        cache.lookup(self.volume, 'vtype', images[0])
+        cache.lookup(self.volume, 'vtype', images[1])
+        # img0 was used more recently than img1
+        cache.lookup(self.volume, 'vtype', images[0])
+        cache.lookup(self.volume, 'vtype', images[2])
+        cached = sorted(v['image_id'] for v in self.volumes.values())
+        self.assertEquals(cached, ['img0', 'img2'])
+        self.assertEquals(cache.stats()['evictions'], 1)
+
+    def test_size_limit(self):
+        cache = imagecache.ImageCache(self.clients, max_gb=8)
+        cache.lookup(self.volume, 'vtype', self.image)
+        cache.lookup(self.volume, 'vtype', {'id': 'img2', 'checksum': 'x'})
+        self.assertEquals(cache.stats()['size_gb'], 5)
+        self.assertEquals([v['image_id'] for v in self.volumes.values()],
+                          ['img2'])
+
+    def test_adopts_after_restart(self):
+        cache = imagecache.ImageCache(self.clients)
+        cache.lookup(self.volume, 'vtype', self.image)
+        golden_id = self.volumes.keys()[0]
+        self.volumes['vol2'] = {'id': 'vol2', 'name': 'vol2', 'size': 1,
+                                'status': 'ACTIVE',
+                                'volume_type_name': 'vtype'}
+        cache = imagecache.ImageCache(self.clients)
+        self.assertEquals(cache.lookup(self.volume, 'vtype', self.image),
+                          golden_id)
+        self.assertEquals(cache.stats()['count'], 1)
+
+    def test_sweep_adopts_every_project(self):
+        cache = imagecache.ImageCache(self.clients)
+        cache.lookup(self.volume, 'vtype', self.image)
+        other = dict(self.volume, project_id='other')
+        cache.lookup(other, 'vtype', self.image)
+        cache = imagecache.ImageCache(self.clients, max_count=1)
+        cache.sweep()
+        # nobody looked anything up, they're over the limit all the same
+        self.assertEquals(cache.stats()['count'], 1)
+        self.assertEquals(len(self.volumes), 1)
+        del self.requests[:]
+        cache.lookup(self.volume, 'vtype', self.image)
+        # no need to list the project again
+        self.assert_(('GET', '/v1.0/fake/volumes') not in self.requests)
+
+    def fail_next(self, method, code):
+        mock_urlopen = self.mock_urlopen
+
+        def urlopen(req, *args, **kwargs):
+            if req.get_method() != method:
+                return mock_urlopen(req, *args, **kwargs)
+            client.urlopen = mock_urlopen
+            raise HTTPError(req.get_full_url(), code, 'Error', {},
+                            StringIO('{}'))
+        client.urlopen = urlopen
+
+    def test_adopt_retried(self):
+        cache = imagecache.ImageCache(self.clients)
+        cache.lookup(self.volume, 'vtype', self.image)
+        cache = imagecache.ImageCache(self.clients)
+        # lunr can't list the volumes right after the restart
+        self.fail_next('GET', 500)
+        cache.lookup(self.volume, 'vtype', {'id': 'img2', 'checksum': 'x'})
+        self.assertEquals(cache.stats()['count'], 1)
+        # the next lookup has another go
+        self.assert_(cache.lookup(self.volume, 'vtype', self.image))
+        self.assertEquals(cache.stats()['count'], 2)
+
+    def test_failed_delete_retried(self):
+        cache = imagecache.ImageCache(self.clients, max_count=1)
+        cache.lookup(self.volume, 'vtype', self.image)
+        golden_id = self.volumes.keys()[0]
+        # still being cloned from, so lunr won't delete it
+        self.fail_next('DELETE', 409)
+        cache.lookup(self.volume, 'vtype', {'id': 'img2', 'checksum': 'x'})
+        self.assert_(golden_id in self.volumes)
+        self.assertEquals(cache.stats()['undeleted'], 1)
+        cache.sweep()
+        self.assert_(golden_id not in self.volumes)
+        self.assertEquals(cache.stats()['undeleted'], 0)
+
+    def test_discard(self):
+        cache = imagecache.ImageCache(self.clients)
+        cache.lookup(self.volume, 'vtype', self.image)
+        golden_id = self.volumes.keys()[0]
+        del self.volumes[golden_id]
+        cache.discard(golden_id)
+        self.assertEquals(cache.stats()['count'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+import eventlet
+
+from lunrdriver.driver import reconciler
+from lunrdriver.lunr import client
+from lunrdriver.lunr.client import ClientRegistry
+from lunrdriver.lunr.schedule import PollSchedule
+
+from testlunrdriver.unit import MockResponse
+
+
+class MockDB(object):
+
+    def __init__(self, **statuses):
+        self.statuses = statuses
+        self.updates = []
+
+    def volume_get(self, context, volume_id):
+        return {'id': volume_id, 'status': self.statuses[volume_id]}
+
+    def volume_update(self, context, volume_id, values):
+        self.updates.append((volume_id, values['status']))
+        self.statuses[volume_id] = values['status']
+
+
+class TestReconciler(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_urlopen = client.urlopen
+        self._orig_sleep = reconciler.sleep
+        reconciler.sleep = lambda *args: eventlet.sleep(0)
+        self.clients = ClientRegistry(
+            'http://127.0.0.1:8080/v1.0',
+            poll_schedule=PollSchedule(initial=0.01, max_backoff=0.01))
+        self.volume = {'id': 'vol1', 'project_id': 'fake', 'size': 1}
+
+    def tearDown(self):
+        client.urlopen = self._orig_urlopen
+        reconciler.sleep = self._orig_sleep
+
+    def mock_lunr(self, *statuses):
+        statuses = list(statuses)
+
+        def mock_urlopen(req, **kwargs):
+            status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+            return MockResponse(json.dumps({'id': 'vol1', 'status': status}))
+        client.urlopen = mock_urlopen
+
+    def test_finishes_volume(self):
+        self.mock_lunr('BUILDING', 'BUILDING', 'ACTIVE')
+        db = MockDB(vol1='available')
+        r = reconciler.Reconciler(db, self.clients)
+        r.reconcile(reconciler.Job(self.volume, 'vol1', ('ACTIVE',)))
+        self.assertEquals(db.updates, [('vol1', 'creating'),
+                                       ('vol1', 'available')])
+        self.assertEquals(r.stats()['completed'], 1)
+
+    def test_waits_for_cinder(self):
+        self.mock_lunr('ACTIVE')
+        db = MockDB(vol1='creating')
+        gets = []
+        _orig_get = db.volume_get
+
+        def volume_get(context, volume_id):
+            gets.append(volume_id)
+            if len(gets) == 3:
+                # the create flow is done
+                db.statuses[volume_id] = 'available'
+            return _orig_get(context, volume_id)
+        db.volume_get = volume_get
+        r = reconciler.Reconciler(db, self.clients)
+        r.reconcile(reconciler.Job(self.volume, 'vol1', ('ACTIVE',)))
+        self.assertEquals(len(gets), 3)
+        # it was done by then, nobody saw it creating
+        self.assertEquals(db.updates, [])
+
+    def test_lunr_error(self):
+        self.mock_lunr('BUILDING', 'ERROR')
+        db = MockDB(vol1='available')
+        r = reconciler.Reconciler(db, self.clients)
+        r.reconcile(reconciler.Job(self.volume, 'vol1', ('ACTIVE',)))
+        self.assertEquals(db.updates, [('vol1', 'creating'),
+                                       ('vol1', 'error')])
+        self.assertEquals(r.stats()['failed'], 1)
+
+    def test_attached_while_waiting(self):
+        db = MockDB(vol1='available')
+        statuses = ['BUILDING', 'BUILDING', 'ACTIVE']
+
+        def mock_urlopen(req, **kwargs):
+            status = statuses.pop(0)
+            if status == 'ACTIVE':
+                # somebody attached it meanwhile
+                db.statuses['vol1'] = 'attaching'
+            return MockResponse(json.dumps({'id': 'vol1', 'status': status}))
+        client.urlopen = mock_urlopen
+        r = reconciler.Reconciler(db, self.clients)
+        r.reconcile(reconciler.Job(self.volume, 'vol1', ('ACTIVE',)))
+        self.assertEquals(db.updates, [('vol1', 'creating')])
+        self.assertEquals(db.statuses['vol1'], 'attaching')
+
+    def test_deleted_before_creating(self):
+        db = MockDB(vol1='available')
+        _orig_get = db.volume_get
+        gets = []
+
+        def volume_get(context, volume_id):
+            gets.append(volume_id)
+            if len(gets) == 2:
+                # deleted between the flow finishing and lunr's answer
+                db.statuses[volume_id] = 'deleting'
+            return _orig_get(context, volume_id)
+        db.volume_get = volume_get
+        self.mock_lunr('BUILDING', 'ACTIVE')
+        r = reconciler.Reconciler(db, self.clients)
+        r.reconcile(reconciler.Job(self.volume, 'vol1', ('ACTIVE',)))
+        self.assertEquals(db.updates, [])
+        self.assertEquals(db.statuses['vol1'], 'deleting')
+
+    def test_deleted_meanwhile(self):
+        db = MockDB(vol1='deleting')
+        r = reconciler.Reconciler(db, self.clients)
+        r.reconcile(reconciler.Job(self.volume, 'vol1', ('ACTIVE',)))
+        self.assertEquals(db.updates, [])
+
+    def test_pending(self):
+        self.mock_lunr('ACTIVE')
+        db = MockDB(vol1='available')
+        r = reconciler.Reconciler(db, self.clients)
+        r.track(self.volume, 'vol1')
+        # the worker hasn't had a chance to run yet
+        self.assertEquals(r.pending('vol1').statuses, ('ACTIVE',))
+        self.assertEquals(r.stats()['pending'], 1)
+        while r.pending('vol1'):
+            eventlet.sleep(0.01)
+        # lunr had it done, cinder's status was right all along
+        self.assertEquals(db.updates, [])
+        self.assertEquals(r.stats()['completed'], 1)
+
+    def test_bounded_concurrency(self):
+        r = reconciler.Reconciler(MockDB(), self.clients, concurrency=2)
+        running = []
+        done = []
+
+        def reconcile(job):
+            running.append(r.running)
+            eventlet.sleep(0.01)
+            done.append(job.volume_id)
+        r.reconcile = reconcile
+        for i in range(5):
+            r.track({'id': 'vol%s' % i, 'project_id': 'fake'}, 'vol%s' % i)
+        self.assertEquals(r.workers, 2)
+        while len(done) < 5:
+            eventlet.sleep(0.01)
+        self.assertEquals(max(running), 2)
+        self.assertEquals(sorted(done), ['vol%s' % i for i in range(5)])
+        self.assertEquals(r.stats()['queued'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
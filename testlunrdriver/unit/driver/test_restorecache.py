@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import unittest
+
+from lunrdriver.driver import restorecache, volumecache
+
+from testlunrdriver.unit.driver import MockLunrTestCase
+
+
+class TestRestoreCache(MockLunrTestCase):
+
+    def setUp(self):
+        super(TestRestoreCache, self).setUp()
+        self._orig_time = restorecache.time
+        self._orig_volumecache_time = volumecache.time
+        self.now = 1000.0
+        restorecache.time = volumecache.time = lambda: self.now
+        self.snapshot = {'id': 'snap1', 'volume_size': 2}
+
+    def tearDown(self):
+        super(TestRestoreCache, self).tearDown()
+        restorecache.time = self._orig_time
+        volumecache.time = self._orig_volumecache_time
+
+    def restore(self, cache, snapshot=None, **kwargs):
+        volume = dict(self.volume, **kwargs)
+        return cache.lookup(volume, 'vtype', snapshot or self.snapshot)
+
+    def test_gets_hot(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=3)
+        self.assertEquals(self.restore(cache), None)
+        self.assertEquals(self.restore(cache), None)
+        self.assertEquals(self.volumes, {})
+        self.assertEquals(self.restore(cache), None)
+        # third time it restored one
+        self.assertEquals(len(self.volumes), 1)
+        restored = self.volumes.values()[0]
+        self.assertEquals(restored['backup'], 'snap1')
+        self.assertEquals(restored['name'], 'restore-cache-snap1')
+        self.assertEquals(restored['size'], 2)
+        self.assertEquals(self.restore(cache), restored['id'])
+        stats = cache.stats()
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 3)
+
+    def test_not_hot_outside_window(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=2,
+                                          window=60)
+        self.restore(cache)
+        self.now += 61
+        self.restore(cache)
+        self.assertEquals(self.volumes, {})
+        self.assertEquals(cache.stats()['tracked'], 1)
+
+    def test_ttl(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=2, ttl=60)
+        self.restore(cache)
+        self.restore(cache)
+        self.now += 30
+        self.assert_(self.restore(cache))
+        self.now += 61
+        self.assertEquals(self.restore(cache), None)
+        self.assertEquals(cache.stats()['expirations'], 1)
+        # and it has to get hot again
+        self.assertEquals(self.volumes, {})
+
+    def test_expires_without_lookups(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=2, ttl=60)
+        self.restore(cache)
+        self.restore(cache)
+        self.assertEquals(len(self.volumes), 1)
+        cache.expire()
+        self.assertEquals(len(self.volumes), 1)
+        self.now += 61
+        # nobody restores it again, the sweep gets it
+        cache.expire()
+        self.assertEquals(self.volumes, {})
+        self.assertEquals(cache.stats()['expirations'], 1)
+
+    def test_frequency_eviction(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=1,
+                                          max_count=2)
+        snapshots = [{'id': 'snap%s' % i} for i in range(3)]
+        self.restore(cache, snapshots[0])
+        self.restore(cache, snapshots[1])
+        self.now += 10
+        # snap0 is used more often, even though snap1 was used last
+        for i in range(3):
+            self.restore(cache, snapshots[0])
+        self.restore(cache, snapshots[1])
+        self.restore(cache, snapshots[2])
+        cached = sorted(v['backup'] for v in self.volumes.values())
+        self.assertEquals(cached, ['snap0', 'snap2'])
+        self.assertEquals(cache.stats()['evictions'], 1)
+
+    def test_discard_snapshot(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=1)
+        self.restore(cache)
+        cache.discard_snapshot('snap1')
+        self.assertEquals(self.volumes, {})
+        self.assertEquals(cache.stats()['count'], 0)
+
+    def test_adopts_after_restart(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=1)
+        self.restore(cache)
+        restored_id = self.volumes.keys()[0]
+        cache = restorecache.RestoreCache(self.clients, threshold=1)
+        self.assertEquals(self.restore(cache), restored_id)
+
+    def test_adopted_expire_without_lookups(self):
+        cache = restorecache.RestoreCache(self.clients, threshold=1, ttl=60)
+        self.restore(cache)
+        cache = restorecache.RestoreCache(self.clients, threshold=1, ttl=60)
+        cache.sweep()
+        self.assertEquals(cache.stats()['count'], 1)
+        self.now += 61
+        cache.sweep()
+        self.assertEquals(self.volumes, {})
+        self.assertEquals(cache.stats()['expirations'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
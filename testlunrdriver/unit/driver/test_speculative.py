@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError
+from urlparse import urlparse
+
+from lunrdriver.driver import speculative
+from lunrdriver.lunr.client import ClientRegistry
+
+from testlunrdriver.unit.driver import ClientTestCase, patch, run_now, \
+    urldecode
+
+
+EXPORT = json.dumps({
+    'id': 'vol1',
+    'target_portal': '10.0.0.1:3260',
+    'target_name': 'iqn-vol1',
+})
+
+
+class TestSpeculativeExports(ClientTestCase):
+
+    def setUp(self):
+        super(TestSpeculativeExports, self).setUp()
+        self._orig_spawn_n = speculative.spawn_n
+        self._orig_time = speculative.time
+        speculative.spawn_n = run_now
+        self.now = 1000.0
+        speculative.time = lambda: self.now
+        self.clients = ClientRegistry('http://127.0.0.1:8080/v1.0')
+        self.client = self.clients.get({'project_id': 'dev'})
+        self.volume = {'id': 'vol1', 'project_id': 'dev'}
+        self.requests = []
+
+        self.request_callback = self.callback
+
+    def callback(self, req):
+        url = urlparse(req.get_full_url())
+        self.requests.append((req.get_method(), url.path,
+                              urldecode(url.query)))
+
+    def tearDown(self):
+        super(TestSpeculativeExports, self).tearDown()
+        speculative.spawn_n = self._orig_spawn_n
+        speculative.time = self._orig_time
+
+    def not_found(self):
+        return HTTPError('/v1.0/dev/volumes/vol1/export', 404, 'Not Found',
+                         {}, StringIO('{}'))
+
+    def prepared(self, **kwargs):
+        exports = speculative.SpeculativeExports(self.clients, **kwargs)
+        self.resp = [json.dumps({'id': 'vol1', 'status': 'ACTIVE'}),
+                     self.not_found(), EXPORT]
+        exports.prepare(self.volume, 'vol1')
+        self.assertEquals(self.requests, [
+            ('GET', '/v1.0/dev/volumes/vol1', {}),
+            ('GET', '/v1.0/dev/volumes/vol1/export', {}),
+            # never open to every initiator
+            ('PUT', '/v1.0/dev/volumes/vol1/export', {'ip': '127.0.0.1'}),
+        ])
+        del self.requests[:]
+        return exports
+
+    def pending(self, exports):
+        # prepare, but with the wait on the volume left for later
+        calls = []
+        with patch(speculative, 'spawn_n',
+                   lambda *args: calls.append(args)):
+            exports.prepare(self.volume, 'vol1')
+        func, args = calls[0][0], calls[0][1:]
+        return lambda: func(*args)
+
+    def test_claim(self):
+        exports = self.prepared()
+        self.assertEquals(exports.stats()['ready'], 1)
+        self.resp = EXPORT
+        info = exports.claim(self.client, 'vol1', {'ip': '10.0.0.2'})
+        self.assertEquals(info['data']['target_iqn'], 'iqn-vol1')
+        self.assertEquals(info['data']['target_portal'], '10.0.0.1:3260')
+        # all that's left is binding the connector
+        self.assertEquals(self.requests, [
+            ('POST', '/v1.0/dev/volumes/vol1/export', {'ip': '10.0.0.2'}),
+        ])
+        stats = exports.stats()
+        self.assertEquals(stats['ready'], 0)
+        self.assertEquals(stats['claimed'], 1)
+
+    def test_nothing_to_claim(self):
+        exports = speculative.SpeculativeExports(self.clients)
+        self.assertEquals(exports.claim(self.client, 'vol1', {'ip': 'x'}),
+                          None)
+        self.assertEquals(self.requests, [])
+
+    def test_bind_fails(self):
+        exports = self.prepared()
+        self.resp = self.not_found()
+        self.assertEquals(exports.claim(self.client, 'vol1', {'ip': 'x'}),
+                          None)
+        self.assertEquals(exports.stats()['ready'], 0)
+
+    def test_export_fails(self):
+        exports = speculative.SpeculativeExports(self.clients)
+        self.resp = [json.dumps({'id': 'vol1', 'status': 'ERROR'})]
+        exports.prepare(self.volume, 'vol1')
+        stats = exports.stats()
+        self.assertEquals(stats['failures'], 1)
+        self.assertEquals(stats['pending'], 0)
+
+    def test_reclaim(self):
+        exports = self.prepared(timeout=60)
+        exports.reclaim()
+        self.assertEquals(self.requests, [])
+        self.now += 61
+        self.resp = '{}'
+        exports.reclaim()
+        self.assertEquals([r[:2] for r in self.requests], [
+            ('DELETE', '/v1.0/dev/volumes/vol1/export'),
+        ])
+        self.assertEquals(exports.stats()['reclaimed'], 1)
+
+    def test_discard(self):
+        exports = self.prepared()
+        self.resp = '{}'
+        exports.discard('vol1')
+        self.assertEquals([r[:2] for r in self.requests], [
+            ('DELETE', '/v1.0/dev/volumes/vol1/export'),
+        ])
+        exports.discard('vol1')
+        self.assertEquals(len(self.requests), 1)
+
+    def test_discard_without_delete(self):
+        exports = self.prepared()
+        exports.discard('vol1', delete=False)
+        self.assertEquals(self.requests, [])
+        self.assertEquals(exports.claim(self.client, 'vol1', {'ip': 'x'}),
+                          None)
+
+    def test_claimed_while_waiting(self):
+        exports = speculative.SpeculativeExports(self.clients)
+        export = self.pending(exports)
+        self.assertEquals(exports.stats()['pending'], 1)
+        # initialize_connection gets there first and makes the export
+        self.assertEquals(exports.claim(self.client, 'vol1',
+                                        {'ip': '10.0.0.2'}), None)
+        self.resp = [json.dumps({'id': 'vol1', 'status': 'ACTIVE'})]
+        export()
+        # no export made, and nothing left to reclaim
+        self.assertEquals([r[:2] for r in self.requests], [
+            ('GET', '/v1.0/dev/volumes/vol1'),
+        ])
+        stats = exports.stats()
+        self.assertEquals(stats['pending'], 0)
+        self.assertEquals(stats['ready'], 0)
+        self.assertEquals(stats['cancelled'], 1)
+
+    def test_claimed_while_exporting(self):
+        exports = speculative.SpeculativeExports(self.clients)
+        export = self.pending(exports)
+
+        def claim(req):
+            self.callback(req)
+            if req.get_method() == 'PUT':
+                exports.claim(self.client, 'vol1', {'ip': '10.0.0.2'})
+        self.request_callback = claim
+        self.resp = [json.dumps({'id': 'vol1', 'status': 'ACTIVE'}),
+                     self.not_found(), EXPORT, EXPORT]
+        export()
+        # the export is initialize_connection's now, bound to it's ip
+        self.assertEquals(self.requests[-1], (
+            'POST', '/v1.0/dev/volumes/vol1/export', {'ip': '10.0.0.2'}))
+        self.assertEquals(exports.stats()['ready'], 0)
+
+    def test_discarded_while_exporting(self):
+        exports = speculative.SpeculativeExports(self.clients)
+        export = self.pending(exports)
+
+        def discard(req):
+            self.callback(req)
+            if req.get_method() == 'PUT':
+                exports.discard('vol1')
+        self.request_callback = discard
+        self.resp = [json.dumps({'id': 'vol1', 'status': 'ACTIVE'}),
+                     self.not_found(), EXPORT, '{}']
+        export()
+        self.assertEquals(self.requests[-1][:2],
+                          ('DELETE', '/v1.0/dev/volumes/vol1/export'))
+
+    def test_already_exported(self):
+        exports = speculative.SpeculativeExports(self.clients)
+        self.resp = [json.dumps({'id': 'vol1', 'status': 'ACTIVE'}), EXPORT]
+        exports.prepare(self.volume, 'vol1')
+        # somebody else's export is left alone
+        self.assertEquals([r[:2] for r in self.requests], [
+            ('GET', '/v1.0/dev/volumes/vol1'),
+            ('GET', '/v1.0/dev/volumes/vol1/export'),
+        ])
+        self.assertEquals(exports.stats()['ready'], 0)
+        exports.reclaim()
+        exports.discard('vol1')
+        self.assertEquals(len(self.requests), 2)
+
+    def test_remove_leftover(self):
+        # made before a restart, lunr still has it restricted
+        exports = speculative.SpeculativeExports(self.clients)
+        self.resp = [json.dumps({'id': 'vol1', 'ip': '127.0.0.1'}), '{}']
+        exports.remove_leftover(self.client, 'vol1')
+        self.assertEquals([r[:2] for r in self.requests], [
+            ('GET', '/v1.0/dev/volumes/vol1/export'),
+            ('DELETE', '/v1.0/dev/volumes/vol1/export'),
+        ])
+        self.assertEquals(exports.stats()['reclaimed'], 1)
+
+    def test_remove_leftover_in_use(self):
+        exports = speculative.SpeculativeExports(self.clients)
+        self.resp = [json.dumps({'id': 'vol1', 'ip': '10.0.0.2'})]
+        exports.remove_leftover(self.client, 'vol1')
+        # somebody's export is left alone
+        self.assertEquals([r[:2] for r in self.requests], [
+            ('GET', '/v1.0/dev/volumes/vol1/export'),
+        ])
+        self.resp = self.not_found()
+        exports.remove_leftover(self.client, 'vol1')
+        self.assertEquals(len(self.requests), 2)
+        self.assertEquals(exports.stats()['reclaimed'], 0)
+
+    def test_reclaim_skips_pending(self):
+        exports = speculative.SpeculativeExports(self.clients, timeout=60)
+        self.pending(exports)
+        self.now += 61
+        exports.reclaim()
+        self.assertEquals(self.requests, [])
+        self.assertEquals(exports.stats()['pending'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
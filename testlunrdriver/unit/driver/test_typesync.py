@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import json
+import unittest
+
+from cinder import exception
+
+from lunrdriver.driver import typesync
+from lunrdriver.lunr.client import ClientRegistry
+
+from testlunrdriver.unit.driver import ClientTestCase, run_now
+
+
+class MockVolumeTypes(object):
+
+    def __init__(self, *names):
+        self.store = dict((name, {'id': i, 'name': name})
+                          for i, name in enumerate(names))
+        self.in_use = set()
+        self.lists = 0
+        self.creates = []
+        self.destroys = []
+
+    def get_all_types(self, context):
+        self.lists += 1
+        return dict(self.store)
+
+    def create(self, context, name, extra_specs={}):
+        self.creates.append(name)
+        if name in self.store:
+            raise exception.VolumeTypeExists(id=name)
+        self.store[name] = {'id': len(self.store), 'name': name}
+
+    def destroy(self, context, id):
+        for name, vtype in self.store.items():
+            if vtype['id'] == id:
+                if name in self.in_use:
+                    raise exception.VolumeTypeInUse(volume_type_id=id)
+                self.destroys.append(name)
+                del self.store[name]
+
+
+def lunr_types(**statuses):
+    return json.dumps([{'name': name, 'status': status}
+                       for name, status in sorted(statuses.items())])
+
+
+class TestTypeSync(ClientTestCase):
+
+    def setUp(self):
+        super(TestTypeSync, self).setUp()
+        self._orig_volume_types = typesync.volume_types
+        self._orig_spawn_n = typesync.spawn_n
+        self._orig_sleep = typesync.sleep
+        self.volume_types = MockVolumeTypes('vtype1', 'other')
+        typesync.volume_types = self.volume_types
+        typesync.spawn_n = run_now
+        self.sleeps = []
+        typesync.sleep = self.sleeps.append
+        self.clients = ClientRegistry('http://127.0.0.1:8080/v1.0')
+
+    def tearDown(self):
+        super(TestTypeSync, self).tearDown()
+        typesync.volume_types = self._orig_volume_types
+        typesync.spawn_n = self._orig_spawn_n
+        typesync.sleep = self._orig_sleep
+
+    def test_creates_missing(self):
+        self.resp = lunr_types(vtype1='ACTIVE', vtype2='ACTIVE',
+                               vtype3='ACTIVE')
+        sync = typesync.TypeSync(self.clients)
+        created, removed = sync.sync()
+        self.assertEquals(created, ['vtype2', 'vtype3'])
+        self.assertEquals(removed, [])
+        # one list of cinder types, and vtype1 wasn't tried again
+        self.assertEquals(self.volume_types.lists, 1)
+        self.assertEquals(self.volume_types.creates, ['vtype2', 'vtype3'])
+
+    def test_reports_removed(self):
+        self.resp = lunr_types(vtype1='DELETED', vtype2='ACTIVE')
+        sync = typesync.TypeSync(self.clients)
+        created, removed = sync.sync()
+        self.assertEquals(removed, [])
+        self.assert_('vtype1' in self.volume_types.store)
+        self.assertEquals(sync.stats()['stale'], ['vtype1'])
+
+    def test_removes_removed(self):
+        self.resp = lunr_types(vtype1='DELETED', vtype2='DELETED')
+        sync = typesync.TypeSync(self.clients, remove=True)
+        created, removed = sync.sync()
+        self.assertEquals(removed, ['vtype1'])
+        # types of other backends are left alone
+        self.assertEquals(sorted(self.volume_types.store), ['other'])
+        self.assertEquals(sync.stats()['stale'], [])
+
+    def test_removed_in_use(self):
+        self.volume_types.in_use.add('vtype1')
+        self.resp = lunr_types(vtype1='DELETED')
+        sync = typesync.TypeSync(self.clients, remove=True)
+        created, removed = sync.sync()
+        self.assertEquals(removed, [])
+        self.assertEquals(sync.stats()['stale'], ['vtype1'])
+
+    def test_retries_list(self):
+        sync = typesync.TypeSync(self.clients, attempts=2)
+        err = IOError('connection refused')
+        self.resp = [err, lunr_types(vtype2='ACTIVE')]
+        self.assertEquals(sync.sync(), (['vtype2'], []))
+        self.assertEquals(self.sleeps, [1])
+
+    def test_syncs_on_interval(self):
+        sync = typesync.TypeSync(self.clients, interval=60)
+
+        def sleep(seconds):
+            self.sleeps.append(seconds)
+            if len(self.sleeps) == 2:
+                raise StopIteration()
+        typesync.sleep = sleep
+        err = IOError('connection refused')
+        self.resp = [err, lunr_types(vtype2='ACTIVE')]
+        sync.attempts = 1
+        self.assertRaises(StopIteration, sync.start)
+        self.assertEquals(self.sleeps, [60, 60])
+        stats = sync.stats()
+        self.assertEquals(stats['failures'], 1)
+        self.assertEquals(stats['syncs'], 1)
+        self.assertEquals(stats['created'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError
+
+from lunrdriver.driver import warmpool
+from lunrdriver.lunr import client
+
+from testlunrdriver.unit.driver import MockLunrTestCase, run_now
+
+
+class TestWarmPool(MockLunrTestCase):
+
+    def setUp(self):
+        super(TestWarmPool, self).setUp()
+        self._orig_spawn_n = warmpool.spawn_n
+        self._orig_time = warmpool.time
+        warmpool.spawn_n = run_now
+        self.now = 10000.0
+        warmpool.time = lambda: self.now
+
+    def tearDown(self):
+        super(TestWarmPool, self).tearDown()
+        warmpool.spawn_n = self._orig_spawn_n
+        warmpool.time = self._orig_time
+
+    def pool(self, **kwargs):
+        return warmpool.WarmPool(self.clients, 'pool', [('vtype', 5)],
+                                 **kwargs)
+
+    def test_parse_pools(self):
+        self.assertEquals(warmpool.parse_pools(['vtype:5', 'ssd:10']),
+                          [('vtype', 5), ('ssd', 10)])
+        self.assertRaises(ValueError, warmpool.parse_pools, ['vtype'])
+        self.assertRaises(ValueError, warmpool.parse_pools, ['vtype:big'])
+
+    def test_refill(self):
+        wp = self.pool(min_size=2)
+        pool = wp.pools[('vtype', 5)]
+        wp.refill(pool)
+        self.assertEquals(len(pool.ready), 2)
+        for lunr_id in pool.ready:
+            volume = self.volumes[lunr_id]
+            self.assertEquals(volume['project_id'], 'pool')
+            self.assertEquals(volume['name'], warmpool.POOL_NAME)
+            self.assertEquals(volume['size'], 5)
+            self.assertEquals(volume['volume_type_name'], 'vtype')
+        self.assertEquals(pool.stats()['refill_lag'], 0)
+
+    def test_claim(self):
+        wp = self.pool()
+        pool = wp.pools[('vtype', 5)]
+        wp.refill(pool)
+        lunr_id = pool.ready[0]
+        claimed_id, resp = wp.claim(self.volume, 'vtype')
+        self.assertEquals(claimed_id, lunr_id)
+        self.assertEquals(self.volumes[lunr_id]['project_id'], 'fake')
+        self.assertEquals(self.volumes[lunr_id]['name'], 'vol1')
+        self.assertEquals(resp.body['id'], lunr_id)
+        # and it got topped back up
+        self.assertEquals(len(pool.ready), 1)
+        self.assertNotEquals(pool.ready[0], lunr_id)
+        self.assertEquals(pool.hits, 1)
+
+    def test_miss(self):
+        wp = self.pool()
+        self.assertEquals(wp.claim(dict(self.volume, size=6), 'vtype'), None)
+        self.assertEquals(wp.claim(self.volume, 'ssd'), None)
+        # nobody would have wanted those
+        self.assertEquals(self.volumes, {})
+        pool = wp.pools[('vtype', 5)]
+        warmpool.spawn_n = lambda *args: None
+        self.assertEquals(wp.claim(self.volume, 'vtype'), None)
+        self.assertEquals(pool.misses, 1)
+
+    def test_claim_skips_gone(self):
+        wp = self.pool(min_size=2)
+        pool = wp.pools[('vtype', 5)]
+        wp.refill(pool)
+        gone, lunr_id = list(pool.ready)
+        del self.volumes[gone]
+        self.assertEquals(wp.claim(self.volume, 'vtype')[0], lunr_id)
+
+    def fail_update(self, applied):
+        """
+        Make the next update of a volume fail, after going through if
+        applied.
+        """
+        mock_urlopen = self.mock_urlopen
+
+        def urlopen(req, *args, **kwargs):
+            if req.get_method() != 'POST':
+                return mock_urlopen(req, *args, **kwargs)
+            client.urlopen = mock_urlopen
+            if applied:
+                mock_urlopen(req, *args, **kwargs)
+            raise HTTPError(req.get_full_url(), 500, 'Server Error', {},
+                            StringIO('{}'))
+        client.urlopen = urlopen
+
+    def test_claim_went_through_anyway(self):
+        wp = self.pool()
+        pool = wp.pools[('vtype', 5)]
+        wp.refill(pool)
+        lunr_id = pool.ready[0]
+        self.fail_update(applied=True)
+        claimed_id, resp = wp.claim(self.volume, 'vtype')
+        self.assertEquals(claimed_id, lunr_id)
+        self.assertEquals(resp.body['name'], 'vol1')
+        self.assertEquals(self.volumes[lunr_id]['project_id'], 'fake')
+        self.assertEquals(pool.hits, 1)
+
+    def test_failed_claim_goes_back(self):
+        wp = self.pool()
+        pool = wp.pools[('vtype', 5)]
+        wp.refill(pool)
+        lunr_id = pool.ready[0]
+        self.fail_update(applied=False)
+        self.assertEquals(wp.claim(self.volume, 'vtype'), None)
+        # not leaked, the next claim gets it
+        self.assertEquals(list(pool.ready), [lunr_id])
+        self.assertEquals(wp.claim(self.volume, 'vtype')[0], lunr_id)
+
+    def test_target_follows_create_rate(self):
+        wp = self.pool(min_size=1, max_size=10, lead_time=60, window=600)
+        pool = wp.pools[('vtype', 5)]
+        self.assertEquals(wp.target(pool), 1)
+        # 30 creates in 10 minutes is 3 a minute
+        pool.requests.extend([self.now - i * 20 for i in range(30)])
+        self.assertEquals(wp.target(pool), 3)
+        pool.requests.extend([self.now] * 1000)
+        self.assertEquals(wp.target(pool), 10)
+        # and it slows down again
+        self.now += 601
+        self.assertEquals(wp.target(pool), 1)
+
+    def test_shrinks(self):
+        wp = self.pool(min_size=3)
+        pool = wp.pools[('vtype', 5)]
+        wp.refill(pool)
+        wp.min_size = 1
+        wp.refill(pool)
+        self.assertEquals(len(pool.ready), 1)
+        self.assertEquals(self.volumes.keys(), list(pool.ready))
+
+    def test_refill_lag(self):
+        wp = self.pool(min_size=2)
+        pool = wp.pools[('vtype', 5)]
+        warmpool.spawn_n = lambda *args: None
+        wp.refill(pool)
+        self.now += 30
+        self.assertEquals(pool.stats()['refill_lag'], 30)
+
+    def test_adopts_after_restart(self):
+        wp = self.pool()
+        pool = wp.pools[('vtype', 5)]
+        wp.refill(pool)
+        lunr_id = pool.ready[0]
+        wp = self.pool()
+        wp._adopt()
+        self.assertEquals(list(wp.pools[('vtype', 5)].ready), [lunr_id])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import socket
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError, URLError
+
+from lunrdriver.lunr import balancer
+from lunrdriver.lunr import client
+from lunrdriver.lunr.breaker import CircuitBreaker, CLOSED, OPEN
+from lunrdriver.lunr.retry import RetryPolicy
+
+from testlunrdriver.unit import MockResponse
+
+
+URLS = ['http://lunr1:8080/v1.0', 'http://lunr2:8080/v1.0/']
+
+
+class TestLoadBalancer(unittest.TestCase):
+
+    def test_least_outstanding(self):
+        lb = balancer.LoadBalancer(URLS)
+        first = lb.choose()
+        lb.start(first)
+        second = lb.choose()
+        self.assertNotEqual(first, second)
+        lb.start(second)
+        lb.finish(first, 0.1, True)
+        self.assertEquals(lb.choose(), first)
+        self.assertEquals(lb.urls(), ['http://lunr1:8080/v1.0',
+                                      'http://lunr2:8080/v1.0'])
+
+    def test_idle_endpoints_take_turns(self):
+        lb = balancer.LoadBalancer(URLS)
+        seen = []
+        for i in range(4):
+            endpoint = lb.choose()
+            lb.start(endpoint)
+            lb.finish(endpoint, 0.1, True)
+            seen.append(endpoint.url)
+        self.assertEquals(seen.count(seen[0]), 2)
+        self.assertEquals(len(set(seen)), 2)
+
+    def test_ewma(self):
+        lb = balancer.LoadBalancer(URLS, strategy='ewma')
+        fast, slow = lb.endpoints
+        for i in range(3):
+            lb.start(slow)
+            lb.finish(slow, 1.0, True)
+            lb.start(fast)
+            lb.finish(fast, 0.1, True)
+        self.assertEquals(lb.choose(), fast)
+        # enough load on the fast one tips the scale
+        for i in range(10):
+            lb.start(fast)
+        self.assertEquals(lb.choose(), slow)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, balancer.LoadBalancer, URLS,
+                          strategy='random')
+
+    def test_unhealthy_out_of_rotation(self):
+        lb = balancer.LoadBalancer(
+            URLS, breaker_factory=lambda: CircuitBreaker(min_requests=1))
+        bad, good = lb.endpoints
+        lb.start(bad)
+        lb.finish(bad, 0.1, False)
+        self.assertEquals(bad.breaker.state, OPEN)
+        for i in range(3):
+            self.assertEquals(lb.choose(), good)
+
+    def test_all_open(self):
+        lb = balancer.LoadBalancer(
+            URLS, breaker_factory=lambda: CircuitBreaker(min_requests=1))
+        for endpoint in lb.endpoints:
+            endpoint.breaker.record(False)
+        self.assertEquals(lb.choose(), None)
+
+    def test_probe(self):
+        lb = balancer.LoadBalancer(
+            URLS, breaker_factory=lambda: CircuitBreaker(
+                min_requests=1, reset_timeout=0, trial_requests=1))
+        bad, good = lb.endpoints
+        bad.breaker.record(False)
+        probed = []
+
+        def mock_urlopen(req, **kwargs):
+            probed.append(req.get_full_url())
+            raise HTTPError(req.get_full_url(), 404, 'Not Found', {},
+                            StringIO(''))
+        _orig_urlopen = balancer.urlopen
+        try:
+            balancer.urlopen = mock_urlopen
+            lb.probe()
+        finally:
+            balancer.urlopen = _orig_urlopen
+        self.assertEquals(probed, [bad.url])
+        self.assertEquals(bad.breaker.state, CLOSED)
+
+
+class TestClientFailover(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_urlopen = client.urlopen
+        self._orig_sleep = client.sleep
+        client.sleep = lambda *args: None
+
+    def tearDown(self):
+        client.urlopen = self._orig_urlopen
+        client.sleep = self._orig_sleep
+
+    def test_retry_fails_over(self):
+        lb = balancer.LoadBalancer(URLS)
+        c = client.LunrClient(lb, {'project_id': 'fake'},
+                              retry_policy=RetryPolicy(attempts=2))
+        urls = []
+
+        def mock_urlopen(req, **kwargs):
+            urls.append(req.get_full_url())
+            if len(urls) == 1:
+                raise URLError(socket.error(111, 'Connection refused'))
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        resp = c.volumes.get('vol1')
+        self.assertEquals(resp.body, {'id': 'vol1'})
+        self.assertEquals(len(urls), 2)
+        self.assertNotEqual(urls[0].split('/')[2], urls[1].split('/')[2])
+        self.assertEquals(urls[1].split('/', 3)[3],
+                          'v1.0/fake/volumes/vol1?')
+        self.assertEquals(sum(e.outstanding for e in lb.endpoints), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
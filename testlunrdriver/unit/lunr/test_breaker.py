@@ -0,0 +1,115 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import socket
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError, URLError
+
+from lunrdriver.lunr import breaker
+from lunrdriver.lunr import client
+from lunrdriver.lunr.balancer import LoadBalancer
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_is_failure(self):
+        b = breaker.CircuitBreaker()
+        self.assert_(b.is_failure(URLError(socket.error(111, 'refused'))))
+        self.assert_(b.is_failure(HTTPError('/', 503, 'Unavailable', {},
+                                            StringIO(''))))
+        self.assertFalse(b.is_failure(HTTPError('/', 404, 'Not Found', {},
+                                                StringIO(''))))
+
+    def test_opens_on_error_rate(self):
+        b = breaker.CircuitBreaker(min_requests=4, error_rate=0.5)
+        b.record(True)
+        b.record(False)
+        b.record(False)
+        self.assertEquals(b.state, breaker.CLOSED)
+        b.record(False)
+        self.assertEquals(b.state, breaker.OPEN)
+        self.assertFalse(b.allow())
+        stats = b.stats()
+        self.assertEquals(stats['opened'], 1)
+        self.assertEquals(stats['rejected'], 1)
+
+    def test_half_open_recovers(self):
+        b = breaker.CircuitBreaker(min_requests=1, reset_timeout=30,
+                                   trial_requests=2)
+        b.record(False)
+        self.assertEquals(b.state, breaker.OPEN)
+        b.opened_at -= 30
+        self.assert_(b.allow())
+        self.assertEquals(b.state, breaker.HALF_OPEN)
+        self.assert_(b.allow())
+        # only trial_requests are let through
+        self.assertFalse(b.allow())
+        b.record(True)
+        self.assertEquals(b.state, breaker.HALF_OPEN)
+        b.record(True)
+        self.assertEquals(b.state, breaker.CLOSED)
+        self.assertEquals(b.stats()['requests'], 0)
+
+    def test_half_open_failure_reopens(self):
+        b = breaker.CircuitBreaker(min_requests=1, reset_timeout=30)
+        b.record(False)
+        b.opened_at -= 30
+        self.assert_(b.allow())
+        b.record(False)
+        self.assertEquals(b.state, breaker.OPEN)
+        self.assertFalse(b.allow())
+        self.assertEquals(b.opened, 2)
+
+    def test_lost_trials_time_out(self):
+        b = breaker.CircuitBreaker(min_requests=1, reset_timeout=30,
+                                   trial_requests=1)
+        b.record(False)
+        b.opened_at -= 30
+        self.assert_(b.allow())
+        # the trial never comes back
+        self.assertFalse(b.allow())
+        b.half_opened_at -= 30
+        self.assert_(b.allow())
+        self.assertEquals(b.state, breaker.HALF_OPEN)
+        b.record(True)
+        self.assertEquals(b.state, breaker.CLOSED)
+
+    def test_client_fails_fast(self):
+        b = breaker.CircuitBreaker(min_requests=1)
+        endpoints = LoadBalancer('http://127.0.0.1:8080/v1.0',
+                                 breaker_factory=lambda: b)
+        c = client.LunrClient(endpoints, {'project_id': 'fake'})
+        calls = []
+
+        def refused(req, **kwargs):
+            calls.append(req)
+            raise URLError(socket.error(111, 'Connection refused'))
+        _orig_urlopen = client.urlopen
+        try:
+            client.urlopen = refused
+            self.assertRaises(client.LunrError, c.volumes.get, 'vol1')
+            with self.assertRaises(client.LunrError) as manager:
+                c.volumes.get('vol1')
+        finally:
+            client.urlopen = _orig_urlopen
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(manager.exception.code, 503)
+        self.assert_('circuit open' in str(manager.exception))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+from eventlet import sleep
+
+from lunrdriver.lunr import bulk
+from lunrdriver.lunr import recheck
+
+
+class Resource(object):
+    name = 'exports'
+
+
+class TestRun(unittest.TestCase):
+
+    def test_results_in_order(self):
+        def func(item):
+            # later items finish first
+            sleep(0.001 * (5 - item))
+            return item * 2
+        report = bulk.run(func, range(5), concurrency=5)
+        self.assertEquals([r.key for r in report.results], range(5))
+        self.assertEquals([r.resp for r in report.results],
+                          [0, 2, 4, 6, 8])
+        self.assertEquals(len(report.succeeded), 5)
+        self.assertEquals(report.failed, [])
+
+    def test_errors_are_per_item(self):
+        def func(item):
+            if item == 'bad':
+                raise ValueError(item)
+            return item
+        report = bulk.run(func, ['good', 'bad', 'fine'])
+        self.assertEquals([r.ok for r in report.results],
+                          [True, False, True])
+        self.assert_(isinstance(report.failed[0].error, ValueError))
+        stats = report.stats()
+        self.assertEquals(stats['items'], 3)
+        self.assertEquals(stats['failed'], 1)
+
+    def test_concurrency(self):
+        running = []
+        most = []
+
+        def func(item):
+            running.append(item)
+            most.append(len(running))
+            sleep(0.001)
+            running.remove(item)
+        bulk.run(func, range(10), concurrency=3)
+        self.assertEquals(max(most), 3)
+
+    def test_slots_bound_operations_together(self):
+        policy = bulk.BulkPolicy(concurrency=2)
+        running = []
+        most = []
+
+        def func(item):
+            running.append(item)
+            most.append(len(running))
+            sleep(0.001)
+            running.remove(item)
+        bulk.run(lambda group: policy.run(func, group),
+                 [range(5), range(5, 10)], concurrency=2)
+        self.assertEquals(max(most), 2)
+
+    def test_no_items(self):
+        report = bulk.run(lambda item: item, [])
+        self.assertEquals(report.results, [])
+
+
+class TestBulkPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_time = recheck.time
+        self.now = 1000.0
+        recheck.time = lambda: self.now
+
+    def tearDown(self):
+        recheck.time = self._orig_time
+
+    def test_unsupported_until_recheck(self):
+        policy = bulk.BulkPolicy(recheck=60)
+        resource = Resource()
+        self.assert_(policy.supported(resource))
+        policy.unsupported(resource, 404)
+        self.assertFalse(policy.supported(resource))
+        self.now += 61
+        self.assert_(policy.supported(resource))
+
+    def test_record(self):
+        policy = bulk.BulkPolicy()
+        report = bulk.BulkReport([bulk.BulkResult('a', resp=1),
+                                  bulk.BulkResult('b', error=Exception())],
+                                 2.0)
+        policy.record(report)
+        stats = policy.stats()
+        self.assertEquals(stats['operations'], 1)
+        self.assertEquals(stats['items'], 2)
+        self.assertEquals(stats['failures'], 1)
+        self.assertEquals(stats['latency']['count'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,11 +15,14 @@
 
 
 import unittest
+from cgi import parse_qsl
 from urllib2 import URLError, HTTPError
+from urlparse import urlparse
 from StringIO import StringIO
 import json
 
 from lunrdriver.lunr import client
+from lunrdriver.lunr.timeouts import Deadline, Timeouts
 
 
 class MockResponse(object):
@@ -44,6 +47,7 @@ class MockUrlOpen(object):
     def __init__(self):
         self._responses = [MockResponse]
         self._resp_iter = None
+        self.calls = []
 
     @property
     def responses(self):
@@ -60,6 +64,7 @@ class MockUrlOpen(object):
         return self._resp_iter.next()
 
     def __call__(self, req, *args, **kwargs):
+        self.calls.append((req, kwargs))
         resp = self.get_next_resp()
         try:
             return resp(req)
@@ -96,6 +101,8 @@ def stub_error(req, code=None, reason='Internal Server Error'):
 
 class TestLunrClient(unittest.TestCase):
 
+    url = 'http://127.0.0.1:8080/v1.0'
+
     def setUp(self):
         super(TestLunrClient, self).setUp()
         self.urlopen = MockUrlOpen()
@@ -110,7 +117,7 @@ class TestLunrClient(unittest.TestCase):
         client.urlopen = self._orig_urlopen
 
     def test_get_volume(self):
-        c = client.LunrClient({'project_id': 'fake'})
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
         def volume_get(req):
             self.assertEquals(req.get_method(), 'GET')
             expected_path = 'http://127.0.0.1:8080/v1.0/fake/volumes/volid?'
@@ -123,7 +130,7 @@ class TestLunrClient(unittest.TestCase):
         self.assertEquals(resp.body['account_id'], 'fake')
 
     def test_get_volume_error(self):
-        c = client.LunrClient({'project_id': 'fake'})
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
         def url_error(req):
             raise stub_error(req, reason='connection refused')
         self.set_response(url_error)
@@ -140,7 +147,7 @@ class TestLunrClient(unittest.TestCase):
         self.assert_(http_error.called)
 
     def test_export_delete(self):
-        c = client.LunrClient({'project_id': 'fake'})
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
         def export_delete(req):
             self.assertEquals(req.get_method(), 'DELETE')
             expected_path = 'http://127.0.0.1:8080/v1.0/fake/volumes/' + \
@@ -152,7 +159,7 @@ class TestLunrClient(unittest.TestCase):
         self.assert_(export_delete.called)
 
     def test_export_delete_force(self):
-        c = client.LunrClient({'project_id': 'fake'})
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
         def export_delete_force(req):
             self.assertEquals(req.get_method(), 'DELETE')
             expected_path = 'http://127.0.0.1:8080/v1.0/fake/volumes/' + \
@@ -163,6 +170,157 @@ class TestLunrClient(unittest.TestCase):
         resp = c.exports.delete('volid', force=True)
         self.assert_(export_delete_force.called)
 
+    def test_export_delete_many_bulk(self):
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
+        def bulk_delete(req):
+            self.assertEquals(req.get_method(), 'DELETE')
+            url = urlparse(req.get_full_url())
+            self.assertEquals(url.path, '/v1.0/fake/exports')
+            self.assertEquals(dict(parse_qsl(url.query)),
+                              {'volumes': 'vol1,vol2', 'initiator': 'iqn'})
+            return MockResponse({
+                'vol1': {'code': 200},
+                'vol2': {'code': 404, 'reason': 'Not Found'},
+            })
+        self.set_response(bulk_delete)
+        report = c.exports.delete_many(['vol1', 'vol2'], initiator='iqn')
+        self.assert_(bulk_delete.called)
+        self.assertEquals([r.key for r in report.results], ['vol1', 'vol2'])
+        self.assert_(report.results[0].ok)
+        self.assertEquals(report.results[1].error.code, 404)
+        self.assertEquals(report.results[1].error.reason, 'Not Found')
+        stats = c.bulk_policy.stats()
+        self.assertEquals(stats['bulk_requests'], 1)
+        self.assertEquals(stats['items'], 2)
+        self.assertEquals(stats['failures'], 1)
+
+    def test_export_delete_many_fallback(self):
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
+        def no_bulk(req):
+            self.assertEquals(req.get_method(), 'DELETE')
+            self.assert_('/fake/exports?' in req.get_full_url())
+            raise stub_error(req, 404, 'Not Found')
+        def export_delete(req):
+            self.assertEquals(req.get_method(), 'DELETE')
+            self.assert_('/fake/volumes/' in req.get_full_url())
+            return MockResponse()
+        def export_error(req):
+            raise stub_error(req, 500)
+        self.set_response(no_bulk, export_delete, export_error)
+        report = c.exports.delete_many(['vol1', 'vol2'], force=True)
+        self.assertEquals([r.ok for r in report.results], [True, False])
+        self.assertEquals(report.results[1].error.code, 500)
+        self.assertEquals(c.bulk_policy.stats()['unsupported'], ['exports'])
+        # doesn't bother with the bulk endpoint again for a while
+        def export_update(req):
+            self.assertEquals(req.get_method(), 'POST')
+            self.assert_('/fake/volumes/' in req.get_full_url())
+            return MockResponse()
+        self.urlopen.calls = []
+        self.set_response(export_update, export_update)
+        report = c.exports.update_many(['vol1', 'vol2'], instance_id=None)
+        self.assertEquals(len(report.succeeded), 2)
+        self.assertEquals(len(self.urlopen.calls), 2)
+
+    def test_lazy_body(self):
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
+        decoded = []
+        _orig_loads = client.json_loads
+
+        def mock_loads(raw):
+            decoded.append(raw)
+            return _orig_loads(raw)
+
+        class ClosingResponse(MockResponse):
+            closed = False
+
+            def close(self):
+                self.closed = True
+        resp = ClosingResponse(stub_volume())
+        self.set_response(lambda req: resp)
+        try:
+            client.json_loads = mock_loads
+            lunr_resp = c.volumes.get('vol1')
+            self.assert_(isinstance(lunr_resp, client.LunrResponse))
+            self.assert_(resp.closed)
+            self.assertEquals(lunr_resp.status, 200)
+            self.assertEquals(decoded, [])
+            self.assertEquals(lunr_resp.body['id'], 'vol1')
+            self.assertEquals(lunr_resp.body['size'], 100)
+        finally:
+            client.json_loads = _orig_loads
+        self.assertEquals(len(decoded), 1)
+        self.assertRaises(AttributeError, setattr, lunr_resp, 'extra', 1)
+
+    def test_set_json_backend(self):
+        _orig_loads = client.json_loads
+        try:
+            self.assertEquals(client.set_json_backend('json'), 'json')
+            self.assertEquals(client.json_loads, json.loads)
+            self.assert_(client.set_json_backend() in client.JSON_BACKENDS)
+            self.assertRaises(ValueError, client.set_json_backend, 'yaml')
+        finally:
+            client.json_loads = _orig_loads
+
+    def test_timeouts(self):
+        timeouts = Timeouts(connect=1, read=2,
+                            connect_overrides={'DELETE': '3'},
+                            read_overrides={'exports': '4',
+                                            'exports.DELETE': '5'})
+        c = client.LunrClient(self.url, {'project_id': 'fake'},
+                              timeouts=timeouts)
+        def ok(req):
+            return MockResponse()
+        self.set_response(ok, ok, ok)
+        c.volumes.get('volid')
+        c.exports.create('volid')
+        c.exports.delete('volid')
+        timeouts = [(req.connect_timeout, kwargs['timeout'])
+                    for req, kwargs in self.urlopen.calls]
+        self.assertEquals(timeouts, [(1, 2), (1, 4), (3, 5)])
+
+    def test_deadline_caps_timeouts(self):
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
+        self.set_response(lambda req: MockResponse())
+        c.volumes.get('volid', deadline=Deadline(1))
+        req, kwargs = self.urlopen.calls[0]
+        self.assert_(req.connect_timeout <= 1)
+        self.assert_(kwargs['timeout'] <= 1)
+        # deadline is not sent to the api
+        self.assertEquals(req.get_full_url(),
+                          'http://127.0.0.1:8080/v1.0/fake/volumes/volid?')
+
+    def test_deadline_exceeded(self):
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
+        with self.assertRaises(client.LunrError) as manager:
+            c.volumes.get('volid', deadline=Deadline(0))
+        self.assertEquals(manager.exception.code, 504)
+        self.assertEquals(self.urlopen.calls, [])
+
+    def test_wait_on_status_deadline(self):
+        c = client.LunrClient(self.url, {'project_id': 'fake'})
+        sleeps = []
+        deadline = Deadline(5)
+
+        def mock_sleep(seconds):
+            sleeps.append(seconds)
+            deadline.expires -= seconds
+
+        def building(req):
+            return MockResponse(stub_volume(status='BUILDING'))
+        self.set_response(*([building] * 4))
+        _orig_sleep = client.sleep
+        try:
+            client.sleep = mock_sleep
+            with self.assertRaises(client.LunrError) as manager:
+                c.volumes.wait_on_status('vol1', 'ACTIVE', deadline=deadline)
+        finally:
+            client.sleep = _orig_sleep
+        self.assertEquals(manager.exception.code, 504)
+        self.assertEquals(len(self.urlopen.calls), 3)
+        self.assertEquals(sleeps[:2], [1, 2])
+        self.assert_(sleeps[2] <= 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,141 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import socket
+import unittest
+from urllib2 import URLError
+
+import eventlet
+
+from lunrdriver.lunr import client
+from lunrdriver.lunr.balancer import LoadBalancer
+from lunrdriver.lunr.hedge import HedgePolicy
+
+from testlunrdriver.unit import MockResponse
+
+
+URLS = ['http://lunr1:8080/v1.0', 'http://lunr2:8080/v1.0']
+
+
+class TestHedgePolicy(unittest.TestCase):
+
+    def test_needs_samples(self):
+        policy = HedgePolicy(min_samples=3, max_rate=1)
+        policy.record('volumes', 0.1)
+        policy.record('volumes', 0.1)
+        self.assertEquals(policy.delay('volumes'), None)
+        policy.record('volumes', 0.1)
+        self.assertEquals(policy.delay('volumes'), 0.1)
+        self.assertEquals(policy.delay('exports'), None)
+
+    def test_percentile(self):
+        policy = HedgePolicy(percentile=90, min_delay=0, min_samples=1,
+                             max_rate=1)
+        for i in range(1, 101):
+            policy.record('volumes', i / 100.0)
+        self.assertEquals(policy.delay('volumes'), 0.91)
+        policy = HedgePolicy(min_delay=2, min_samples=1, max_rate=1)
+        policy.record('volumes', 0.1)
+        self.assertEquals(policy.delay('volumes'), 2)
+
+    def test_max_rate(self):
+        policy = HedgePolicy(max_rate=0.5, min_samples=1)
+        policy.record('volumes', 0.1)
+        self.assertNotEqual(policy.delay('volumes'), None)
+        policy.hedged += 1
+        self.assertEquals(policy.delay('volumes'), None)
+        self.assertNotEqual(policy.delay('volumes'), None)
+        stats = policy.stats()
+        self.assertEquals(stats['requests'], 3)
+        self.assertEquals(stats['hedged'], 1)
+
+
+class TestClientHedging(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_urlopen = client.urlopen
+        self.policy = HedgePolicy(min_delay=0.01, min_samples=1, max_rate=1)
+        self.policy.record('volumes', 0.01)
+        self.endpoints = LoadBalancer(URLS)
+        self.client = client.LunrClient(self.endpoints,
+                                        {'project_id': 'fake'},
+                                        hedge_policy=self.policy)
+
+    def tearDown(self):
+        client.urlopen = self._orig_urlopen
+
+    def test_hedge_wins(self):
+        urls = []
+
+        def mock_urlopen(req, **kwargs):
+            urls.append(req.get_full_url())
+            if len(urls) == 1:
+                eventlet.sleep(10)
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        resp = self.client.volumes.get('vol1')
+        self.assertEquals(resp.body, {'id': 'vol1'})
+        self.assertEquals(len(urls), 2)
+        # the hedge went to the other endpoint
+        self.assertNotEqual(urls[0].split('/')[2], urls[1].split('/')[2])
+        stats = self.policy.stats()
+        self.assertEquals(stats['hedged'], 1)
+        self.assertEquals(stats['wins'], 1)
+        # the loser was cancelled
+        self.assertEquals(sum(e.outstanding for e in self.endpoints.endpoints),
+                          0)
+
+    def test_fast_response_not_hedged(self):
+        urls = []
+
+        def mock_urlopen(req, **kwargs):
+            urls.append(req.get_full_url())
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        self.client.volumes.get('vol1')
+        self.assertEquals(len(urls), 1)
+        self.assertEquals(self.policy.stats()['hedged'], 0)
+
+    def test_first_failure_waits_for_hedge(self):
+        urls = []
+
+        def mock_urlopen(req, **kwargs):
+            urls.append(req.get_full_url())
+            if len(urls) == 1:
+                eventlet.sleep(0.05)
+                raise URLError(socket.error(111, 'Connection refused'))
+            eventlet.sleep(0.1)
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        resp = self.client.volumes.get('vol1')
+        self.assertEquals(resp.body, {'id': 'vol1'})
+        self.assertEquals(self.policy.stats()['wins'], 1)
+
+    def test_writes_not_hedged(self):
+        urls = []
+
+        def mock_urlopen(req, **kwargs):
+            urls.append(req.get_full_url())
+            eventlet.sleep(0.05)
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        self.client.volumes.create('vol1', size=1)
+        self.assertEquals(len(urls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
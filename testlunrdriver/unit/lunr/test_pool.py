@@ -0,0 +1,156 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import httplib
+import unittest
+import json
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from urllib2 import Request, HTTPError
+
+from lunrdriver.lunr import pool
+
+
+class KeepAliveRequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.ports.append(self.client_address[1])
+        code = 404 if self.path.endswith('missing') else 200
+        body = json.dumps({'path': self.path})
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.posts += 1
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPoolManager(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), KeepAliveRequestHandler)
+        self.server.ports = []
+        self.server.posts = 0
+        # connections the tests drop on the floor aren't worth a traceback
+        self.server.handle_error = lambda *args: None
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.manager = pool.PoolManager(size=2, idle_timeout=60,
+                                        max_requests=100)
+
+    def tearDown(self):
+        self.manager.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def urlopen(self, path, data=None):
+        req = Request(self.url + path, data=data)
+        return self.manager.opener.open(req, timeout=5)
+
+    def test_connection_reused(self):
+        for i in range(3):
+            resp = self.urlopen('/v1.0/volumes/%s' % i)
+            self.assertEquals(resp.getcode(), 200)
+            self.assertEquals(json.loads(resp.read()),
+                              {'path': '/v1.0/volumes/%s' % i})
+        # all three requests came in over the same socket
+        self.assertEquals(len(set(self.server.ports)), 1)
+        stats = self.manager.stats()
+        self.assertEquals(stats['misses'], 1)
+        self.assertEquals(stats['hits'], 2)
+        self.assertEquals(stats['idle'], 1)
+        self.assertEquals(stats['pools'], 1)
+
+    def test_max_requests(self):
+        self.manager.configure(max_requests=2)
+        for i in range(4):
+            self.urlopen('/v1.0/volumes/%s' % i).read()
+        self.assertEquals(len(set(self.server.ports)), 2)
+        stats = self.manager.stats()
+        self.assertEquals(stats['misses'], 2)
+        self.assertEquals(stats['hits'], 2)
+
+    def test_idle_timeout(self):
+        self.manager.configure(idle_timeout=-1)
+        for i in range(2):
+            self.urlopen('/v1.0/volumes/%s' % i).read()
+        self.assertEquals(len(set(self.server.ports)), 2)
+        self.assertEquals(self.manager.stats()['hits'], 0)
+
+    def test_http_error_keeps_connection(self):
+        with self.assertRaises(HTTPError) as cm:
+            self.urlopen('/v1.0/volumes/missing')
+        self.assertEquals(cm.exception.code, 404)
+        self.assertEquals(json.loads(cm.exception.fp.read()),
+                          {'path': '/v1.0/volumes/missing'})
+        self.urlopen('/v1.0/volumes/found').read()
+        self.assertEquals(len(set(self.server.ports)), 1)
+
+    def test_server_closed_idle_connection(self):
+        self.urlopen('/v1.0/volumes/1').read()
+        # drop the server side of the keep-alive connection
+        conn_pool = self.manager.pools.values()[0]
+        for conn in conn_pool._idle:
+            conn.sock.shutdown(2)
+        resp = self.urlopen('/v1.0/volumes/2')
+        self.assertEquals(resp.getcode(), 200)
+        self.assertEquals(len(set(self.server.ports)), 2)
+
+    def lose_responses(self):
+        # the server drops the connection after reading the request
+        conn_pool = self.manager.pools.values()[0]
+        for conn in conn_pool._idle:
+            def getresponse():
+                raise httplib.BadStatusLine('')
+            conn.getresponse = getresponse
+
+    def test_stale_get_resent(self):
+        self.urlopen('/v1.0/volumes/1').read()
+        self.lose_responses()
+        resp = self.urlopen('/v1.0/volumes/2')
+        self.assertEquals(resp.getcode(), 200)
+
+    def test_stale_post_not_resent(self):
+        self.urlopen('/v1.0/volumes/1').read()
+        self.lose_responses()
+        self.assertRaises(httplib.BadStatusLine, self.urlopen,
+                          '/v1.0/volumes/2/export', data='ip=10.0.0.1')
+        # the server got it, sending it again could export it twice
+        self.assertEquals(self.server.posts, 1)
+
+    def test_unsent_post_resent(self):
+        self.urlopen('/v1.0/volumes/1').read()
+        conn_pool = self.manager.pools.values()[0]
+        for conn in conn_pool._idle:
+            conn.sock.shutdown(2)
+        resp = self.urlopen('/v1.0/volumes/2/export', data='ip=10.0.0.1')
+        self.assertEquals(resp.getcode(), 200)
+        self.assertEquals(self.server.posts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,238 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import time
+import unittest
+import urllib2
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Condition, Thread, Timer
+from urlparse import urlparse, parse_qs
+
+from webob import Request
+
+from lunrdriver.lunr import client
+from lunrdriver.lunr import pool
+from lunrdriver.lunr import push
+from lunrdriver.lunr.schedule import PollSchedule
+
+
+class LunrRequestHandler(BaseHTTPRequestHandler):
+    """
+    Just enough of the Lunr api to wait on volumes.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self, code, body, headers=None):
+        body = json.dumps(body)
+        self.send_response(code)
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse(self):
+        url = urlparse(self.path)
+        self.server.requests.append((self.command, url.path, url.query))
+        # /v1.0/<project>/volumes/<id>[/watch]
+        parts = url.path.strip('/').split('/')
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        return parts[3], parts[4:], query
+
+    def do_GET(self):
+        _id, rest, query = self.parse()
+        lunr = self.server
+        if not lunr.long_poll or 'wait_for' not in query:
+            return self.respond(200, lunr.volume(_id))
+        statuses = query['wait_for'].split(',')
+        expires = time.time() + float(query['timeout'])
+        with lunr.changed:
+            while lunr.volumes[_id] not in statuses:
+                remaining = expires - time.time()
+                if remaining <= 0:
+                    break
+                lunr.changed.wait(remaining)
+        self.respond(200, lunr.volume(_id),
+                     headers={push.LONG_POLL_HEADER: 'true'})
+
+    def do_PUT(self):
+        _id, rest, query = self.parse()
+        if not self.server.callbacks or rest != ['watch']:
+            return self.respond(404, {'reason': 'Not Found'})
+        self.server.watches.append(query['callback_url'])
+        self.respond(200, self.server.volume(_id))
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInLunr(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, long_poll=False, callbacks=False):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), LunrRequestHandler)
+        self.long_poll = long_poll
+        self.callbacks = callbacks
+        self.volumes = {}
+        self.watches = []
+        self.requests = []
+        self.changed = Condition()
+        self.url = 'http://127.0.0.1:%s/v1.0' % self.server_port
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def volume(self, _id):
+        return {'id': _id, 'status': self.volumes[_id]}
+
+    def set_status(self, _id, status):
+        with self.changed:
+            self.volumes[_id] = status
+            self.changed.notify_all()
+        for url in self.watches:
+            req = urllib2.Request(url, json.dumps(self.volume(_id)))
+            try:
+                urllib2.urlopen(req, timeout=5).read()
+            except urllib2.HTTPError:
+                pass
+
+    def set_status_later(self, _id, status, delay=0.1):
+        Timer(delay, self.set_status, (_id, status)).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class PushTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_sleep = client.sleep
+        self.sleeps = []
+
+    def tearDown(self):
+        client.sleep = self._orig_sleep
+        self.lunr.stop()
+        pool.manager.clear()
+
+    def client(self, status_push):
+        return client.LunrClient(self.lunr.url, {'project_id': 'fake'},
+                                 status_push=status_push,
+                                 poll_schedule=PollSchedule(initial=0.01))
+
+    def activate_on_sleep(self, _id):
+        def mock_sleep(seconds):
+            self.sleeps.append(seconds)
+            self.lunr.set_status(_id, 'ACTIVE')
+        client.sleep = mock_sleep
+
+
+class TestLongPoller(PushTestCase):
+
+    def test_long_poll(self):
+        self.lunr = StandInLunr(long_poll=True)
+        self.lunr.volumes['vol1'] = 'BUILDING'
+        poller = push.LongPoller(timeout=5)
+        c = self.client(poller)
+        self.lunr.set_status_later('vol1', 'ACTIVE')
+        resp = c.volumes.wait_on_status('vol1', 'ACTIVE')
+        self.assertEquals(resp.body['status'], 'ACTIVE')
+        self.assertEquals(len(self.lunr.requests), 1)
+        method, path, query = self.lunr.requests[0]
+        self.assertEquals(path, '/v1.0/fake/volumes/vol1')
+        self.assertEquals(parse_qs(query), {'timeout': ['5'],
+                                            'wait_for': ['ACTIVE']})
+        stats = poller.stats()
+        self.assertEquals(stats['requests'], 1)
+        self.assertEquals(stats['pushed'], 1)
+
+    def test_fallback(self):
+        self.lunr = StandInLunr(long_poll=False)
+        self.lunr.volumes['vol1'] = 'BUILDING'
+        poller = push.LongPoller(timeout=5)
+        c = self.client(poller)
+        self.activate_on_sleep('vol1')
+        resp = c.volumes.wait_on_status('vol1', 'ACTIVE')
+        self.assertEquals(resp.body['status'], 'ACTIVE')
+        self.assertEquals(poller.stats()['unsupported'], ['volumes'])
+        # the next wait doesn't bother
+        self.lunr.volumes['vol2'] = 'BUILDING'
+        self.activate_on_sleep('vol2')
+        del self.lunr.requests[:]
+        c.volumes.wait_on_status('vol2', 'ACTIVE')
+        self.assert_(all('wait_for' not in query for method, path, query
+                         in self.lunr.requests))
+        self.assertEquals(poller.stats()['fallbacks'], 2)
+
+
+class TestCallbackListener(PushTestCase):
+
+    def setUp(self):
+        super(TestCallbackListener, self).setUp()
+        self.listener = push.CallbackListener(host='127.0.0.1',
+                                              safety_interval=5)
+        self.listener.start()
+
+    def tearDown(self):
+        super(TestCallbackListener, self).tearDown()
+        self.listener.stop()
+
+    def test_callback(self):
+        self.lunr = StandInLunr(callbacks=True)
+        self.lunr.volumes['vol1'] = 'BUILDING'
+        c = self.client(self.listener)
+        self.lunr.set_status_later('vol1', 'ACTIVE')
+        resp = c.volumes.wait_on_status('vol1', 'ACTIVE')
+        self.assertEquals(resp.body['status'], 'ACTIVE')
+        self.assertEquals(len(self.lunr.watches), 1)
+        self.assert_(self.lunr.watches[0].startswith(self.listener.url))
+        self.assertEquals([r[0] for r in self.lunr.requests], ['PUT'])
+        stats = self.listener.stats()
+        self.assertEquals(stats['pushed'], 1)
+        self.assertEquals(stats['waiting'], 0)
+
+    def test_status_error(self):
+        self.lunr = StandInLunr(callbacks=True)
+        self.lunr.volumes['vol1'] = 'BUILDING'
+        c = self.client(self.listener)
+        self.lunr.set_status_later('vol1', 'ERROR')
+        self.assertRaises(client.StatusError, c.volumes.wait_on_status,
+                          'vol1', 'ACTIVE')
+
+    def test_fallback(self):
+        self.lunr = StandInLunr(callbacks=False)
+        self.lunr.volumes['vol1'] = 'BUILDING'
+        c = self.client(self.listener)
+        self.activate_on_sleep('vol1')
+        resp = c.volumes.wait_on_status('vol1', 'ACTIVE')
+        self.assertEquals(resp.body['status'], 'ACTIVE')
+        self.assertEquals(self.listener.stats()['unsupported'], ['volumes'])
+
+    def test_unknown_callback(self):
+        self.lunr = StandInLunr()
+        req = Request.blank('/nope', method='POST', body='{"status": "x"}')
+        self.assertEquals(req.get_response(self.listener).status_int, 404)
+        req = Request.blank('/nope')
+        self.assertEquals(req.get_response(self.listener).status_int, 405)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,180 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import unittest
+
+from lunrdriver.lunr import breaker
+from lunrdriver.lunr import client
+from lunrdriver.lunr import ratelimit
+from lunrdriver.lunr.balancer import LoadBalancer
+from lunrdriver.lunr.timeouts import Deadline
+
+from testlunrdriver.unit import MockResponse
+
+
+class ClockTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self._orig_time = ratelimit.time
+        self._orig_sleep = ratelimit.sleep
+        ratelimit.time = lambda: self.now
+        ratelimit.sleep = self.sleep
+
+    def tearDown(self):
+        ratelimit.time = self._orig_time
+        ratelimit.sleep = self._orig_sleep
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(ClockTestCase):
+
+    def test_burst_then_rate(self):
+        bucket = ratelimit.TokenBucket(rate=2, burst=3)
+        self.assertEquals([bucket.reserve(10) for i in range(3)], [0, 0, 0])
+        # the next ones are spaced out by the rate
+        self.assertEquals(bucket.reserve(10), 0.5)
+        self.assertEquals(bucket.reserve(10), 1.0)
+        self.now += 1.0
+        self.assertEquals(bucket.reserve(10), 0.5)
+
+    def test_refills_up_to_burst(self):
+        bucket = ratelimit.TokenBucket(rate=1, burst=2)
+        bucket.reserve(0)
+        bucket.reserve(0)
+        self.now += 60
+        self.assertEquals([bucket.reserve(0) for i in range(2)], [0, 0])
+        self.assertEquals(bucket.reserve(0), None)
+
+    def test_too_long_takes_nothing(self):
+        bucket = ratelimit.TokenBucket(rate=1, burst=1)
+        bucket.reserve(0)
+        self.assertEquals(bucket.reserve(0.5), None)
+        self.assertEquals(bucket.next_token(), 1.0)
+        self.assertEquals(bucket.reserve(1), 1.0)
+
+
+class TestRateLimiter(ClockTestCase):
+
+    def test_method_class(self):
+        self.assertEquals(ratelimit.method_class('GET'), 'reads')
+        self.assertEquals(ratelimit.method_class('GET', poll=True), 'polls')
+        self.assertEquals(ratelimit.method_class('DELETE'), 'writes')
+
+    def test_queues(self):
+        limiter = ratelimit.RateLimiter({'writes': 1}, burst=1, max_wait=10)
+        limiter.wait('PUT', 'http://lunr1')
+        limiter.wait('PUT', 'http://lunr1')
+        self.assertEquals(self.sleeps, [1.0])
+        # each endpoint has it's own bucket
+        limiter.wait('PUT', 'http://lunr2')
+        self.assertEquals(self.sleeps, [1.0])
+        stats = limiter.stats()['writes']
+        self.assertEquals(stats['requests'], 3)
+        self.assertEquals(stats['throttled'], 1)
+        self.assertEquals(stats['mean_wait'], 1.0 / 3)
+
+    def test_rejects(self):
+        limiter = ratelimit.RateLimiter({'writes': 1}, burst=1, max_wait=0)
+        limiter.wait('DELETE', 'http://lunr1')
+        with self.assertRaises(ratelimit.RateLimited) as manager:
+            limiter.wait('DELETE', 'http://lunr1')
+        self.assertEquals(manager.exception.method_class, 'writes')
+        self.assert_('http://lunr1' in str(manager.exception))
+        self.assertEquals(limiter.stats()['writes']['rejected'], 1)
+
+    def test_deadline_caps_wait(self):
+        limiter = ratelimit.RateLimiter({'polls': 0.1}, burst=1)
+        limiter.wait('GET', 'http://lunr1', poll=True)
+        self.assertRaises(ratelimit.RateLimited, limiter.wait, 'GET',
+                          'http://lunr1', poll=True, deadline=Deadline(5))
+
+    def test_unlimited_classes(self):
+        limiter = ratelimit.RateLimiter({'writes': 1, 'reads': 0}, burst=1,
+                                        max_wait=0)
+        for i in range(10):
+            limiter.wait('GET', 'http://lunr1')
+        self.assertEquals(self.sleeps, [])
+        stats = limiter.stats()
+        self.assertEquals(stats['reads']['rate'], None)
+        self.assertEquals(stats['reads']['requests'], 10)
+
+
+class TestClientRateLimit(ClockTestCase):
+
+    def setUp(self):
+        super(TestClientRateLimit, self).setUp()
+        self.requests = []
+        self._orig_urlopen = client.urlopen
+        client.urlopen = self.urlopen
+
+    def tearDown(self):
+        super(TestClientRateLimit, self).tearDown()
+        client.urlopen = self._orig_urlopen
+
+    def urlopen(self, req, *args, **kwargs):
+        self.requests.append((req.get_method(), self.now))
+        return MockResponse(json.dumps({'id': 'vol1', 'status': 'ACTIVE'}))
+
+    def test_rejected_request(self):
+        limiter = ratelimit.RateLimiter({'writes': 1}, burst=1, max_wait=0)
+        c = client.LunrClient('http://127.0.0.1:8080/v1.0',
+                              {'project_id': 'fake'}, rate_limiter=limiter)
+        c.exports.delete('vol1')
+        with self.assertRaises(client.LunrError) as manager:
+            c.exports.delete('vol1')
+        self.assertEquals(manager.exception.code, 429)
+        self.assert_('rate limit of writes' in str(manager.exception))
+        # reads have no limit
+        c.volumes.get('vol1')
+        self.assertEquals([method for method, now in self.requests],
+                          ['DELETE', 'GET'])
+
+    def test_rejected_request_gives_back_trial(self):
+        limiter = ratelimit.RateLimiter({'writes': 1}, burst=1, max_wait=0)
+        b = breaker.CircuitBreaker(min_requests=1, trial_requests=1)
+        endpoints = LoadBalancer('http://127.0.0.1:8080/v1.0',
+                                 breaker_factory=lambda: b)
+        c = client.LunrClient(endpoints, {'project_id': 'fake'},
+                              rate_limiter=limiter)
+        b.record(False)
+        b.opened_at -= b.reset_timeout
+        limiter.wait('DELETE', endpoints.primary.url)
+        self.assertRaises(client.LunrError, c.exports.delete, 'vol1')
+        self.assertEquals(b.state, breaker.HALF_OPEN)
+        # the trial is still there for the next request
+        c.volumes.get('vol1')
+        self.assertEquals(b.state, breaker.CLOSED)
+
+    def test_polls_are_their_own_class(self):
+        limiter = ratelimit.RateLimiter({'polls': 1}, burst=1)
+        c = client.LunrClient('http://127.0.0.1:8080/v1.0',
+                              {'project_id': 'fake'}, rate_limiter=limiter)
+        c.volumes.get('vol1')
+        c.volumes.get('vol1')
+        c.volumes.wait_on_status('vol1', 'ACTIVE')
+        stats = limiter.stats()
+        self.assertEquals(stats['reads']['requests'], 2)
+        self.assertEquals(stats['polls']['requests'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
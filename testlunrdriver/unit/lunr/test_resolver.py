@@ -0,0 +1,144 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import socket
+import time
+import unittest
+
+import eventlet
+
+from lunrdriver.lunr import resolver
+
+
+class TestResolver(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_gethostbyname = socket.gethostbyname
+        self._orig_time = resolver.time
+        self.now = 1000.0
+        resolver.time = lambda: self.now
+        self.lookups = []
+        self.addresses = {'lunr1': '10.0.0.1'}
+        socket.gethostbyname = self.mock_gethostbyname
+
+    def tearDown(self):
+        socket.gethostbyname = self._orig_gethostbyname
+        resolver.time = self._orig_time
+
+    def mock_gethostbyname(self, hostname):
+        self.lookups.append(hostname)
+        try:
+            return self.addresses[hostname]
+        except KeyError:
+            raise socket.gaierror(-5, 'No address associated with hostname')
+
+    def test_cached(self):
+        r = resolver.Resolver(ttl=60)
+        self.assertEquals(r.resolve_portal('lunr1:3260'), '10.0.0.1:3260')
+        self.assertEquals(r.resolve_portal('lunr1:3260'), '10.0.0.1:3260')
+        self.assertEquals(self.lookups, ['lunr1'])
+        self.now += 61
+        r.resolve('lunr1')
+        self.assertEquals(self.lookups, ['lunr1', 'lunr1'])
+        stats = r.stats()
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['misses'], 2)
+        self.assertEquals(stats['latency']['count'], 2)
+
+    def test_negative_cache(self):
+        r = resolver.Resolver(negative_ttl=10)
+        self.assertEquals(r.resolve_portal('nope:3260'), 'nope:3260')
+        self.assertEquals(r.resolve('nope'), None)
+        self.assertEquals(self.lookups, ['nope'])
+        self.now += 11
+        self.addresses['nope'] = '10.0.0.2'
+        self.assertEquals(r.resolve('nope'), '10.0.0.2')
+        stats = r.stats()
+        self.assertEquals(stats['negative_hits'], 1)
+        self.assertEquals(stats['failures'], 1)
+
+    def test_stale_on_failure(self):
+        r = resolver.Resolver(ttl=60)
+        r.resolve('lunr1')
+        self.now += 61
+        del self.addresses['lunr1']
+        self.assertEquals(r.resolve('lunr1'), '10.0.0.1')
+        self.assertEquals(r.stats()['stale'], 1)
+
+    def test_timeout(self):
+        resolver.time = self._orig_time
+        r = resolver.Resolver(timeout=0.01)
+
+        def slow_gethostbyname(hostname):
+            time.sleep(0.2)
+            return '10.0.0.1'
+        socket.gethostbyname = slow_gethostbyname
+        self.assertEquals(r.resolve_portal('slow:3260'), 'slow:3260')
+        self.assertEquals(r.stats()['timeouts'], 1)
+
+    def test_does_not_block_the_hub(self):
+        resolver.time = self._orig_time
+        r = resolver.Resolver()
+        ticks = []
+
+        def slow_gethostbyname(hostname):
+            time.sleep(0.05)
+            return '10.0.0.1'
+        socket.gethostbyname = slow_gethostbyname
+
+        def tick():
+            for i in range(5):
+                ticks.append(i)
+                eventlet.sleep(0)
+        eventlet.spawn(tick)
+        self.assertEquals(r.resolve('slow'), '10.0.0.1')
+        self.assertEquals(len(ticks), 5)
+
+    def test_concurrent_lookups_shared(self):
+        r = resolver.Resolver()
+
+        def gethostbyname(hostname):
+            self.lookups.append(hostname)
+            time.sleep(0.05)
+            return '10.0.0.1'
+        socket.gethostbyname = gethostbyname
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(r.resolve, ['lunr1'] * 3))
+        self.assertEquals(results, ['10.0.0.1'] * 3)
+        self.assertEquals(self.lookups, ['lunr1'])
+
+    def test_prefetch(self):
+        r = resolver.Resolver(ttl=60)
+        r.resolve('lunr1')
+        self.now += 31
+        self.addresses['lunr1'] = '10.0.0.9'
+        _orig_sleep = resolver.sleep
+
+        def stop(seconds):
+            r.prefetch = False
+        resolver.sleep = stop
+        try:
+            r.prefetch = True
+            r._prefetch_forever()
+        finally:
+            resolver.sleep = _orig_sleep
+        # it's fresh again, nobody had to wait on it
+        self.assertEquals(r.resolve('lunr1'), '10.0.0.9')
+        self.assertEquals(r.stats()['misses'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import socket
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError, URLError
+
+from lunrdriver.lunr.retry import RetryPolicy
+
+
+def http_error(code, headers=None):
+    return HTTPError('/v1.0/fake/volumes/vol1', code, 'Error', headers or {},
+                     StringIO('{}'))
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_retryable(self):
+        policy = RetryPolicy()
+        refused = URLError(socket.error(111, 'Connection refused'))
+        for method in ('GET', 'PUT', 'DELETE'):
+            self.assert_(policy.is_retryable(method, refused))
+            self.assert_(policy.is_retryable(method, http_error(503)))
+        self.assertFalse(policy.is_retryable('POST', refused))
+        self.assertFalse(policy.is_retryable('POST', http_error(503)))
+        self.assertFalse(policy.is_retryable('GET', http_error(500)))
+        self.assertFalse(policy.is_retryable('PUT', http_error(409)))
+
+    def test_timeout_only_retries_get(self):
+        policy = RetryPolicy()
+        timeout = URLError(socket.timeout('timed out'))
+        self.assert_(policy.is_retryable('GET', timeout))
+        self.assertFalse(policy.is_retryable('PUT', timeout))
+        self.assertFalse(policy.is_retryable('DELETE', timeout))
+
+    def test_full_jitter_backoff(self):
+        policy = RetryPolicy(attempts=10, backoff=1, max_backoff=4,
+                             budget=100)
+        for attempt, ceiling in ((1, 1), (2, 2), (3, 4), (6, 4)):
+            delay = policy.get_delay('GET', http_error(502), attempt, 0)
+            self.assert_(0 <= delay <= ceiling)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(budget=100)
+        e = http_error(503, {'Retry-After': '7'})
+        self.assertEquals(policy.get_delay('GET', e, 1, 0), 7)
+        e = http_error(503, {'Retry-After': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.assertEquals(policy.get_delay('GET', e, 1, 0), 0)
+
+    def test_attempts_and_budget(self):
+        policy = RetryPolicy(attempts=3, budget=10)
+        e = http_error(503, {'Retry-After': '4'})
+        self.assertEquals(policy.get_delay('GET', e, 1, 0), 4)
+        self.assertEquals(policy.get_delay('GET', e, 2, 4), 4)
+        self.assertEquals(policy.get_delay('GET', e, 3, 8), None)
+        self.assertEquals(policy.get_delay('GET', e, 2, 8), None)
+        policy.succeeded(2)
+        self.assertEquals(policy.stats(), {'retries': 2, 'recovered': 1,
+                                           'exhausted': 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
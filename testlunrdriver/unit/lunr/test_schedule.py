@@ -0,0 +1,174 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import unittest
+
+from lunrdriver.lunr import client
+from lunrdriver.lunr import schedule
+
+from testlunrdriver.unit import MockResponse
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class ScheduleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self._orig_time = schedule.time
+        schedule.time = self.clock
+
+    def tearDown(self):
+        schedule.time = self._orig_time
+
+    def wait(self, sched, duration, size=None, statuses=('ACTIVE',)):
+        poll = sched.start('volumes', statuses, size)
+        poll.observe('BUILDING')
+        self.clock.sleep(duration)
+        poll.finish('ACTIVE')
+
+
+class TestPollSchedule(ScheduleTestCase):
+
+    def test_size_bucket(self):
+        self.assertEquals(schedule.size_bucket(None), None)
+        self.assertEquals(schedule.size_bucket(1), 1)
+        self.assertEquals(schedule.size_bucket(5), 10)
+        self.assertEquals(schedule.size_bucket(100), 100)
+        self.assertEquals(schedule.size_bucket(101), 1000)
+
+    def test_backoff_without_history(self):
+        sched = schedule.PollSchedule()
+        poll = sched.start('volumes', ('ACTIVE',), 10)
+        delays = [poll.delay() for i in range(8)]
+        self.assertEquals(delays, [0, 1, 2, 4, 8, 16, 30, 30])
+
+    def test_learns_expected_duration(self):
+        sched = schedule.PollSchedule(min_samples=3)
+        for duration in (100, 110, 120):
+            self.wait(sched, duration, size=10)
+        # other sizes haven't been seen yet
+        self.assertEquals(sched.expected('volumes', ('ACTIVE',), 1000),
+                          None)
+        poll = sched.start('volumes', ('ACTIVE',), 10)
+        self.assertEquals(poll.expected, (100, 120))
+        delays = []
+        for i in range(8):
+            delays.append(poll.delay())
+            self.clock.sleep(delays[-1])
+        # first poll when it's expected to be done, tight polls until it's
+        # overdue, then back off
+        self.assertEquals(delays, [100, 5, 5, 5, 5, 1, 2, 4])
+
+    def test_done_before_first_poll(self):
+        sched = schedule.PollSchedule(min_samples=1)
+        self.wait(sched, 100)
+        poll = sched.start('volumes', ('ACTIVE',))
+        self.clock.sleep(poll.delay())
+        poll.finish('ACTIVE')
+        # all we know is it took no more than 100
+        stats = sched.stats()['durations']
+        self.assertEquals(stats['volumes BUILDING->ACTIVE any size'],
+                          {'samples': 1, 'p10': 100, 'p50': 100,
+                           'p90': 100})
+        # so the next one looks earlier
+        poll = sched.start('volumes', ('ACTIVE',))
+        self.assertEquals(poll.expected, (50, 100))
+        self.clock.sleep(poll.delay())
+        poll.finish('ACTIVE')
+        self.assertEquals(sched.expected('volumes', ('ACTIVE',), None),
+                          (25, 100))
+
+    def test_gets_faster(self):
+        sched = schedule.PollSchedule(min_samples=1, window=1)
+        self.wait(sched, 100)
+        # done long before the first poll
+        poll = sched.start('volumes', ('ACTIVE',))
+        self.clock.sleep(poll.delay())
+        poll.finish('ACTIVE')
+        # the next first poll catches it building
+        poll = sched.start('volumes', ('ACTIVE',))
+        self.assertEquals(poll.delay(), 50)
+        self.clock.sleep(50)
+        poll.observe('BUILDING')
+        self.clock.sleep(10)
+        poll.finish('ACTIVE')
+        self.assertEquals(sched.expected('volumes', ('ACTIVE',), None),
+                          (60, 60))
+
+    def test_time_in_state(self):
+        sched = schedule.PollSchedule()
+        poll = sched.start('backups', ('AVAILABLE',))
+        poll.observe('NEW')
+        self.clock.sleep(3)
+        poll.observe('SAVING')
+        self.clock.sleep(40)
+        poll.observe('SAVING')
+        self.clock.sleep(40)
+        poll.finish('AVAILABLE')
+        stats = sched.stats()['time_in_state']
+        self.assertEquals(stats['backups NEW']['count'], 1)
+        self.assertEquals(stats['backups NEW']['mean'], 3)
+        self.assertEquals(dict(stats['backups SAVING']['buckets'])[120], 1)
+
+
+class TestClientSchedule(ScheduleTestCase):
+
+    def setUp(self):
+        super(TestClientSchedule, self).setUp()
+        self._orig_urlopen = client.urlopen
+        self._orig_sleep = client.sleep
+        self.sleeps = []
+
+        def mock_sleep(seconds):
+            self.sleeps.append(seconds)
+            self.clock.sleep(seconds)
+        client.sleep = mock_sleep
+
+    def tearDown(self):
+        super(TestClientSchedule, self).tearDown()
+        client.urlopen = self._orig_urlopen
+        client.sleep = self._orig_sleep
+
+    def test_wait_on_status(self):
+        sched = schedule.PollSchedule(min_samples=1)
+        self.wait(sched, 60, size=1)
+        c = client.LunrClient('http://127.0.0.1:8080/v1.0',
+                              {'project_id': 'fake'}, poll_schedule=sched)
+        statuses = ['BUILDING', 'ACTIVE']
+        client.urlopen = lambda req, **kwargs: MockResponse(json.dumps(
+            {'id': 'vol1', 'status': statuses.pop(0)}))
+        resp = c.volumes.wait_on_status('vol1', 'ACTIVE', size=1)
+        self.assertEquals(resp.body['status'], 'ACTIVE')
+        self.assertEquals(self.sleeps, [60, 1])
+        self.assertEquals(
+            sched.stats()['durations']['volumes BUILDING->ACTIVE up to 1GB'],
+            {'samples': 2, 'p10': 60, 'p50': 61, 'p90': 61})
+
+
+if __name__ == "__main__":
+    unittest.main()
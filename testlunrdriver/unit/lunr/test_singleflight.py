@@ -0,0 +1,196 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import socket
+import unittest
+from urllib2 import URLError
+
+import eventlet
+
+from lunrdriver.lunr import client
+from lunrdriver.lunr.singleflight import SingleFlight
+from lunrdriver.lunr.timeouts import Deadline, DeadlineExceeded
+
+from testlunrdriver.unit import MockResponse
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_shared_result(self):
+        sf = SingleFlight()
+        calls = []
+
+        def func():
+            calls.append(1)
+            eventlet.sleep(0.01)
+            return len(calls)
+        pool = eventlet.GreenPool()
+        results = list(pool.imap(lambda i: sf.do('key', func), range(5)))
+        self.assertEquals(results, [1] * 5)
+        self.assertEquals(len(calls), 1)
+        stats = sf.stats()
+        self.assertEquals(stats['saved'], 4)
+        self.assertEquals(stats['requests'], 5)
+        self.assertEquals(stats['in_flight'], 0)
+        # once it's done the next call goes through
+        self.assertEquals(sf.do('key', func), 2)
+
+    def test_different_keys(self):
+        sf = SingleFlight()
+        pool = eventlet.GreenPool()
+
+        def func():
+            eventlet.sleep(0.01)
+        for key in ('a', 'b'):
+            pool.spawn(sf.do, key, func)
+        pool.waitall()
+        self.assertEquals(sf.stats()['saved'], 0)
+
+    def test_shared_error(self):
+        sf = SingleFlight()
+
+        def func():
+            eventlet.sleep(0.01)
+            raise ValueError('boom')
+        waiter = eventlet.spawn(sf.do, 'key', func)
+        eventlet.sleep(0)
+        self.assertRaises(ValueError, sf.do, 'key', func)
+        self.assertRaises(ValueError, waiter.wait)
+
+    def test_unshared_error(self):
+        sf = SingleFlight()
+        calls = []
+
+        def func():
+            calls.append(True)
+            eventlet.sleep(0.01)
+            if len(calls) == 1:
+                raise ValueError('mine')
+            return 'ok'
+        leader = eventlet.spawn(sf.do, 'key', func,
+                                shared=lambda e: str(e) != 'mine')
+        eventlet.sleep(0)
+        # the waiter makes the call itself
+        self.assertEquals(sf.do('key', func), 'ok')
+        self.assertRaises(ValueError, leader.wait)
+        self.assertEquals(len(calls), 2)
+
+    def test_waiter_deadline(self):
+        sf = SingleFlight()
+        leader = eventlet.spawn(sf.do, 'key', lambda: eventlet.sleep(1))
+        eventlet.sleep(0)
+        self.assertRaises(DeadlineExceeded, sf.do, 'key', lambda: None,
+                          deadline=Deadline(0.01))
+        leader.kill()
+
+    def test_killed_leader_hands_over(self):
+        sf = SingleFlight()
+        leader = eventlet.spawn(sf.do, 'key', lambda: eventlet.sleep(1))
+        eventlet.sleep(0)
+        waiter = eventlet.spawn(sf.do, 'key', lambda: 'mine')
+        eventlet.sleep(0)
+        leader.kill()
+        self.assertEquals(waiter.wait(), 'mine')
+
+
+class TestClientCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_urlopen = client.urlopen
+        self.single_flight = SingleFlight()
+        self.client = client.LunrClient('http://127.0.0.1:8080/v1.0',
+                                        {'project_id': 'fake'},
+                                        single_flight=self.single_flight)
+
+    def tearDown(self):
+        client.urlopen = self._orig_urlopen
+
+    def test_concurrent_gets(self):
+        urls = []
+
+        def mock_urlopen(req, **kwargs):
+            urls.append(req.get_full_url())
+            eventlet.sleep(0.01)
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        pool = eventlet.GreenPool()
+        resps = list(pool.imap(lambda i: self.client.volumes.get('vol1'),
+                               range(3)))
+        self.assertEquals(len(urls), 1)
+        self.assertEquals([r.body for r in resps], [{'id': 'vol1'}] * 3)
+        # each caller can scribble on their own body
+        self.assert_(resps[0].body is not resps[1].body)
+        self.assertEquals(self.single_flight.stats()['saved'], 2)
+
+    def test_writes_not_coalesced(self):
+        urls = []
+
+        def mock_urlopen(req, **kwargs):
+            urls.append(req.get_full_url())
+            eventlet.sleep(0.01)
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        pool = eventlet.GreenPool()
+        list(pool.imap(lambda i: self.client.volumes.create('vol1', size=1),
+                       range(3)))
+        self.assertEquals(len(urls), 3)
+
+    def test_shared_error(self):
+        def mock_urlopen(req, **kwargs):
+            eventlet.sleep(0.01)
+            raise URLError(socket.error(111, 'Connection refused'))
+        client.urlopen = mock_urlopen
+        waiter = eventlet.spawn(self.client.volumes.get, 'vol1')
+        eventlet.sleep(0)
+        self.assertRaises(client.LunrError, self.client.volumes.get, 'vol1')
+        self.assertRaises(client.LunrError, waiter.wait)
+        self.assertEquals(self.single_flight.stats()['saved'], 1)
+
+    def test_leader_deadline_not_shared(self):
+        urls = []
+
+        def mock_urlopen(req, timeout=None, **kwargs):
+            urls.append(req.get_full_url())
+            if timeout < 0.05:
+                eventlet.sleep(timeout)
+                raise URLError(socket.timeout('timed out'))
+            eventlet.sleep(0.05)
+            return MockResponse(json.dumps({'id': 'vol1'}))
+        client.urlopen = mock_urlopen
+        leader = eventlet.spawn(self.client.volumes.get, 'vol1',
+                                deadline=Deadline(0.01))
+        eventlet.sleep(0)
+        # the leader runs out of time, we still have plenty
+        resp = self.client.volumes.get('vol1', deadline=Deadline(5))
+        self.assertEquals(resp.body['id'], 'vol1')
+        self.assertRaises(client.LunrError, leader.wait)
+        self.assertEquals(len(urls), 2)
+
+    def test_waiter_deadline(self):
+        def mock_urlopen(req, **kwargs):
+            eventlet.sleep(1)
+        client.urlopen = mock_urlopen
+        leader = eventlet.spawn(self.client.volumes.get, 'vol1')
+        eventlet.sleep(0)
+        with self.assertRaises(client.LunrError) as manager:
+            self.client.volumes.get('vol1', deadline=Deadline(0.01))
+        self.assertEquals(manager.exception.code, 504)
+        leader.kill()
+
+
+if __name__ == "__main__":
+    unittest.main()
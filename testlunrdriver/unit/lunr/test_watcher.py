@@ -0,0 +1,143 @@
+# Copyright (c) 2011-2013 Rackspace US, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import unittest
+from StringIO import StringIO
+from urllib2 import HTTPError
+from urlparse import urlparse
+
+import eventlet
+
+from lunrdriver.lunr import client
+from lunrdriver.lunr.schedule import PollSchedule
+from lunrdriver.lunr.timeouts import Deadline
+from lunrdriver.lunr.watcher import StatusWatcher
+
+from testlunrdriver.unit import MockResponse
+
+
+class MockLunr(object):
+    """
+    Volumes that step through their statuses each time they're looked at.
+    """
+
+    def __init__(self, volumes):
+        self.volumes = volumes
+        self.paths = []
+
+    def status(self, _id):
+        statuses = self.volumes[_id]
+        if len(statuses) > 1:
+            return statuses.pop(0)
+        return statuses[0]
+
+    def __call__(self, req, **kwargs):
+        path = urlparse(req.get_full_url()).path
+        self.paths.append(path)
+        _id = path.rsplit('/', 1)[-1]
+        if _id == 'volumes':
+            body = [{'id': _id, 'status': self.status(_id)}
+                    for _id in sorted(self.volumes)]
+        elif _id in self.volumes:
+            body = {'id': _id, 'status': self.status(_id)}
+        else:
+            raise HTTPError(req.get_full_url(), 404, 'Not Found', {},
+                            StringIO('{}'))
+        return MockResponse(json.dumps(body))
+
+
+class TestStatusWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_urlopen = client.urlopen
+        self.watcher = StatusWatcher(interval=0.01)
+        self.client = client.LunrClient('http://127.0.0.1:8080/v1.0',
+                                        {'project_id': 'fake'},
+                                        watcher=self.watcher,
+                                        poll_schedule=PollSchedule(
+                                            initial=0.01, max_backoff=0.01))
+
+    def tearDown(self):
+        client.urlopen = self._orig_urlopen
+
+    def test_one_waiter_gets(self):
+        lunr = client.urlopen = MockLunr({'vol1': ['BUILDING', 'ACTIVE']})
+        resp = self.client.volumes.wait_on_status('vol1', 'ACTIVE')
+        self.assertEquals(resp.body['status'], 'ACTIVE')
+        self.assertEquals(lunr.paths, ['/v1.0/fake/volumes/vol1'] * 2)
+        self.assertEquals(self.watcher.stats(),
+                          {'waiting': 0, 'polls': 2, 'requests': 2})
+        # the poller quits once nobody is waiting
+        eventlet.sleep(0.05)
+        self.assertFalse(self.watcher.running)
+
+    def test_waiters_share_list(self):
+        volumes = dict(('vol%s' % i, ['BUILDING', 'BUILDING', 'ACTIVE'])
+                       for i in range(5))
+        lunr = client.urlopen = MockLunr(volumes)
+        pool = eventlet.GreenPool()
+        resps = list(pool.imap(
+            lambda _id: self.client.volumes.wait_on_status(_id, 'ACTIVE'),
+            sorted(volumes)))
+        self.assertEquals([r.body['id'] for r in resps], sorted(volumes))
+        self.assertEquals(lunr.paths, ['/v1.0/fake/volumes'] * 3)
+
+    def test_few_waiters_get(self):
+        volumes = dict(('vol%s' % i, ['BUILDING', 'ACTIVE'])
+                       for i in range(4))
+        lunr = client.urlopen = MockLunr(volumes)
+        pool = eventlet.GreenPool()
+        list(pool.imap(
+            lambda _id: self.client.volumes.wait_on_status(_id, 'ACTIVE'),
+            sorted(volumes)))
+        # cheaper than listing the whole project
+        self.assertEquals(sorted(lunr.paths), sorted(
+            ['/v1.0/fake/volumes/vol%s' % i for i in range(4)] * 2))
+
+    def test_missing_from_list(self):
+        self.watcher.list_threshold = 2
+        lunr = client.urlopen = MockLunr({'vol1': ['ACTIVE']})
+
+        def wait(_id):
+            try:
+                return self.client.volumes.wait_on_status(_id, 'ACTIVE')
+            except client.LunrError, e:
+                return e
+        pool = eventlet.GreenPool()
+        waiters = [pool.spawn(wait, _id) for _id in ('vol1', 'vol2')]
+        self.assertEquals(waiters[0].wait().body['id'], 'vol1')
+        self.assertEquals(waiters[1].wait().code, 404)
+        self.assertEquals(lunr.paths, ['/v1.0/fake/volumes',
+                                       '/v1.0/fake/volumes/vol2'])
+
+    def test_error_status(self):
+        client.urlopen = MockLunr({'vol1': ['BUILDING', 'ERROR']})
+        self.assertRaises(client.StatusError,
+                          self.client.volumes.wait_on_status, 'vol1',
+                          'ACTIVE')
+
+    def test_deadline(self):
+        client.urlopen = MockLunr({'vol1': ['BUILDING']})
+        with self.assertRaises(client.LunrError) as manager:
+            self.client.volumes.wait_on_status('vol1', 'ACTIVE',
+                                               deadline=Deadline(0.05))
+        self.assertEquals(manager.exception.code, 504)
+        self.assertEquals(self.watcher.stats()['waiting'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()